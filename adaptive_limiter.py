@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+import metrics
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+from startup import lazy_module
+asyncio = lazy_module('asyncio')
+aiohttp = lazy_module('aiohttp')
+
+BREAKER_CLOSED = '正常'
+BREAKER_OPEN = '熔断'
+BREAKER_HALF_OPEN = '试探'
+DEFAULT_HOST_SETTINGS = {'qt.gtimg.cn': {'initial': 50, 'maximum': 200}, 'push2his.eastmoney.com': {'initial': 32, 'maximum': 128}}
+EVENT_LOG_SIZE = 200
+_WAIT_STEP = 0.02
+
+class CircuitOpenError(Exception):
+    """主机处于熔断状态，请求没有发出"""
+
+class AdaptiveLimiter:
+    """单个主机的自适应并发限制（AIMD）+ 熔断器
+
+    请求成功且延迟正常时并发上限加性增长（每完成约一个上限数量的请求+1），
+    出错、超时或延迟超过 slow_latency 时乘性减小（同一个 decrease_interval 内只减一次，
+    避免一批同时失败的请求把上限直接压到最小）；
+    连续失败 breaker_failures 次后熔断 breaker_cooldown 秒，期间不发请求，
+    冷却结束后只放一个试探请求，成功才恢复。
+    不绑定事件循环，行情引擎线程和历史数据抓取可以共用同一个实例
+    """
+
+    def __init__(self, host, initial=16, minimum=1, maximum=200, slow_latency=3.0, decrease_factor=0.5, decrease_interval=1.0, breaker_failures=8, breaker_cooldown=30.0):
+        self.host = host
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.slow_latency = slow_latency
+        self.decrease_factor = decrease_factor
+        self.decrease_interval = decrease_interval
+        self.breaker_failures = breaker_failures
+        self.breaker_cooldown = breaker_cooldown
+        self.in_flight = 0
+        self.state = BREAKER_CLOSED
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.trip_count = 0
+        self.requests = 0
+        self.failures = 0
+        self.latency_ewma = None
+        self.error_rate_ewma = 0.0
+        self._last_decrease = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def _try_acquire(self, now):
+        """尝试占用一个并发名额
+        Returns:
+            float: 0表示成功；>0表示熔断中，需要等待的秒数；<0表示名额已满
+        """
+        with self._lock:
+            if self.state == BREAKER_OPEN:
+                if now < self.open_until:
+                    return self.open_until - now
+                self.state = BREAKER_HALF_OPEN
+                _record_event(self.host, '熔断冷却结束，开始试探')
+            if self.state == BREAKER_HALF_OPEN:
+                if self._probe_in_flight:
+                    return -1
+                self._probe_in_flight = True
+                self.in_flight += 1
+                return 0
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return 0
+            return -1
+
+    async def acquire(self, deadline=None):
+        """等待一个并发名额
+        Args:
+            deadline: time.monotonic() 的截止时间；熔断在截止前结束就等待，否则直接抛出 CircuitOpenError。
+                None 表示熔断时不等待
+        """
+        while True:
+            now = time.monotonic()
+            wait = self._try_acquire(now)
+            if wait == 0:
+                return
+            if wait > 0:
+                if deadline is None or now + wait >= deadline:
+                    raise CircuitOpenError(f'{self.host} 熔断中，{wait:.1f}秒后恢复')
+                await asyncio.sleep(wait)
+                continue
+            if deadline is not None and now >= deadline:
+                raise asyncio.TimeoutError()
+            await asyncio.sleep(_WAIT_STEP)
+
+    def release(self, ok, latency):
+        """请求结束后调用，根据结果调整并发上限和熔断状态
+        Args:
+            ok: 请求是否成功，None表示请求被取消（只归还名额，不计入统计）
+            latency: 请求耗时（秒）
+        """
+        now = time.monotonic()
+        with self._lock:
+            self.in_flight -= 1
+            if ok is None:
+                self._probe_in_flight = False
+                return
+            self.requests += 1
+            self.latency_ewma = latency if self.latency_ewma is None else self.latency_ewma * 0.9 + latency * 0.1
+            self.error_rate_ewma = self.error_rate_ewma * 0.9 + (0.0 if ok else 0.1)
+            probe = self.state == BREAKER_HALF_OPEN and self._probe_in_flight
+            if probe:
+                self._probe_in_flight = False
+            if ok:
+                self.consecutive_failures = 0
+                if probe:
+                    self.state = BREAKER_CLOSED
+                    self.limit = float(self.minimum)
+                    _record_event(self.host, '试探成功，恢复请求')
+                if latency <= self.slow_latency:
+                    self.limit = min(float(self.maximum), self.limit + 1.0 / max(self.limit, 1.0))
+                    return
+            else:
+                self.failures += 1
+                self.consecutive_failures += 1
+                if probe or self.consecutive_failures >= self.breaker_failures:
+                    if self.state != BREAKER_OPEN:
+                        self.state = BREAKER_OPEN
+                        self.open_until = now + self.breaker_cooldown
+                        self.trip_count += 1
+                        _record_event(self.host, f'连续失败{self.consecutive_failures}次，熔断{self.breaker_cooldown:.0f}秒')
+                    return
+            if now - self._last_decrease >= self.decrease_interval:
+                self._last_decrease = now
+                old_limit = int(self.limit)
+                self.limit = max(float(self.minimum), self.limit * self.decrease_factor)
+                if int(self.limit) != old_limit:
+                    _record_event(self.host, f"{('请求失败' if not ok else '延迟过高')}，并发上限 {old_limit} -> {int(self.limit)}")
+
+    def status(self):
+        with self._lock:
+            return {'并发上限': int(self.limit), '进行中': self.in_flight, '状态': self.state, '平均延迟': round(self.latency_ewma, 3) if self.latency_ewma is not None else None, '错误率': round(self.error_rate_ewma, 3), '请求数': self.requests, '失败数': self.failures, '熔断次数': self.trip_count}
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+_events = deque(maxlen=EVENT_LOG_SIZE)
+
+def _record_event(host, message):
+    _events.append((time.time(), host, message))
+    print(f'[限流] {host}: {message}')
+
+def get_limiter(host):
+    """获取（必要时创建）某个主机的限流器"""
+    with _limiters_lock:
+        limiter = _limiters.get(host)
+        if limiter is None:
+            limiter = AdaptiveLimiter(host, **DEFAULT_HOST_SETTINGS.get(host, {}))
+            _limiters[host] = limiter
+        return limiter
+
+def get_limiter_for_url(url):
+    return get_limiter(urlsplit(url).hostname or '')
+
+def get_status():
+    """所有主机的限流状态 {主机: {...}}"""
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.host: limiter.status() for limiter in limiters}
+
+def get_recent_events(limit=20):
+    """最近的限流/熔断事件，新的在前"""
+    events = list(_events)[-limit:]
+    return [{'时间': time.strftime('%H:%M:%S', time.localtime(t)), '主机': host, '事件': message} for t, host, message in reversed(events)]
+
+async def fetch_text(session, url, timeout_seconds=10, deadline=None):
+    """经过主机的自适应限流器发出GET请求并返回文本
+    HTTP错误状态、超时和网络异常都会记为失败，用于调整并发上限和触发熔断
+    Args:
+        deadline: time.monotonic() 的截止时间，熔断在截止前结束会等待，否则抛出 CircuitOpenError
+    """
+    limiter = get_limiter_for_url(url)
+    await limiter.acquire(deadline)
+    start = time.monotonic()
+    ok = None
+    try:
+        async with session.get(url, timeout=aiohttp.ClientTimeout(total=timeout_seconds)) as response:
+            response.raise_for_status()
+            content = await response.text()
+        ok = True
+        return content
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        ok = False
+        raise
+    finally:
+        latency = time.monotonic() - start
+        limiter.release(ok, latency)
+        if ok is not None:
+            metrics.observe(f'请求_{limiter.host}', latency)
+            metrics.increment(f'请求_{limiter.host}')
+            if not ok:
+                metrics.increment(f'请求失败_{limiter.host}')
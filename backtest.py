@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+"""表格筛选条件的历史回测
+
+逐个回放过去的交易日：把每只股票的K线截到当天收盘，按 merge_all_data 的规则算出当天收盘时的
+涨停统计、阳天数、前N天阳天数、昨日涨幅、30/60日最高价等字段，套用和页面表格相同的筛选条件，
+统计每天的命中股票以及之后N个交易日的收益。各天之间互不依赖，用进程池并行计算。
+
+每天只在页面当天会显示的股票里筛选：股票数据文件夹里当天及之前的xlsx从新到旧排，
+和 get_folder_data 一样取第 离涨停最少天数 个开始的 离涨停最多天数 个文件，基准收益也只算这些股票。
+
+历史数据仓库只保留最近 HISTORY_WINDOW 根K线，不够回放一整年，所以回测用单独的K线文件
+（历史数据文件夹/回测K线.bin，格式同 history_file），第一次运行时抓取，之后每天最多更新一次。
+
+用法:
+    python backtest.py --days 250 --filter 连续涨停数至少=2 --filter 前N天阳天数=3
+    python backtest.py --days 120 --workers 4 --json
+"""
+import argparse
+import concurrent.futures
+import json
+import os
+import time
+from datetime import datetime
+import numpy as np
+import get_xls_data
+import history_file
+import history_matrix
+import trading_calendar
+
+BACKTEST_FILENAME = '回测K线.bin'
+DEFAULT_DAYS = 250
+DEFAULT_HORIZONS = (1, 3, 5, 10)
+DEFAULT_FILTERS = {'离涨停最少天数': 3, '离涨停最多天数': 21}
+# 筛选条件与页面表格的对应关系，值为None表示不启用
+SUPPORTED_FILTERS = {'离涨停最少天数': '.preview', '离涨停最多天数': '.back', '阳天数': '.sun_day', '涨幅下限': '.up_to', '离30日新高比例': '.break_30_input', '连续涨停数至少': '.limit_up_gte2_input', '连续涨停数等于': '.limit_up_2_input', '总涨停数': '.total-limit-up-input', '昨天阴': '.yesterday-negative-check', '前N天阳天数': '.prev-days-positive-input'}
+# 依赖盘中数据（今日最高/最低价、创新高次数等）的筛选条件无法用日K线回放
+UNSUPPORTED_FILTERS = ('今日最高', '创新高次数', '今日最低', '创新低次数', '曾经最高涨幅', '30日新高次数', '突破60日新高')
+
+def get_backtest_file_path():
+    return os.path.join(get_xls_data.get_history_data_folder(), BACKTEST_FILENAME)
+
+def normalize_filters(filters):
+    """合并默认筛选条件并检查名称
+    Raises:
+        ValueError: 条件名称不认识，或者是无法回测的盘中条件
+    """
+    result = dict(DEFAULT_FILTERS)
+    for key, value in (filters or {}).items():
+        if key in UNSUPPORTED_FILTERS:
+            raise ValueError(f'筛选条件 {key} 依赖盘中数据，无法用日K线回测')
+        if key not in SUPPORTED_FILTERS:
+            raise ValueError(f"未知的筛选条件: {key}，可用: {'、'.join(SUPPORTED_FILTERS)}")
+        result[key] = value
+    return result
+
+def load_workbook_universes(today=None):
+    """读取股票数据文件夹里每个xlsx的股票代码
+    Returns:
+        list: [(日期整数, 代码集合)]，从新到旧
+    Raises:
+        ValueError: 没有股票数据文件夹或者里面没有xlsx
+    """
+    try:
+        files = get_xls_data.list_stock_data_files()
+    except OSError:
+        files = []
+    if not files:
+        raise ValueError('股票数据文件夹里没有xlsx，无法确定回测的股票范围')
+    universes = []
+    for data_file in files:
+        try:
+            rows_list = get_xls_data.load_workbook_rows(os.path.join(get_xls_data.get_stock_data_folder(), data_file))
+        except Exception as e:
+            print(f'警告：无法读取文件 {data_file}，错误：{e}')
+            continue
+        date_str = trading_calendar.concept_date_to_iso(get_xls_data.stock_data_file_date(data_file), today)
+        universes.append((history_matrix.date_to_int(date_str), frozenset(row[0] for row in rows_list)))
+    universes.sort(key=lambda item: item[0], reverse=True)
+    return universes
+
+def day_universe(universes, date_int, strat_index, count):
+    """date_int 那天页面显示的股票代码：当天及之前的xlsx从新到旧排，取第 strat_index 个开始的 count 个文件"""
+    codes = set()
+    files = [day_codes for day, day_codes in universes if day <= date_int]
+    for day_codes in files[strat_index:strat_index + count]:
+        codes |= day_codes
+    return codes
+
+def prepare_backtest_file(stock_codes=None, days=DEFAULT_DAYS, refresh=False, progress_callback=None):
+    """准备回测用的K线文件，今天已经抓过且天数足够时直接使用
+    Args:
+        stock_codes: 回测的股票范围，None表示股票数据文件夹里全部xlsx的股票
+        days: 要回放的交易日数，会额外抓取 HISTORY_WINDOW 根K线用于计算第一天的统计
+        refresh: 强制重新抓取
+    Returns:
+        str: K线文件路径
+    """
+    file_path = get_backtest_file_path()
+    today_date = datetime.now().strftime('%Y-%m-%d')
+    limit = days + get_xls_data.HISTORY_WINDOW
+    header = history_file.read_history_header(file_path)
+    if not refresh and header and header['同步日期'] == today_date and header['天数'] >= limit:
+        return file_path
+    if stock_codes is None:
+        stock_codes = sorted(set().union(*(day_codes for _, day_codes in load_workbook_universes())))
+    if not stock_codes:
+        raise ValueError('股票数据文件夹里没有股票，无法回测')
+    print(f'抓取回测K线: {len(stock_codes)} 个股票，每只 {limit} 根...')
+    start = time.time()
+    results = get_xls_data.crawl_history([(stock_code, limit) for stock_code in stock_codes], progress_callback=progress_callback, deadline_seconds=max(get_xls_data.HISTORY_CRAWL_DEADLINE, len(stock_codes) / 20))
+    stocks = {stock_code: prices for stock_code, prices in results.items() if prices}
+    history_file.write_history_file(file_path, stocks, today_date)
+    print(f'回测K线已保存: {file_path} (成功 {len(stocks)}/{len(stock_codes)} 个，用时 {time.time() - start:.1f} 秒)')
+    return file_path
+
+def build_kline_index(codes, closes):
+    """为按天截取K线预先建立索引（每个K线文件只需要算一次）
+    Returns:
+        tuple: (counts[N, D] 每只股票截止到每一列（含）的K线根数, columns[N, K] 每只股票第k根K线所在的列, 严格涨停阈值向量)
+    """
+    strict_thresholds = np.array([history_matrix.get_limit_threshold(stock_code) for stock_code in codes])
+    valid = ~np.isnan(closes)
+    counts = valid.cumsum(axis=1, dtype=np.int32)
+    columns = np.zeros((closes.shape[0], max(1, closes.shape[1])), dtype=np.int32)
+    rows, cols = np.nonzero(valid)
+    columns[rows, counts[rows, cols] - 1] = cols
+    return (counts, columns, strict_thresholds)
+
+def _align_day(closes, changes, date_ints, column, window, kline_index):
+    """把截止到第column列（含）的K线按股票右对齐，每只股票只保留最近window根（跳过停牌的空缺）
+    Returns:
+        tuple: (closes[N, window], changes[N, window], dates[N, window])
+    """
+    counts, columns, _ = kline_index
+    positions = counts[:, column][:, None] - window + np.arange(window)
+    present = positions >= 0
+    rows = np.arange(closes.shape[0])[:, None]
+    source = columns[rows, np.maximum(positions, 0)]
+    aligned_closes = np.where(present, closes[rows, source], np.nan)
+    aligned_changes = np.where(present, changes[rows, source], np.nan)
+    aligned_dates = np.where(present, date_ints[source], 0).astype(np.int32)
+    return (aligned_closes, aligned_changes, aligned_dates)
+
+def compute_day_fields(codes, closes, changes, date_ints, column, window=None, kline_index=None):
+    """计算第column个交易日收盘时每只股票的合并字段（与 merge_all_data 收盘后的结果一致）
+    收盘后 现价 就是当天收盘价，所以 阳天数 等于以当天结尾的收盘价连续上涨天数；
+    今日最高/最低价、换手率等盘中字段日K线里没有，不参与回测
+    Returns:
+        dict: 字段名 -> 长度为股票数的向量，另有 '有效' 表示当天有K线且至少有两根K线的股票
+    """
+    window = window or get_xls_data.HISTORY_WINDOW
+    if kline_index is None:
+        kline_index = build_kline_index(codes, closes)
+    aligned_closes, aligned_changes, aligned_dates = _align_day(closes, changes, date_ints, column, window, kline_index)
+    matrix = history_matrix.HistoryMatrix.from_arrays(codes, aligned_closes, aligned_changes, aligned_dates, aligned_closes[:, -2], kline_index[2])
+    strict = history_matrix.compute_limit_up_stats(matrix, matrix.limit_up_mask(matrix.strict_thresholds))
+    loose = history_matrix.compute_limit_up_stats(matrix, matrix.limit_up_mask(matrix.loose_thresholds))
+    trend = history_matrix.compute_trend_stats(matrix)
+    active = ~np.isnan(closes[:, column]) & (matrix.lengths >= 2)
+    price = aligned_closes[:, -1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        max_30d = _nanmax(aligned_closes[:, -31:-1])
+        max_60d = _nanmax(aligned_closes[:, -61:-1])
+        percent_to_30d = np.where(max_30d > 0, (price - max_30d) / max_30d * 100, 0.0)
+        percent_to_60d = np.where(max_60d > 0, (price - max_60d) / max_60d * 100, 0.0)
+    fields = {'有效': active, '现价': price, '涨幅': aligned_changes[:, -1], '昨日收盘价': aligned_closes[:, -2], '昨日涨幅': aligned_changes[:, -2], '30日最高价': max_30d, '60日最高价': max_60d, '离30日新高%': percent_to_30d, '离60日新高%': percent_to_60d, '阳天数': trend['上涨天数_最后'], '前N天阳天数': trend['前N天阳天数'], '使用严格版': matrix.strict_thresholds > history_matrix.LOOSE_LIMIT_PCT}
+    for suffix, stats in (('_严格', strict), ('_宽松', loose)):
+        streak = stats['最大连续涨停数']
+        fields['连续涨停数' + suffix] = streak
+        fields['全部涨停天数' + suffix] = stats['全部涨停天数']
+        fields['总涨停数_天数' + suffix] = np.maximum(0, stats['全部涨停天数'] - streak)
+        fields['离涨停多少天' + suffix] = stats['离最新日期天数']
+    return fields
+
+def _nanmax(values):
+    """按行取最大值，整行都是NaN时为0"""
+    filled = np.where(np.isnan(values), -np.inf, values)
+    result = filled.max(axis=1) if values.shape[1] else np.full(values.shape[0], -np.inf)
+    return np.where(np.isinf(result), 0.0, result)
+
+def apply_filters(fields, filters):
+    """按页面表格 fillStockTable 的规则筛选
+    3开头和68开头用严格版（19.8%）的涨停统计，其他用宽松版（9.8%）
+    Returns:
+        numpy.ndarray: 命中的布尔向量
+    """
+    use_strict = fields['使用严格版']
+    days = np.where(use_strict, fields['离涨停多少天_严格'], fields['离涨停多少天_宽松'])
+    consecutive = np.where(use_strict, fields['连续涨停数_严格'], fields['连续涨停数_宽松'])
+    has_limit = days >= 0
+    change = fields['涨幅']
+    mask = fields['有效'] & has_limit
+    mask &= (days >= (filters.get('离涨停最少天数') or 3)) & (days <= (filters.get('离涨停最多天数') or 21))
+    with np.errstate(invalid='ignore'):
+        if filters.get('阳天数') is not None:
+            mask &= fields['阳天数'] == filters['阳天数']
+            if filters['阳天数'] > 0:
+                mask &= change > 0
+        if filters.get('涨幅下限') is not None:
+            mask &= change >= filters['涨幅下限']
+        if filters.get('离30日新高比例') is not None:
+            max_30d = fields['30日最高价']
+            ratio = np.where(max_30d > 0, fields['现价'] / np.where(max_30d > 0, max_30d, 1) * 100, np.inf)
+            mask &= ratio >= filters['离30日新高比例']
+        if filters.get('连续涨停数至少') is not None:
+            if filters['连续涨停数至少'] == 1:
+                mask &= has_limit
+            else:
+                mask &= consecutive >= filters['连续涨停数至少']
+        if filters.get('连续涨停数等于') is not None:
+            streak = fields['连续涨停数_严格'] if filters['连续涨停数等于'] == 1 else fields['连续涨停数_宽松']
+            mask &= streak == filters['连续涨停数等于']
+        if filters.get('总涨停数') is not None:
+            all_limit_days = np.where(use_strict, fields['全部涨停天数_严格'], fields['全部涨停天数_宽松'])
+            total_days = np.where(use_strict, fields['总涨停数_天数_严格'], fields['总涨停数_天数_宽松'])
+            single_day = (consecutive == 0) & has_limit
+            mask &= np.where(single_day, np.maximum(0, all_limit_days - 1), total_days) == filters['总涨停数']
+        if filters.get('昨天阴'):
+            mask &= fields['昨日涨幅'] < 0
+        if filters.get('前N天阳天数') is not None:
+            mask &= fields['前N天阳天数'] >= filters['前N天阳天数']
+    return mask
+
+def forward_returns(closes, column, horizon):
+    """第column天收盘买入、horizon个交易日后收盘卖出的收益（%），停牌或超出数据范围为NaN"""
+    if column + horizon >= closes.shape[1]:
+        return np.full(closes.shape[0], np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (closes[:, column + horizon] / closes[:, column] - 1) * 100
+
+def _mean(values):
+    values = values[~np.isnan(values)]
+    return round(float(values.mean()), 3) if len(values) else None
+
+def backtest_day(codes, closes, changes, date_ints, column, filters, horizons, kline_index=None, universe=None):
+    """回放一个交易日
+    Args:
+        universe: 当天参与回测的股票（布尔向量），None表示K线文件里的全部股票；命中和基准收益都只在这些股票里算
+    Returns:
+        dict: {'日期', '股票数', '命中数', '命中': [{'代码', '涨幅', 'N日收益'...}], '平均收益': {N日: %}, '基准收益': {N日: %}}
+    """
+    fields = compute_day_fields(codes, closes, changes, date_ints, column, kline_index=kline_index)
+    active = fields['有效'] if universe is None else fields['有效'] & universe
+    hits = np.flatnonzero(apply_filters(fields, filters) & active)
+    returns = {f'{h}日': forward_returns(closes, column, h) for h in horizons}
+    hit_rows = []
+    for i in hits.tolist():
+        row = {'代码': codes[i], '涨幅': round(float(fields['涨幅'][i]), 2)}
+        for key, values in returns.items():
+            row[key + '收益'] = None if np.isnan(values[i]) else round(float(values[i]), 2)
+        hit_rows.append(row)
+    return {'日期': history_matrix.int_to_date(date_ints[column]), '股票数': int(active.sum()), '命中数': len(hits), '命中': hit_rows, '平均收益': {key: _mean(values[hits]) for key, values in returns.items()}, '基准收益': {key: _mean(values[active]) for key, values in returns.items()}}
+
+_worker_state = {}
+
+def _init_worker(file_path, filters, horizons, universes, stock_codes):
+    """进程池初始化：每个进程自己mmap打开K线文件，不需要把矩阵序列化传过去"""
+    hf = history_file.HistoryFile(file_path)
+    _worker_state.update({'file': hf, 'kline_index': build_kline_index(hf.codes, hf.closes), 'filters': filters, 'horizons': horizons, 'universes': universes, 'stock_codes': None if stock_codes is None else set(stock_codes)})
+
+def _column_universe(hf, column):
+    """第column天参与回测的股票：当天的xlsx股票范围，传了 stock_codes 时再取交集"""
+    filters = _worker_state['filters']
+    codes = day_universe(_worker_state['universes'], hf.date_ints[column], filters['离涨停最少天数'], filters['离涨停最多天数'])
+    if _worker_state['stock_codes'] is not None:
+        codes &= _worker_state['stock_codes']
+    return np.array([stock_code in codes for stock_code in hf.codes], dtype=bool)
+
+def _run_columns(columns):
+    hf = _worker_state['file']
+    return [backtest_day(hf.codes, hf.closes, hf.changes, hf.date_ints, column, _worker_state['filters'], _worker_state['horizons'], _worker_state['kline_index'], _column_universe(hf, column)) for column in columns]
+
+def summarize(day_results, horizons):
+    """汇总每天的结果：每个持有期的命中样本数、平均收益、胜率和同期全部股票的平均收益"""
+    summary = {'回测天数': len(day_results), '有命中的天数': sum((1 for day in day_results if day['命中数'])), '命中总数': sum((day['命中数'] for day in day_results)), '持有期': {}}
+    for h in horizons:
+        key = f'{h}日'
+        values = np.array([row[key + '收益'] for day in day_results for row in day['命中'] if row[key + '收益'] is not None], dtype=float)
+        baselines = np.array([day['基准收益'][key] for day in day_results if day['基准收益'][key] is not None], dtype=float)
+        summary['持有期'][key] = {'样本数': len(values), '平均收益%': round(float(values.mean()), 3) if len(values) else None, '中位数收益%': round(float(np.median(values)), 3) if len(values) else None, '胜率%': round(float((values > 0).mean() * 100), 1) if len(values) else None, '基准平均收益%': round(float(baselines.mean()), 3) if len(baselines) else None}
+    return summary
+
+def run_backtest(filters=None, days=DEFAULT_DAYS, horizons=DEFAULT_HORIZONS, workers=None, file_path=None, stock_codes=None, refresh=False):
+    """回测筛选条件
+    Args:
+        filters: 筛选条件 {名称: 值}，名称见 SUPPORTED_FILTERS，未给出的用 DEFAULT_FILTERS
+        days: 回放最近多少个交易日
+        horizons: 计算收益的持有天数
+        workers: 进程数，None表示CPU核数，1表示在当前进程里顺序计算
+        file_path: 使用已有的K线文件（history_file格式），None表示自动准备 回测K线.bin
+        stock_codes: 只回测这些股票（在每天的xlsx股票范围里再取交集）
+    Returns:
+        dict: {'筛选条件', '汇总', '每日': [...], '用时秒'}
+    """
+    filters = normalize_filters(filters)
+    horizons = tuple(sorted(set(int(h) for h in horizons)))
+    start = time.time()
+    universes = load_workbook_universes()
+    if file_path is None:
+        wanted = set().union(*(day_codes for _, day_codes in universes))
+        if stock_codes is not None:
+            wanted &= set(stock_codes)
+        file_path = prepare_backtest_file(sorted(wanted), days, refresh)
+    with history_file.HistoryFile(file_path) as hf:
+        n_dates = len(hf.dates)
+    first_column = max(1, n_dates - days)
+    columns = list(range(first_column, n_dates))
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(columns) <= 1:
+        _init_worker(file_path, filters, horizons, universes, stock_codes)
+        try:
+            day_results = _run_columns(columns)
+        finally:
+            _worker_state.pop('file').close()
+    else:
+        chunk_size = max(1, len(columns) // (workers * 4))
+        chunks = [columns[i:i + chunk_size] for i in range(0, len(columns), chunk_size)]
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(file_path, filters, horizons, universes, stock_codes)) as pool:
+            day_results = [day for chunk_result in pool.map(_run_columns, chunks) for day in chunk_result]
+    elapsed = time.time() - start
+    print(f'回测完成: {len(columns)} 个交易日，用时 {elapsed:.2f} 秒')
+    return {'筛选条件': filters, '汇总': summarize(day_results, horizons), '每日': day_results, '用时秒': round(elapsed, 2)}
+
+def parse_filter_args(items):
+    """把 ['连续涨停数至少=2', '昨天阴=1'] 解析为筛选条件字典"""
+    filters = {}
+    for item in items or []:
+        key, _, value = item.partition('=')
+        key = key.strip()
+        if key == '昨天阴':
+            filters[key] = value.strip() not in ('', '0', 'false', 'False')
+        elif key in ('涨幅下限', '离30日新高比例'):
+            filters[key] = float(value)
+        else:
+            filters[key] = int(value)
+    return filters
+
+def main():
+    parser = argparse.ArgumentParser(description='表格筛选条件的历史回测')
+    parser.add_argument('--days', type=int, default=DEFAULT_DAYS, help='回放最近多少个交易日')
+    parser.add_argument('--horizons', type=int, nargs='+', default=list(DEFAULT_HORIZONS), help='持有天数')
+    parser.add_argument('--filter', action='append', help=f"筛选条件，如 连续涨停数至少=2，可用: {'、'.join(SUPPORTED_FILTERS)}")
+    parser.add_argument('--workers', type=int, default=None, help='进程数，默认CPU核数')
+    parser.add_argument('--file', help='使用指定的K线文件（history_file格式）')
+    parser.add_argument('--refresh', action='store_true', help='重新抓取回测K线')
+    parser.add_argument('--json', action='store_true', help='输出完整JSON')
+    args = parser.parse_args()
+    try:
+        result = run_backtest(parse_filter_args(args.filter), args.days, args.horizons, args.workers, args.file, refresh=args.refresh)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        return
+    summary = result['汇总']
+    print(f"筛选条件: {result['筛选条件']}")
+    print(f"回测 {summary['回测天数']} 天，{summary['有命中的天数']} 天有命中，共命中 {summary['命中总数']} 次")
+    for key, stats in summary['持有期'].items():
+        print(f"  持有{key}: 样本 {stats['样本数']}，平均 {stats['平均收益%']}%，中位数 {stats['中位数收益%']}%，胜率 {stats['胜率%']}%，基准 {stats['基准平均收益%']}%")
+
+if __name__ == '__main__':
+    main()
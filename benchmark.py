@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""端到端延迟压测
+
+在本地启动 mock_server 模拟行情服务器，生成合成的股票数据xlsx和行业表，
+然后按 抓取实时行情 → 分级 → 合并 → 序列化推送数据 的完整流程跑若干轮，
+统计吞吐量、每轮延迟的p50/p95/p99和峰值内存。每个股票数量在独立的子进程里运行，峰值内存互不影响。
+--compute-worker 把合并放到计算子进程里（见 compute_worker），可以和不加时对比合并阶段的耗时。
+--startup 对比延迟导入+后台预热和原来的启动方式（THREE_SUN_EAGER_STARTUP=1）从进程启动到可以创建窗口、到数据预热完成的耗时。
+
+用法:
+    python benchmark.py
+    python benchmark.py --sizes 500 2000 5000 --ticks 20 --latency 0.03 --error-rate 0.01
+    python benchmark.py --sizes 5000 --compute-worker
+    python benchmark.py --startup --sizes 5000
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+STAGES = ['抓取', '分级', '合并', '序列化']
+
+def percentile(values, q):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+def build_workspace(folder, universe, file_count, seed=1):
+    """生成压测用的数据目录：股票数据/*.xlsx（每只股票出现在3个文件里）和 Table(1).xls 行业表"""
+    from openpyxl import Workbook
+    rnd = random.Random(seed)
+    stock_folder = os.path.join(folder, '股票数据')
+    os.makedirs(stock_folder, exist_ok=True)
+    concepts = [f'概念{i}' for i in range(40)]
+    files = [[] for _ in range(file_count)]
+    for stock_code in universe:
+        for index in rnd.sample(range(file_count), min(3, file_count)):
+            files[index].append(stock_code)
+    for index, codes in enumerate(files):
+        wb = Workbook()
+        ws = wb.active
+        ws.append(['代码', '名称', '涨幅', '概念', '原因', '备注'])
+        for stock_code in codes:
+            ws.append([stock_code, f'模拟{stock_code}', 10.0, '+'.join(rnd.sample(concepts, 2)), '-', '-'])
+        month, day = divmod(1231 - index, 100)
+        wb.save(os.path.join(stock_folder, f'涨停{month:02d}{max(day, 1):02d}.xlsx'))
+    with open(os.path.join(folder, 'Table(1).xls'), 'w', encoding='gbk') as f:
+        f.write('代码\t名称\t行业\n')
+        for stock_code in universe:
+            f.write(f'{stock_code}\t模拟{stock_code}\t行业{int(stock_code) % 30}\n')
+
+def peak_memory_mb():
+    """进程的峰值常驻内存（MB），没有resource模块（Windows）时用tracemalloc的峰值"""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+    import tracemalloc
+    return tracemalloc.get_traced_memory()[1] / 1024 / 1024
+
+def run_size(size, ticks, file_count, config, use_compute_worker=False):
+    """在当前进程里跑一个股票数量的压测，返回结果字典"""
+    if resource is None:
+        import tracemalloc
+        tracemalloc.start()
+    from mock_server import MockMarket, MockServer, make_universe
+    universe = make_universe(size)
+    workspace = tempfile.mkdtemp(prefix='three_sun_bench_')
+    server = None
+    try:
+        build_workspace(workspace, universe, file_count + 1)
+        server = MockServer(port=0, config=config, market=MockMarket()).start()
+        os.environ.update(server.endpoint_env())
+        os.environ['THREE_SUN_DATA_DIR'] = workspace
+        import get_xls_data
+        import main
+        strat_index = 1
+        with open(os.devnull, 'w', encoding='utf-8') as devnull, contextlib.redirect_stdout(devnull):
+            api = main.Api()
+            api.start_warm_up(background=False)
+            if use_compute_worker:
+                api.start_compute_worker()
+            start = time.perf_counter()
+            api.get_history_data(strat_index=strat_index, count=file_count, show_progress=False)
+            history_seconds = time.perf_counter() - start
+            api.concept_data = get_xls_data.get_folder_data(strat_index=strat_index, count=file_count)
+            top_codes = universe[:50]
+            high_codes = []
+            tick_seconds = []
+            stage_seconds = {stage: [] for stage in STAGES}
+            payload_bytes = 0
+            for _ in range(ticks):
+                t0 = time.perf_counter()
+                api.real_time_data = get_xls_data.get_real_time_data(strat_index=strat_index, count=file_count, show_progress=False, top_priority_codes=top_codes, high_priority_codes=high_codes)
+                api.check_breakthrough()
+                t1 = time.perf_counter()
+                high_codes = api.classify_priority_stocks(strat_index=strat_index, count=file_count)['high_priority']
+                t2 = time.perf_counter()
+                api.merge_all_data(min_days=3, max_days=file_count)
+                snapshot = api._publish_snapshot()
+                t3 = time.perf_counter()
+                payload = api._build_push_payload(snapshot)
+                payload_bytes = len(json.dumps(payload, ensure_ascii=False).encode('utf-8'))
+                t4 = time.perf_counter()
+                for stage, seconds in zip(STAGES, (t1 - t0, t2 - t1, t3 - t2, t4 - t3)):
+                    stage_seconds[stage].append(seconds)
+                tick_seconds.append(t4 - t0)
+            api.stop_compute_worker()
+    finally:
+        if server is not None:
+            server.stop()
+        # 生成的xlsx和历史数据仓库有几千个文件，跑完就删掉
+        shutil.rmtree(workspace, ignore_errors=True)
+    mean_tick = sum(tick_seconds) / len(tick_seconds)
+    return {'股票数': size, '轮数': ticks, '实时行情数': len(api.real_time_data), '历史抓取秒': round(history_seconds, 3), '吞吐量(股/秒)': round(size / mean_tick, 1), 'p50毫秒': round(percentile(tick_seconds, 0.5) * 1000, 1), 'p95毫秒': round(percentile(tick_seconds, 0.95) * 1000, 1), 'p99毫秒': round(percentile(tick_seconds, 0.99) * 1000, 1), '各阶段平均毫秒': {stage: round(sum(values) / len(values) * 1000, 1) for stage, values in stage_seconds.items()}, '最后一次推送KB': payload_bytes // 1024, '峰值内存MB': round(peak_memory_mb(), 1), '模拟服务器请求数': server.requests}
+
+def build_startup_workspace(size, file_count):
+    """启动耗时测试用的数据目录：股票数据xlsx、行业表和今天已同步的历史数据仓库"""
+    from mock_server import MockMarket, make_universe
+    import history_file
+    universe = make_universe(size)
+    workspace = tempfile.mkdtemp(prefix='three_sun_startup_')
+    build_workspace(workspace, universe, file_count + 4)
+    market = MockMarket(days=61)
+    stocks = {stock_code: [{'日期': date, '收盘价': close, '涨幅': change} for date, close, change in market.klines(stock_code)] for stock_code in universe}
+    history_folder = os.path.join(workspace, '历史数据文件夹')
+    os.makedirs(history_folder, exist_ok=True)
+    history_file.write_history_file(os.path.join(history_folder, '历史数据仓库.bin'), stocks, time.strftime('%Y-%m-%d'))
+    return workspace
+
+def run_startup_once():
+    """在当前进程里模拟一次启动（不创建真正的窗口），返回各阶段距进程启动的毫秒数"""
+    import startup
+    with open(os.devnull, 'w', encoding='utf-8') as devnull, contextlib.redirect_stdout(devnull):
+        import main
+        startup.mark('模块导入完成')
+        api = main.Api()
+        api.start_warm_up(background=not startup.EAGER_STARTUP)
+        startup.mark('可以创建窗口')
+        api.warm_up.wait()
+    return startup.startup_timings()
+
+def run_startup(size, file_count, runs=5):
+    """分别用两种启动方式各跑runs次（先各跑一次不计时，生成xlsx和行业表的缓存），返回每种方式各阶段的中位数"""
+    workspace = build_startup_workspace(size, file_count)
+    results = {}
+    try:
+        for label, eager in (('原启动方式', '1'), ('延迟导入+后台预热', '0')):
+            env = dict(os.environ, THREE_SUN_DATA_DIR=workspace, THREE_SUN_EAGER_STARTUP=eager)
+            samples = []
+            for attempt in range(runs + 1):
+                proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--startup-single'], env=env, capture_output=True, text=True, encoding='utf-8')
+                lines = [line for line in proc.stdout.splitlines() if line.startswith('{')]
+                if proc.returncode != 0 or not lines:
+                    raise RuntimeError(f'启动测试失败:\n{proc.stderr[-2000:]}')
+                if attempt:
+                    samples.append(json.loads(lines[-1]))
+            results[label] = {stage: round(percentile([sample[stage] for sample in samples], 0.5), 1) for stage in samples[0]}
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+    return results
+
+def print_report(results):
+    print(f"{'股票数':>6} {'历史抓取s':>9} {'吞吐(股/s)':>10} {'p50ms':>8} {'p95ms':>8} {'p99ms':>8} {'峰值MB':>8}  各阶段平均ms")
+    for r in results:
+        stages = ' '.join((f'{stage}{ms}' for stage, ms in r['各阶段平均毫秒'].items()))
+        print(f"{r['股票数']:>6} {r['历史抓取秒']:>9} {r['吞吐量(股/秒)']:>10} {r['p50毫秒']:>8} {r['p95毫秒']:>8} {r['p99毫秒']:>8} {r['峰值内存MB']:>8}  {stages}")
+
+def main():
+    parser = argparse.ArgumentParser(description='端到端延迟压测（使用本地模拟行情服务器）')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[500, 2000, 5000], help='股票数量')
+    parser.add_argument('--ticks', type=int, default=20, help='每个股票数量跑多少轮')
+    parser.add_argument('--files', type=int, default=21, help='股票数据xlsx文件数（即回看天数）')
+    parser.add_argument('--latency', type=float, default=0.03)
+    parser.add_argument('--jitter', type=float, default=0.02)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--slow-rate', type=float, default=0.0)
+    parser.add_argument('--slow-latency', type=float, default=3.0)
+    parser.add_argument('--max-rps', type=int, default=0)
+    parser.add_argument('--compute-worker', action='store_true', help='在计算子进程里合并')
+    parser.add_argument('--json', action='store_true', help='输出JSON而不是表格')
+    parser.add_argument('--startup', action='store_true', help='测试启动耗时（用--sizes的第一个值作为股票数）')
+    parser.add_argument('--single', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--startup-single', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.startup_single:
+        print(json.dumps(run_startup_once(), ensure_ascii=False))
+        return
+    if args.startup:
+        results = run_startup(args.sizes[0], args.files)
+        if args.json:
+            print(json.dumps(results, ensure_ascii=False, indent=2))
+            return
+        for label, stages in results.items():
+            print(f"{label}: {'，'.join((f'{stage} {ms}ms' for stage, ms in stages.items()))}")
+        return
+    from mock_server import MockConfig
+    config = MockConfig(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, slow_rate=args.slow_rate, slow_latency=args.slow_latency, max_rps=args.max_rps)
+    if args.single:
+        print(json.dumps(run_size(args.single, args.ticks, args.files, config, args.compute_worker), ensure_ascii=False))
+        return
+    results = []
+    passthrough = [arg for arg in sys.argv[1:] if arg != '--json']
+    if '--sizes' in passthrough:
+        start = passthrough.index('--sizes')
+        end = start + 1
+        while end < len(passthrough) and (not passthrough[end].startswith('--')):
+            end += 1
+        del passthrough[start:end]
+    for size in args.sizes:
+        print(f'压测 {size} 个股票...', file=sys.stderr)
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--single', str(size)] + passthrough, capture_output=True, text=True, encoding='utf-8')
+        lines = [line for line in proc.stdout.splitlines() if line.startswith('{')]
+        if proc.returncode != 0 or not lines:
+            print(f'  {size} 个股票压测失败:\n{proc.stderr[-2000:]}', file=sys.stderr)
+            continue
+        results.append(json.loads(lines[-1]))
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        print_report(results)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+from collections import deque
+import numpy as np
+
+DEFAULT_EVENT_LOG_SIZE = 2000
+EVENT_NEW_HIGH = '突破新高'
+EVENT_NEW_LOW = '跌破新低'
+EVENT_MAX_CHANGE = '创今日最高涨幅'
+EVENT_BREAK_30D = '突破30日新高'
+EVENT_BREAK_60D = '突破60日新高'
+
+class BreakthroughTracker:
+    """盘中突破跟踪（向量化）
+
+    每只股票占一个槽位，跟踪状态保存在按槽位对齐的数组里，每轮行情用整列比较一次更新完，
+    新高/新低等事件写入有上限的事件日志，不再逐条打印；
+    事件日志由自动更新线程追加、页面调用读取，读写都在 _events_lock 下进行
+    """
+
+    def __init__(self, event_log_size=DEFAULT_EVENT_LOG_SIZE):
+        self.codes = []
+        self.index = {}
+        self.initialized = np.zeros(0, dtype=bool)
+        self.initial_price = np.zeros(0)
+        self.high = np.zeros(0)
+        self.low = np.zeros(0)
+        self.new_high_count = np.zeros(0, dtype=np.int32)
+        self.new_low_count = np.zeros(0, dtype=np.int32)
+        self.max_change = np.zeros(0)
+        self.break_30d_count = np.zeros(0, dtype=np.int32)
+        self.above_30d = np.zeros(0, dtype=bool)
+        self.above_60d = np.zeros(0, dtype=bool)
+        self.max_30d = np.zeros(0)
+        self.max_60d = np.zeros(0)
+        self.events = deque(maxlen=event_log_size)
+        self._events_lock = threading.Lock()
+        self._history_source = None
+        self._slots_key = None
+        self._slots = np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return int(self.initialized.sum())
+
+    def _grow(self, new_codes):
+        """给新出现的股票分配槽位（先把数组加长，再登记代码和槽位）"""
+        new_codes = list(new_codes)
+        extra = len(new_codes)
+        self.initialized = np.concatenate([self.initialized, np.zeros(extra, dtype=bool)])
+        self.initial_price = np.concatenate([self.initial_price, np.zeros(extra)])
+        self.high = np.concatenate([self.high, np.zeros(extra)])
+        self.low = np.concatenate([self.low, np.zeros(extra)])
+        self.new_high_count = np.concatenate([self.new_high_count, np.zeros(extra, dtype=np.int32)])
+        self.new_low_count = np.concatenate([self.new_low_count, np.zeros(extra, dtype=np.int32)])
+        self.max_change = np.concatenate([self.max_change, np.zeros(extra)])
+        self.break_30d_count = np.concatenate([self.break_30d_count, np.zeros(extra, dtype=np.int32)])
+        self.above_30d = np.concatenate([self.above_30d, np.zeros(extra, dtype=bool)])
+        self.above_60d = np.concatenate([self.above_60d, np.zeros(extra, dtype=bool)])
+        self.max_30d = np.concatenate([self.max_30d, np.zeros(extra)])
+        self.max_60d = np.concatenate([self.max_60d, np.zeros(extra)])
+        for stock_code in new_codes:
+            self.index[stock_code] = len(self.codes)
+            self.codes.append(stock_code)
+        self._history_source = None
+
+    def _slots_for(self, prefix_codes):
+        """行情字典的股票顺序不变时复用上一次的槽位数组"""
+        key = tuple(prefix_codes)
+        if key != self._slots_key:
+            new_codes = [prefix_code[2:] for prefix_code in prefix_codes if prefix_code[2:] not in self.index]
+            if new_codes:
+                self._grow(dict.fromkeys(new_codes))
+            self._slots = np.fromiter((self.index[prefix_code[2:]] for prefix_code in prefix_codes), dtype=np.int64, count=len(prefix_codes))
+            self._slots_key = key
+        return self._slots
+
+    def _load_history_highs(self, history_data):
+        """history_data 被替换后重新读取每只股票的30日/60日最高价"""
+        if self._history_source is history_data:
+            return
+        for i, stock_code in enumerate(self.codes):
+            history = history_data.get(stock_code)
+            if history is None:
+                self.max_30d[i] = 0
+                self.max_60d[i] = 0
+                continue
+            try:
+                self.max_30d[i] = float(history.get('30日最高价', 0))
+                self.max_60d[i] = float(history.get('60日最高价', 0))
+            except (TypeError, ValueError):
+                self.max_30d[i] = 0
+                self.max_60d[i] = 0
+        self._history_source = history_data
+
+    def update(self, real_time_data, history_data, now=None):
+        """用一轮实时行情更新跟踪状态
+        Args:
+            real_time_data: {带前缀代码: Quote}
+            history_data: 历史数据字典，用于读取30日/60日最高价
+            now: 事件时间（时间戳），默认当前时间；回放录制的行情时传模拟时钟的时间
+        Returns:
+            int: 本轮产生的事件数
+        """
+        quotes = list(real_time_data.values())
+        if not quotes:
+            return 0
+        slots = self._slots_for(list(real_time_data.keys()))
+        self._load_history_highs(history_data)
+        prices = np.fromiter((quote.price for quote in quotes), dtype=np.float64, count=len(quotes))
+        changes = np.fromiter((quote.change for quote in quotes), dtype=np.float64, count=len(quotes))
+        live = prices > 0
+        slots, prices, changes = (slots[live], prices[live], changes[live])
+        max_30d = self.max_30d[slots]
+        max_60d = self.max_60d[slots]
+        has_30d = max_30d > 0
+        has_60d = max_60d > 0
+        above_30d = has_30d & (prices > max_30d)
+        above_60d = has_60d & (prices > max_60d)
+        now = time.time() if now is None else now
+        event_count = 0
+        first = ~self.initialized[slots]
+        if first.any():
+            s = slots[first]
+            self.initialized[s] = True
+            self.initial_price[s] = prices[first]
+            self.high[s] = prices[first]
+            self.low[s] = prices[first]
+            self.new_high_count[s] = 0
+            self.new_low_count[s] = 0
+            self.max_change[s] = changes[first]
+            self.break_30d_count[s] = above_30d[first]
+            self.above_30d[s] = above_30d[first]
+            self.above_60d[s] = above_60d[first]
+            event_count += self._log(now, EVENT_BREAK_30D, s[above_30d[first]], prices[first & above_30d], self.break_30d_count)
+            event_count += self._log(now, EVENT_BREAK_60D, s[above_60d[first]], prices[first & above_60d], None)
+        seen = ~first
+        if seen.any():
+            s = slots[seen]
+            p = prices[seen]
+            c = changes[seen]
+            new_high = p > self.high[s]
+            new_low = p < self.low[s]
+            new_max_change = c > self.max_change[s]
+            self.new_high_count[s[new_high]] += 1
+            self.high[s[new_high]] = p[new_high]
+            self.new_low_count[s[new_low]] += 1
+            self.low[s[new_low]] = p[new_low]
+            self.max_change[s[new_max_change]] = c[new_max_change]
+            above = above_30d[seen]
+            crossed_30d = above & ~self.above_30d[s]
+            self.break_30d_count[s[crossed_30d]] += 1
+            self.above_30d[s[crossed_30d]] = True
+            self.above_30d[s[has_30d[seen] & ~above]] = False
+            self.above_60d[s[has_60d[seen]]] = above_60d[seen][has_60d[seen]]
+            event_count += self._log(now, EVENT_NEW_HIGH, s[new_high], p[new_high], self.new_high_count)
+            event_count += self._log(now, EVENT_NEW_LOW, s[new_low], p[new_low], self.new_low_count)
+            event_count += self._log(now, EVENT_MAX_CHANGE, s[new_max_change], c[new_max_change], None)
+            event_count += self._log(now, EVENT_BREAK_30D, s[crossed_30d], p[crossed_30d], self.break_30d_count)
+        return event_count
+
+    def _log(self, now, kind, slots, values, counts):
+        """把一类事件追加到事件日志：(时间戳, 代码, 事件, 价格或涨幅, 累计次数)"""
+        if len(slots) == 0:
+            return 0
+        codes = self.codes
+        if counts is None:
+            entries = [(now, codes[slot], kind, float(value), None) for slot, value in zip(slots.tolist(), values.tolist())]
+        else:
+            entries = [(now, codes[slot], kind, float(value), int(count)) for slot, value, count in zip(slots.tolist(), values.tolist(), counts[slots].tolist())]
+        with self._events_lock:
+            self.events.extend(entries)
+        return len(slots)
+
+    def columns(self):
+        """页面查询要用的跟踪状态的副本，和合并结果一起发布到快照里，之后的 update 不会改到它
+        Returns:
+            dict: {'index': {代码: 槽位}, 'initialized': 数组, 'new_high_count'/'new_low_count'/'max_change'/'break_30d_count'/'above_60d': 数组}
+        """
+        return {'index': dict(self.index), 'initialized': self.initialized.copy(), 'new_high_count': self.new_high_count.copy(), 'new_low_count': self.new_low_count.copy(), 'max_change': self.max_change.copy(), 'break_30d_count': self.break_30d_count.copy(), 'above_60d': self.above_60d.copy()}
+
+    def get_state(self, stock_code):
+        """按原来的中文键返回单只股票的跟踪状态，没有跟踪过返回None"""
+        i = self.index.get(stock_code)
+        if i is None or not self.initialized[i]:
+            return None
+        return {'初始价格': float(self.initial_price[i]), '当前最高': float(self.high[i]), '当前最低': float(self.low[i]), '突破新高次数': int(self.new_high_count[i]), '突破新低次数': int(self.new_low_count[i]), '曾经最高涨幅': float(self.max_change[i]), '突破30日新高次数': int(self.break_30d_count[i]), '上次是否超过30日': bool(self.above_30d[i]), '已突破60日新高': bool(self.above_60d[i])}
+
+    def recent_events(self, limit=100):
+        """最近的事件，新的在前
+        Returns:
+            list: [{'时间', '代码', '事件', '数值', '累计次数'}]
+        """
+        with self._events_lock:
+            events = list(self.events)[-limit:] if limit > 0 else []
+        result = []
+        for timestamp, stock_code, kind, value, count in reversed(events):
+            result.append({'时间': time.strftime('%H:%M:%S', time.localtime(timestamp)), '代码': stock_code, '事件': kind, '数值': value, '累计次数': count})
+        return result
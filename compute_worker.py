@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""可选的计算子进程
+
+合并引擎（历史特征表 + 增量合并，见 merge_engine）和优先级分类放到单独的进程里运行，
+子进程自己从历史数据仓库读K线、建历史数据和特征表，主进程只告诉它换成了哪些股票；
+pywebview 进程只负责抓行情、发布快照和推送，不再建历史特征表，也不用把历史数据序列化后传过去。
+合并期间主进程在管道上等待结果，不占GIL，页面调用和界面线程不会被一轮合并卡住。
+设置环境变量 THREE_SUN_COMPUTE_WORKER=1 时启动就打开，也可以由页面调用 Api.start_compute_worker。
+
+管道协议（都由主进程发起，子进程按顺序处理）：
+    ('history', [代码], 是否交易时间)   历史数据换了才发（一般每天一次）：子进程用 get_xls_data.load_history_records
+                                       从仓库读这些股票，回复 ('history_loaded', 读到的股票数)
+    ('industry', 行业数据)             行业数据换了才发
+    ('codes', [(带前缀代码, 名称)])     行情的股票列表或名称变了才发
+    ('merge', 基准版本, 是否交易时间)   后面紧跟一段 send_bytes：按 codes 的顺序排列的float64行情，每只股票 QUOTE_FIELDS 6个数
+    ('classify', [代码])                回复 ('classified', [高优先级代码])，规则见 merge_engine.classify_priority
+子进程对 merge 回复 ('merged', 版本, 是否全量)，后面紧跟一段 send_bytes 的合并结果（见 encode_merged）：
+基准版本等于子进程上一次回复的版本时只带这一轮重新计算的行里变了的字段，否则带全部行；出错时回复 ('error', 信息)
+"""
+import array
+import marshal
+import multiprocessing
+import os
+import threading
+
+COMPUTE_WORKER_ENABLED = os.environ.get('THREE_SUN_COMPUTE_WORKER') == '1'
+QUOTE_FIELDS = ('price', 'change', 'turnover', 'float_cap', 'high', 'low')
+REPLY_TIMEOUT = 30
+
+def encode_quotes(real_time_data):
+    """把行情拆成股票列表和紧凑的float64数组
+    Returns:
+        tuple: ([(带前缀代码, 名称)], bytes)
+    """
+    table = [(prefix_code, quote.name) for prefix_code, quote in real_time_data.items()]
+    values = array.array('d', [value for quote in real_time_data.values() for value in (quote.price, quote.change, quote.turnover, quote.float_cap, quote.high, quote.low)])
+    return (table, values.tobytes())
+
+def decode_quotes(table, payload):
+    """encode_quotes 的逆过程，返回 {带前缀代码: Quote}"""
+    from quote_sources import Quote
+    values = array.array('d')
+    values.frombytes(payload)
+    width = len(QUOTE_FIELDS)
+    return {prefix_code: Quote(name, *values[i * width:(i + 1) * width]) for i, (prefix_code, name) in enumerate(table)}
+
+def encode_merged(merged, table, recomputed_rows, previous=None):
+    """把一轮合并结果编码成紧凑的二进制（marshal），行按 table 的顺序用下标表示，字段按 MERGED_FIELDS 的顺序
+    Args:
+        merged: {代码: 合并结果}
+        table: [(带前缀代码, 名称)]
+        recomputed_rows: 本轮重新计算的行在 table 里的下标
+        previous: 对方手里上一版的 {代码: 合并结果}；None表示全量，每行编码成值的元组（没有的字段为None）；
+            否则只编码重新计算的行里和上一版不同的字段：每行一个64位掩码，加上变了的字段值
+    Returns:
+        bytes
+    """
+    from merge_engine import MERGED_FIELDS
+    rows = array.array('I', recomputed_rows).tobytes()
+    if previous is None:
+        return marshal.dumps((rows, [tuple(merged[prefix_code[2:]].get(field) for field in MERGED_FIELDS) for prefix_code, _ in table]))
+    masks = array.array('Q')
+    values = []
+    for i in recomputed_rows:
+        stock_code = table[i][0][2:]
+        row = merged[stock_code]
+        old = previous.get(stock_code) or {}
+        mask = 0
+        for bit, field in enumerate(MERGED_FIELDS):
+            value = row.get(field)
+            old_value = old.get(field)
+            if value != old_value or type(value) is not type(old_value):
+                mask |= 1 << bit
+                values.append(value)
+        masks.append(mask)
+    return marshal.dumps((rows, masks.tobytes(), tuple(values)))
+
+def decode_merged(payload, table, previous=None):
+    """encode_merged 的逆过程；增量时在 previous 的行的副本上改变了的字段，没重新计算的行直接沿用 previous 的行
+    Returns:
+        tuple: ({代码: 合并结果}, [重新计算的带前缀代码])
+    """
+    from merge_engine import MERGED_FIELDS
+    decoded = marshal.loads(payload)
+    rows = array.array('I')
+    rows.frombytes(decoded[0])
+    recomputed = [table[i][0] for i in rows]
+    if previous is None:
+        merged = {}
+        for (prefix_code, _), values in zip(table, decoded[1]):
+            merged[prefix_code[2:]] = {field: value for field, value in zip(MERGED_FIELDS, values) if value is not None}
+        return (merged, recomputed)
+    masks = array.array('Q')
+    masks.frombytes(decoded[1])
+    values = iter(decoded[2])
+    changed = {}
+    for prefix_code, mask in zip(recomputed, masks):
+        stock_code = prefix_code[2:]
+        row = dict(previous.get(stock_code) or {})
+        for bit, field in enumerate(MERGED_FIELDS):
+            if mask >> bit & 1:
+                value = next(values)
+                if value is None:
+                    row.pop(field, None)
+                else:
+                    row[field] = value
+        changed[stock_code] = row
+    merged = {prefix_code[2:]: changed.get(prefix_code[2:]) or previous[prefix_code[2:]] for prefix_code, _ in table}
+    return (merged, recomputed)
+
+def _worker_main(conn):
+    """子进程入口：按协议处理消息，直到收到 stop 或管道关闭"""
+    import merge_engine
+    engine = merge_engine.MergeEngine()
+    history_data = {}
+    industry_data = {}
+    table = []
+    positions = {}
+    version = 0
+    sent = {}
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        kind = message[0]
+        if kind == 'stop':
+            break
+        if kind == 'history':
+            try:
+                import get_xls_data
+                history_data = get_xls_data.load_history_records(message[1], message[2])
+            except Exception as e:
+                history_data = {}
+                conn.send(('error', f'{type(e).__name__}: {e}'))
+                continue
+            conn.send(('history_loaded', len(history_data)))
+        elif kind == 'industry':
+            industry_data = message[1]
+        elif kind == 'codes':
+            table = message[1]
+            positions = {prefix_code: i for i, (prefix_code, _) in enumerate(table)}
+        elif kind == 'classify':
+            try:
+                high_priority, _ = merge_engine.classify_priority(engine.get_history_features(history_data), message[1])
+            except Exception as e:
+                conn.send(('error', f'{type(e).__name__}: {e}'))
+                continue
+            conn.send(('classified', high_priority))
+        elif kind == 'merge':
+            _, base_version, is_trading_time = message
+            payload = conn.recv_bytes()
+            try:
+                merged, recomputed = engine.merge(decode_quotes(table, payload), history_data, industry_data, is_trading_time)
+                full = base_version != version
+                reply = encode_merged(merged, table, [positions[prefix_code] for prefix_code in recomputed], None if full else sent)
+            except Exception as e:
+                conn.send(('error', f'{type(e).__name__}: {e}'))
+                continue
+            version += 1
+            sent = merged
+            conn.send(('merged', version, full))
+            conn.send_bytes(reply)
+    conn.close()
+
+class ComputeWorker:
+    """计算子进程的主进程一端：历史数据换了时只发股票列表让子进程自己读仓库，行业数据和行情股票列表换了时才发，
+    每轮只传行情数组和变了的字段"""
+
+    def __init__(self):
+        context = multiprocessing.get_context('spawn')
+        self._conn, child_conn = context.Pipe()
+        self._process = context.Process(target=_worker_main, args=(child_conn,), name='compute-worker', daemon=True)
+        self._process.start()
+        child_conn.close()
+        self._lock = threading.Lock()
+        self._industry_data = None
+        self._table = None
+        self._version = None
+        self._merged = {}
+        self.merges = 0
+        self.full_replies = 0
+        self.reply_bytes = 0
+
+    @property
+    def alive(self):
+        return self._process.is_alive()
+
+    def _send_industry(self, industry_data):
+        """行业数据换了对象时发给子进程（调用方持有 self._lock）"""
+        if industry_data is not None and industry_data is not self._industry_data:
+            self._conn.send(('industry', industry_data))
+            self._industry_data = industry_data
+
+    def _receive(self):
+        """等待子进程的回复（调用方持有 self._lock），出错时抛出 RuntimeError"""
+        if not self._conn.poll(REPLY_TIMEOUT):
+            raise RuntimeError(f'{REPLY_TIMEOUT}秒内没有回复')
+        reply = self._conn.recv()
+        if reply[0] == 'error':
+            self._version = None
+            raise RuntimeError(reply[1])
+        return reply
+
+    def load_history(self, stock_codes, is_trading_time=None):
+        """让子进程从历史数据仓库读这些股票的历史数据（主进程的历史数据换了时调用），读完才返回
+        Args:
+            stock_codes: 主进程历史数据里的股票代码
+            is_trading_time: 主进程生成这份历史数据时用的值，见 get_xls_data.build_history_record
+        Raises:
+            RuntimeError: 子进程出错、退出，或者仓库里读到的股票比主进程少
+        """
+        stock_codes = list(stock_codes)
+        with self._lock:
+            try:
+                self._conn.send(('history', stock_codes, is_trading_time))
+                loaded = self._receive()[1]
+            except (OSError, EOFError) as e:
+                raise RuntimeError(f'计算子进程已退出: {e}')
+        if loaded != len(stock_codes):
+            raise RuntimeError(f'子进程从历史数据仓库只读到 {loaded}/{len(stock_codes)} 个股票')
+
+    def classify(self, stock_codes):
+        """在子进程里按历史特征表分出高优先级的股票，规则同 merge_engine.classify_priority
+        Returns:
+            list: 高优先级代码
+        """
+        with self._lock:
+            try:
+                self._conn.send(('classify', list(stock_codes)))
+                return self._receive()[1]
+            except (OSError, EOFError) as e:
+                raise RuntimeError(f'计算子进程已退出: {e}')
+
+    def merge(self, real_time_data, industry_data, is_trading_time):
+        """在子进程里合并，用 load_history 读好的历史数据，其他参数和返回值同 MergeEngine.merge
+        子进程出错、退出或 REPLY_TIMEOUT 秒内没有回复时抛出 RuntimeError，之后这个实例不能再用
+        """
+        with self._lock:
+            try:
+                self._send_industry(industry_data)
+                table, payload = encode_quotes(real_time_data)
+                if table != self._table:
+                    self._conn.send(('codes', table))
+                    self._table = table
+                self._conn.send(('merge', self._version, is_trading_time))
+                self._conn.send_bytes(payload)
+                _, version, full = self._receive()
+                reply = self._conn.recv_bytes()
+            except (OSError, EOFError) as e:
+                raise RuntimeError(f'计算子进程已退出: {e}')
+            merged, recomputed = decode_merged(reply, table, None if full else self._merged)
+            if full:
+                self.full_replies += 1
+            self.reply_bytes += len(reply)
+            self._version = version
+            self._merged = merged
+            self.merges += 1
+            return (merged, recomputed)
+
+    def stop(self, timeout=2):
+        try:
+            self._conn.send(('stop',))
+        except (OSError, EOFError):
+            pass
+        self._process.join(timeout)
+        if self._process.is_alive():
+            self._process.terminate()
+        self._conn.close()
+
+    def status(self):
+        return {'运行中': self.alive, '进程号': self._process.pid, '合并次数': self.merges, '全量回复次数': self.full_replies, '回复字节数': self.reply_bytes}
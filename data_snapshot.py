@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""整合数据的只读快照
+
+写入方（自动更新线程、开始按钮和参数修改触发的刷新）在自己的工作数据上算好一版完整的结果，
+再用 SnapshotStore.publish 一次换上去；页面调用的读取方只拿 latest() 返回的快照。
+快照和它引用的字典发布后都不再修改（写入方每次都生成新字典再替换），
+读取方不需要加锁，也不会看到一半是新一半是旧的数据
+"""
+import threading
+
+class DataSnapshot:
+    """一版完整的数据，发布后只读"""
+    __slots__ = ('version', 'concept_data', 'real_time_data', 'history_data', 'merged_data', 'concept_count', 'today_limit_up', 'updated_at', 'data_source', 'tracker_columns')
+
+    def __init__(self, version, concept_data, real_time_data, history_data, merged_data, concept_count, today_limit_up, updated_at=None, data_source='', tracker_columns=None):
+        self.version = version
+        self.concept_data = concept_data
+        self.real_time_data = real_time_data
+        self.history_data = history_data
+        self.merged_data = merged_data
+        self.concept_count = concept_count
+        self.today_limit_up = today_limit_up
+        self.updated_at = updated_at
+        self.data_source = data_source
+        # 盘中突破跟踪状态的副本（BreakthroughTracker.columns），和这一版行情对应
+        self.tracker_columns = tracker_columns
+
+    def __repr__(self):
+        return f'DataSnapshot(版本={self.version}, 股票数={len(self.merged_data)}, 更新时间={self.updated_at})'
+
+EMPTY_SNAPSHOT = DataSnapshot(0, {}, {}, {}, {}, {}, {})
+
+class SnapshotStore:
+    """保存最新发布的快照；publish 之间加锁保证版本号递增，latest 只读一次引用，不加锁"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._current = EMPTY_SNAPSHOT
+
+    def publish(self, concept_data, real_time_data, history_data, merged_data, concept_count, today_limit_up, updated_at=None, data_source='', tracker_columns=None):
+        """发布新的一版数据，传进来的字典之后不能再修改
+        Returns:
+            DataSnapshot: 刚发布的快照
+        """
+        with self._lock:
+            snapshot = DataSnapshot(self._current.version + 1, concept_data, real_time_data, history_data, merged_data, concept_count, today_limit_up, updated_at, data_source, tracker_columns)
+            self._current = snapshot
+        return snapshot
+
+    def latest(self):
+        """最新发布的快照（还没有发布过时是版本0的空快照）"""
+        return self._current
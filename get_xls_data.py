@@ -1,17 +1,25 @@
-from openpyxl import load_workbook
 import os
 import re
-import requests
 import time
+import random
 import threading
-from concurrent.futures import ThreadPoolExecutor
-from tenacity import retry, stop_after_attempt, wait_random
 import json
+import pickle
+import adaptive_limiter
+import quote_sources
+import metrics
+import trading_calendar
+from quote_sources import parse_quote_fields
+from startup import lazy_module, lazy_retry
 from datetime import datetime
 import sys
-import asyncio
-import aiohttp
-from aiohttp import ClientSession, TCPConnector
+import concurrent.futures
+# 这些模块导入较慢，第一次用到时才导入，见 startup.lazy_module
+openpyxl = lazy_module('openpyxl')
+requests = lazy_module('requests')
+asyncio = lazy_module('asyncio')
+aiohttp = lazy_module('aiohttp')
+history_file = lazy_module('history_file')
 thread_local = threading.local()
 
 def get_resource_path(relative_path):
@@ -23,8 +31,12 @@ def get_resource_path(relative_path):
     return os.path.join(base_path, relative_path)
 
 def get_data_path(relative_path):
-    """获取外部数据文件的绝对路径（用户自己放的数据）"""
-    if getattr(sys, 'frozen', False):
+    """获取外部数据文件的绝对路径（用户自己放的数据）
+    设置了环境变量 THREE_SUN_DATA_DIR 时使用该目录（压测等场景用独立的数据目录）
+    """
+    if os.environ.get('THREE_SUN_DATA_DIR'):
+        base_path = os.environ['THREE_SUN_DATA_DIR']
+    elif getattr(sys, 'frozen', False):
         base_path = os.path.dirname(sys.executable)
     else:
         base_path = os.path.dirname(os.path.abspath(__file__))
@@ -137,43 +149,96 @@ def get_session():
         thread_local.session.headers.update({'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'})
     return thread_local.session
 
-def get_folder_data(strat_index=1, count=1):
-    xlsx_datas = {}
+WORKBOOK_SIDECAR_ENABLED = True
+_workbook_cache = {}
+_workbook_cache_lock = threading.Lock()
+
+def get_workbook_sidecar_path(file_path):
+    """获取xlsx解析结果的磁盘缓存路径（与xlsx放在同一目录）"""
+    return file_path + '.rows.pkl'
+
+def parse_workbook_rows(file_path):
+    """用openpyxl解析单个股票数据xlsx，返回 [[代码, 名称, ..., 概念, ...], ...]"""
+    wb = openpyxl.load_workbook(file_path)
+    ws = wb.active
+    rows_list = []
+    for row in ws.iter_rows(min_row=2, values_only=True):
+        if row[3]:
+            concept = row[3].split('+')[0]
+        row_data = [row[0], row[1], row[2], concept, row[4], row[5]]
+        rows_list.append(row_data)
+    return rows_list
+
+def load_workbook_rows(file_path):
+    """读取单个xlsx的行数据，按 (路径, 修改时间, 文件大小) 缓存
+    先查进程内缓存，再查磁盘缓存，都失效时才用openpyxl解析
+    """
+    stat = os.stat(file_path)
+    cache_key = (stat.st_mtime_ns, stat.st_size)
+    with _workbook_cache_lock:
+        cached = _workbook_cache.get(file_path)
+    if cached and cached[0] == cache_key:
+        return cached[1]
+    rows_list = None
+    sidecar_path = get_workbook_sidecar_path(file_path)
+    if WORKBOOK_SIDECAR_ENABLED and os.path.exists(sidecar_path):
+        try:
+            with open(sidecar_path, 'rb') as f:
+                sidecar = pickle.load(f)
+            if sidecar.get('key') == cache_key:
+                rows_list = sidecar['rows']
+        except Exception as e:
+            print(f'读取缓存文件失败 {sidecar_path}: {e}')
+    if rows_list is None:
+        rows_list = parse_workbook_rows(file_path)
+        if WORKBOOK_SIDECAR_ENABLED:
+            try:
+                with open(sidecar_path, 'wb') as f:
+                    pickle.dump({'key': cache_key, 'rows': rows_list}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            except Exception as e:
+                print(f'写入缓存文件失败 {sidecar_path}: {e}')
+    with _workbook_cache_lock:
+        _workbook_cache[file_path] = (cache_key, rows_list)
+    return rows_list
+
+def get_stock_data_folder():
+    return os.path.join(get_data_path(''), '股票数据')
+
+def list_stock_data_files():
+    """股票数据文件夹里的xlsx文件名（跳过Excel的临时文件），从新到旧排序"""
     file_name = []
-    folder_name = '股票数据'
-    base_path = get_data_path('')
-    stock_path = os.path.join(base_path, folder_name)
-    files = os.listdir(stock_path)
+    files = os.listdir(get_stock_data_folder())
     for file in files:
         if file.startswith('~$'):
             continue
         if not file.endswith('.xlsx'):
             continue
         file_name.append(file)
-    reverse_files = sorted(file_name, reverse=True)
+    return sorted(file_name, reverse=True)
+
+def stock_data_file_date(data_file):
+    """股票数据文件名末尾的MMDD转成 '10月30' 格式的日期"""
+    match = re.search('(\\d{2})(\\d{2})$', data_file.replace('.xlsx', ''))
+    month = int(match.group(1))
+    day = int(match.group(2))
+    return f'{month}月{day}'
+
+def get_folder_data(strat_index=1, count=1):
+    xlsx_datas = {}
+    stock_path = get_stock_data_folder()
+    reverse_files = list_stock_data_files()
     result_files = reverse_files[strat_index:strat_index + count]
     for data_file in result_files:
         file_path = os.path.join(stock_path, data_file)
         try:
-            wb = load_workbook(file_path)
+            rows_list = load_workbook_rows(file_path)
         except Exception as e:
             print(f'警告：无法读取文件 {data_file}，错误：{e}')
             continue
-        ws = wb.active
-        rows_list = []
-        for row in ws.iter_rows(min_row=2, values_only=True):
-            if row[3]:
-                concept = row[3].split('+')[0]
-            row_data = [row[0], row[1], row[2], concept, row[4], row[5]]
-            rows_list.append(row_data)
-        match = re.search('(\\d{2})(\\d{2})$', data_file.replace('.xlsx', ''))
-        month = int(match.group(1))
-        day = int(match.group(2))
-        date = f'{month}月{day}'
-        xlsx_datas[date] = rows_list
+        xlsx_datas[stock_data_file_date(data_file)] = rows_list
     return xlsx_datas
 
-@retry(stop=stop_after_attempt(5), wait=wait_random(2, 5))
+@lazy_retry(5, 2, 5)
 def fetch_single_stock(prefix_stock):
     session = get_session()
     url = f'https://qt.gtimg.cn/q={prefix_stock}'
@@ -182,54 +247,194 @@ def fetch_single_stock(prefix_stock):
         content = res.text
         content = content.split('=')[1].strip('";')
         parts = content.split('~')
-        price = parts[3]
-        change_percent = parts[32]
-        turnover_rate = parts[38]
-        circulation_value = parts[44]
-        name = parts[1]
-        today_high = parts[33]
-        today_low = parts[34]
-        return {'code': prefix_stock, 'data': {'现价': price, '涨幅': change_percent, '换手率': turnover_rate, '流通市值': circulation_value, '名称': name, '今日最高价': today_high, '今日最低价': today_low}}
+        return parse_quote_fields(prefix_stock, parts)
     except Exception as e:
         return None
 
-async def fetch_single_stock_async(session, prefix_stock, semaphore):
-    """异步获取单个股票数据"""
-    url = f'https://qt.gtimg.cn/q={prefix_stock}'
+def to_prefix_code(stock_code):
+    """给股票代码加上交易所前缀：6/9开头为sh，0/2/3开头为sz，其他返回None"""
+    if stock_code.startswith(('6', '9')):
+        return 'sh' + stock_code
+    if stock_code.startswith(('0', '2', '3')):
+        return 'sz' + stock_code
+    return None
+
+QUOTE_BATCH_SIZE = 80
+QUOTE_MIN_BATCH_SIZE = 5
+
+async def fetch_single_stock_async(session, prefix_stock, semaphore, budget=None):
+    """异步获取单个股票数据（经过 quote_sources 的对冲/故障切换）
+    只有网络和HTTP错误才重试；请求成功但返回里没有这个代码（代码不存在、停牌退市）时直接返回None
+    """
     async with semaphore:
         for attempt in range(5):
             try:
-                async with session.get(url, timeout=aiohttp.ClientTimeout(total=10)) as response:
-                    content = await response.text()
-                    content = content.split('=')[1].strip('";')
-                    parts = content.split('~')
-                    return {'code': prefix_stock, 'data': {'现价': parts[3], '涨幅': parts[32], '换手率': parts[38], '流通市值': parts[44], '名称': parts[1], '今日最高价': parts[33], '今日最低价': parts[34]}}
+                results = await quote_sources.fetch_quotes(session, [prefix_stock], budget)
+                for result in results:
+                    if result['code'] == prefix_stock:
+                        return result
+                metrics.increment('无行情_实时行情')
+                return
+            except adaptive_limiter.CircuitOpenError:
+                return
             except Exception as e:
                 if attempt == 4:
+                    metrics.increment('失败_实时行情')
                     return
+                metrics.increment('重试_实时行情')
                 await asyncio.sleep(2 + attempt)
                 continue
 
-async def fetch_stocks_batch_async(stock_list, batch_name='批次'):
-    """批量异步获取股票数据"""
+async def fetch_stock_chunk_async(session, chunk, semaphore, min_batch_size=QUOTE_MIN_BATCH_SIZE, on_results=None, budget=None):
+    """异步获取一批股票数据（一个请求携带多个代码，逗号分隔）
+    请求失败时把这一批拆成两半分别重试，拆到不超过min_batch_size后逐个获取
+    Args:
+        on_results: 每拿到一部分结果就立即调用 on_results(记录列表)，不必等整批（包括拆分出来的另一半）完成
+        budget: 请求预算，拆分重试和逐个获取发出的每个请求都要扣，见 quote_sources.QuoteRouter.fetch
+    Returns:
+        list: 成功获取的记录列表
+    """
+    if len(chunk) == 1:
+        result = await fetch_single_stock_async(session, chunk[0], semaphore, budget)
+        results = [result] if result else []
+    else:
+        results = await _fetch_multi_stock_chunk_async(session, chunk, semaphore, min_batch_size, on_results, budget)
+        if results is not None:
+            return results
+        middle = len(chunk) // 2
+        halves = await asyncio.gather(fetch_stock_chunk_async(session, chunk[:middle], semaphore, min_batch_size, on_results, budget), fetch_stock_chunk_async(session, chunk[middle:], semaphore, min_batch_size, on_results, budget))
+        return halves[0] + halves[1]
+    if on_results and results:
+        on_results(results)
+    return results
+
+async def _fetch_multi_stock_chunk_async(session, chunk, semaphore, min_batch_size, on_results, budget):
+    """发出一个多代码请求，需要拆成两半重试时返回None
+    请求成功但返回里缺了部分代码（v_pv_none_match、响应被截断、无法解析的行）时，
+    缺的代码计入 缺失_实时行情，再按同样的拆分/逐个获取流程补抓；整批都缺时和请求失败一样处理
+    """
+    try:
+        async with semaphore:
+            results = await quote_sources.fetch_quotes(session, chunk, budget)
+    except adaptive_limiter.CircuitOpenError:
+        return []
+    except Exception as e:
+        if len(chunk) > min_batch_size:
+            metrics.increment('拆分重试_实时行情')
+            print(f'[批量爬取] {len(chunk)}个代码请求失败({e})，拆分为{len(chunk) // 2}+{len(chunk) - len(chunk) // 2}重试')
+            return None
+        results = await asyncio.gather(*[fetch_single_stock_async(session, prefix_stock, semaphore, budget) for prefix_stock in chunk])
+        results = [r for r in results if r]
+    else:
+        returned = {result['code'] for result in results}
+        missing = [prefix_stock for prefix_stock in chunk if prefix_stock not in returned]
+        if missing:
+            metrics.increment('缺失_实时行情', len(missing))
+            if len(missing) == len(chunk) and len(chunk) > min_batch_size:
+                metrics.increment('拆分重试_实时行情')
+                print(f'[批量爬取] {len(chunk)}个代码的请求没有返回任何行情，拆分为{len(chunk) // 2}+{len(chunk) - len(chunk) // 2}重试')
+                return None
+            if on_results and results:
+                on_results(results)
+            if len(missing) == len(chunk):
+                retried = await asyncio.gather(*[fetch_stock_chunk_async(session, [prefix_stock], semaphore, min_batch_size, on_results, budget) for prefix_stock in missing])
+                return [result for part in retried for result in part]
+            print(f'[批量爬取] {len(chunk)}个代码的请求缺少{len(missing)}个，补抓缺少的代码')
+            return results + await fetch_stock_chunk_async(session, missing, semaphore, min_batch_size, on_results, budget)
+    if on_results and results:
+        on_results(results)
+    return results
+
+async def fetch_stocks_batch_async(stock_list, batch_name='批次', batch_size=QUOTE_BATCH_SIZE, session=None, on_results=None):
+    """批量异步获取股票数据
+    Args:
+        stock_list: 带前缀的股票代码列表，如 ['sh600000', 'sz000001']
+        batch_name: 日志中显示的批次名称
+        batch_size: 每个请求携带的代码数，<=1 时退回逐个请求
+        session: 共用的 ClientSession，None时临时创建一个
+        on_results: 部分结果到达时的回调，见 fetch_stock_chunk_async
+    """
     if not stock_list:
         return []
-    connector = TCPConnector(limit=800, limit_per_host=200)
-    semaphore = asyncio.Semaphore(800)
-    timeout = aiohttp.ClientTimeout(total=10, connect=5)
-    async with ClientSession(connector=connector, timeout=timeout) as session:
-        tasks = [fetch_single_stock_async(session, prefix_stock, semaphore) for prefix_stock in stock_list]
+    if session is None:
+        connector = aiohttp.TCPConnector(limit=800, limit_per_host=200)
+        timeout = aiohttp.ClientTimeout(total=10, connect=5)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            return await fetch_stocks_batch_async(stock_list, batch_name, batch_size, session, on_results)
+    batch_start = time.perf_counter()
+    if batch_size <= 1:
+        semaphore = asyncio.Semaphore(800)
         print(f'[异步爬取] {batch_name}: 开始爬取 {len(stock_list)} 个股票...')
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        success_count = sum((1 for r in results if r is not None and (not isinstance(r, Exception))))
-        print(f'[异步爬取] {batch_name}: 完成，成功 {success_count}/{len(stock_list)} 个')
-        return results
+        results = await asyncio.gather(*[fetch_stock_chunk_async(session, [prefix_stock], semaphore, on_results=on_results) for prefix_stock in stock_list], return_exceptions=True)
+    else:
+        semaphore = asyncio.Semaphore(50)
+        chunks = [stock_list[i:i + batch_size] for i in range(0, len(stock_list), batch_size)]
+        print(f'[异步爬取] {batch_name}: 开始爬取 {len(stock_list)} 个股票（{len(chunks)}个批量请求，每批{batch_size}个）...')
+        results = await asyncio.gather(*[fetch_stock_chunk_async(session, chunk, semaphore, on_results=on_results) for chunk in chunks], return_exceptions=True)
+    flat_results = []
+    for chunk_result in results:
+        if chunk_result and (not isinstance(chunk_result, Exception)):
+            flat_results.extend(chunk_result)
+    metrics.observe(f'抓取_{batch_name}', time.perf_counter() - batch_start)
+    print(f'[异步爬取] {batch_name}: 完成，成功 {len(flat_results)}/{len(stock_list)} 个')
+    return flat_results
+
+REALTIME_TICK_DEADLINE = 1.5
+_realtime_loop = None
+_realtime_session = None
+_realtime_lock = threading.Lock()
+_late_quotes = {}
+_pending_quote_codes = set()
+
+def get_realtime_loop():
+    """一次性实时数据抓取共用的后台事件循环（常驻线程），超过截止时间还没返回的请求在这里继续完成"""
+    global _realtime_loop
+    with _realtime_lock:
+        if _realtime_loop is None:
+            _realtime_loop = asyncio.new_event_loop()
+            threading.Thread(target=_realtime_loop.run_forever, name='realtime-fetch', daemon=True).start()
+        return _realtime_loop
+
+class _QuoteCollector:
+    """收集一次抓取的结果；调用方放弃等待(detach)之后，迟到的结果转入 _late_quotes，留给下一次抓取合并"""
+
+    def __init__(self):
+        self.quotes = {}
+        self.detached = False
+
+    def add(self, results):
+        with _realtime_lock:
+            target = _late_quotes if self.detached else self.quotes
+            for result in results:
+                target[result['code']] = result['data']
+
+    def detach(self):
+        with _realtime_lock:
+            self.detached = True
+            return dict(self.quotes)
+
+async def _fetch_quote_tiers_async(tiers, batch_size, collector):
+    """在后台事件循环上同时抓取三个优先级的股票（最高优先级的请求最先发出）"""
+    global _realtime_session
+    if _realtime_session is None or _realtime_session.closed:
+        _realtime_session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=800, limit_per_host=200, keepalive_timeout=60), timeout=aiohttp.ClientTimeout(total=10, connect=5))
+    codes = [prefix_stock for _, stock_list in tiers for prefix_stock in stock_list]
+    with _realtime_lock:
+        _pending_quote_codes.update(codes)
+    try:
+        await asyncio.gather(*[fetch_stocks_batch_async(stock_list, batch_name, batch_size, _realtime_session, collector.add) for batch_name, stock_list in tiers if stock_list])
+    finally:
+        with _realtime_lock:
+            _pending_quote_codes.difference_update(codes)
 
-def get_real_time_data(progress_callback=None, strat_index=3, count=20, show_progress=True, top_priority_codes=None, high_priority_codes=None):
+def get_real_time_data(progress_callback=None, strat_index=3, count=20, show_progress=True, top_priority_codes=None, high_priority_codes=None, batch_size=QUOTE_BATCH_SIZE, deadline=None):
     """获取实时数据（异步版本，支持三级优先级）
     Args:
         top_priority_codes: 最高优先级（表格显示的股票）
         high_priority_codes: 高优先级（阳天数=1且有连续涨停）
+        batch_size: 每个请求携带的股票代码数，<=1 时逐个请求
+        deadline: 最多等待多少秒，到时只返回已经到达的行情，没返回的请求继续在后台完成并合并到下一次调用；
+            None表示等全部完成
     """
     start_time = time.time()
     prefix_stocks = []
@@ -278,26 +483,24 @@ def get_real_time_data(progress_callback=None, strat_index=3, count=20, show_pro
         if stock not in set(top_priority_stocks) and stock not in set(high_priority_stocks):
             normal_priority_stocks.append(stock)
     print(f'【普通优先级】其他股票: {len(normal_priority_stocks)}个')
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+    with _realtime_lock:
+        late_quotes = {code: _late_quotes.pop(code) for code in prefix_stocks if code in _late_quotes}
+        still_pending = set(_pending_quote_codes)
+    if late_quotes:
+        print(f'合并上一次迟到的行情: {len(late_quotes)}个')
+    stock_dates.update(late_quotes)
+    tiers = [(batch_name, [stock for stock in stock_list if stock not in still_pending]) for batch_name, stock_list in (('最高优先级', top_priority_stocks), ('高优先级', high_priority_stocks), ('普通优先级', normal_priority_stocks))]
+    if still_pending:
+        print(f'{len(still_pending)}个股票的上一次请求还没返回，本次不重复请求')
+    collector = _QuoteCollector()
+    future = asyncio.run_coroutine_threadsafe(_fetch_quote_tiers_async(tiers, batch_size, collector), get_realtime_loop())
     try:
-        if top_priority_stocks:
-            top_results = loop.run_until_complete(fetch_stocks_batch_async(top_priority_stocks, '最高优先级'))
-            for result in top_results:
-                if result and (not isinstance(result, Exception)):
-                    stock_dates[result['code']] = result['data']
-        if high_priority_stocks:
-            high_results = loop.run_until_complete(fetch_stocks_batch_async(high_priority_stocks, '高优先级'))
-            for result in high_results:
-                if result and (not isinstance(result, Exception)):
-                    stock_dates[result['code']] = result['data']
-        if normal_priority_stocks:
-            normal_results = loop.run_until_complete(fetch_stocks_batch_async(normal_priority_stocks, '普通优先级'))
-            for result in normal_results:
-                if result and (not isinstance(result, Exception)):
-                    stock_dates[result['code']] = result['data']
-    finally:
-        loop.close()
+        future.result(timeout=deadline)
+    except concurrent.futures.TimeoutError:
+        print(f'实时数据达到截止时间 {deadline} 秒，先使用已经返回的结果，其余的合并到下一次')
+    except Exception as e:
+        print(f'实时数据抓取异常: {e}')
+    stock_dates.update(collector.detach())
     print(f'\n最终成功获取{len(stock_dates)}个实时数据')
     failed_count = total_count - len(stock_dates)
     if failed_count > 0:
@@ -309,10 +512,65 @@ def get_real_time_data(progress_callback=None, strat_index=3, count=20, show_pro
     print(f'实时数据获取完成，用时 {used_time:.2f} 秒，成功 {len(stock_dates)} 个')
     return stock_dates
 
-@retry(stop=stop_after_attempt(3), wait=wait_random(1, 3))
+def get_quotes(prefix_codes, deadline=None, batch_size=QUOTE_BATCH_SIZE):
+    """只抓取指定股票的实时行情（修改参数后新增的股票用，不读取股票数据文件）
+    Args:
+        prefix_codes: 带交易所前缀的代码列表
+        deadline: 同 get_real_time_data，到时只返回已经到达的行情，其余的合并到下一次调用
+    Returns:
+        dict: {带前缀代码: Quote}
+    """
+    with _realtime_lock:
+        quotes = {code: _late_quotes.pop(code) for code in prefix_codes if code in _late_quotes}
+        still_pending = set(_pending_quote_codes)
+    codes = [code for code in prefix_codes if code not in quotes and code not in still_pending]
+    if not codes:
+        return quotes
+    collector = _QuoteCollector()
+    future = asyncio.run_coroutine_threadsafe(_fetch_quote_tiers_async([('补充', codes)], batch_size, collector), get_realtime_loop())
+    try:
+        future.result(timeout=deadline)
+    except concurrent.futures.TimeoutError:
+        print(f'补充行情达到截止时间 {deadline} 秒，其余的合并到下一次')
+    except Exception as e:
+        print(f'补充行情抓取异常: {e}')
+    quotes.update(collector.detach())
+    return quotes
+
+INDUSTRY_CACHE_ENABLED = True
+
+def get_industry_cache_path(path):
+    """行业表解析结果的二进制缓存路径（与行业表放在同一目录）"""
+    return path + '.pkl'
+
 def get_code_industry():
-    industry_dict = {}
+    """读取行业表 {代码: {'名字', '行业'}}
+    按 (修改时间, 文件大小) 缓存解析结果，行业表没变时直接读二进制缓存
+    """
     path = get_data_path('Table(1).xls')
+    stat = os.stat(path)
+    cache_key = (stat.st_mtime_ns, stat.st_size)
+    cache_path = get_industry_cache_path(path)
+    if INDUSTRY_CACHE_ENABLED and os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'rb') as f:
+                cached = pickle.load(f)
+            if cached.get('key') == cache_key:
+                return cached['industry']
+        except Exception as e:
+            print(f'读取缓存文件失败 {cache_path}: {e}')
+    industry_dict = parse_code_industry(path)
+    if INDUSTRY_CACHE_ENABLED:
+        try:
+            with open(cache_path, 'wb') as f:
+                pickle.dump({'key': cache_key, 'industry': industry_dict}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            print(f'写入缓存文件失败 {cache_path}: {e}')
+    return industry_dict
+
+@lazy_retry(3, 1, 3)
+def parse_code_industry(path):
+    industry_dict = {}
     with open(path, 'r', encoding='gbk') as f:
         lines = f.readlines()
         for line in lines[1:]:
@@ -327,205 +585,417 @@ def get_code_industry():
             industry_dict[code] = {'名字': name, '行业': industry}
     return industry_dict
 
-@retry(stop=stop_after_attempt(5), wait=wait_random(2, 5))
-def fetch_history_single(stock_code):
+HISTORY_WINDOW = 61
+HISTORY_STORE_FILENAME = '历史数据仓库.bin'
+LEGACY_HISTORY_STORE_FILENAME = '历史数据仓库.json'
+HISTORY_JSON_EXPORT_ENABLED = True
+
+def get_history_store_path():
+    """获取持久化历史数据仓库的文件路径（二进制格式，见 history_file）"""
+    return os.path.join(get_history_data_folder(), HISTORY_STORE_FILENAME)
+
+def read_history_store_header():
+    """只读取历史数据仓库的文件头
+    Returns:
+        dict: {'同步日期', '最新日期', '股票数', '天数'}，仓库不存在时返回None
+    """
+    return history_file.read_history_header(get_history_store_path())
+
+def load_legacy_history_store():
+    """读取旧版JSON格式的历史数据仓库，用于第一次升级到二进制格式"""
+    file_path = os.path.join(get_history_data_folder(), LEGACY_HISTORY_STORE_FILENAME)
+    if not os.path.exists(file_path):
+        return {'同步日期': '', '股票': {}}
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            raw = json.load(f)
+        stocks = {}
+        for stock_code, rows in raw.get('股票', {}).items():
+            stocks[stock_code] = [{'日期': row[0], '收盘价': row[1], '涨幅': row[2]} for row in rows]
+        print(f'从旧版历史数据仓库读取: {file_path} (共{len(stocks)}个股票)')
+        return {'同步日期': raw.get('同步日期', ''), '股票': stocks}
+    except Exception as e:
+        print(f'读取旧版历史数据仓库失败: {e}')
+        return {'同步日期': '', '股票': {}}
+
+_partial_store_cache = None
+
+def load_history_store(stock_codes=None):
+    """读取历史数据仓库
+    只读部分股票的结果会缓存一份（按文件修改时间、大小和股票集合判断），
+    后台预热读过之后，第一次获取历史数据时直接使用；调用方不能修改缓存返回的结果
+    Args:
+        stock_codes: 只读取这些股票的K线，None表示全部（只读部分股票时只会访问文件里对应的页）
+    Returns:
+        dict: {'同步日期': '2025-10-30', '股票': {代码: [{日期, 收盘价, 涨幅}, ...]}}，文件不存在时返回空仓库
+    """
+    global _partial_store_cache
+    file_path = get_history_store_path()
+    if not os.path.exists(file_path):
+        return load_legacy_history_store()
+    cache_key = None
+    if stock_codes is not None:
+        stat = os.stat(file_path)
+        cache_key = (stat.st_mtime_ns, stat.st_size, frozenset(stock_codes))
+        cached = _partial_store_cache
+        if cached is not None and cached[0] == cache_key:
+            return cached[1]
+    try:
+        with history_file.HistoryFile(file_path) as hf:
+            codes = hf.codes if stock_codes is None else [code for code in stock_codes if code in hf]
+            stocks = {stock_code: hf.prices(stock_code) for stock_code in codes}
+            store = {'同步日期': hf.sync_date, '股票': stocks}
+    except Exception as e:
+        print(f'读取历史数据仓库失败: {e}')
+        return {'同步日期': '', '股票': {}}
+    if cache_key is not None:
+        _partial_store_cache = (cache_key, store)
+    return store
+
+def save_history_store(store):
+    """保存历史数据仓库（二进制格式，先写临时文件再替换）"""
+    file_path = get_history_store_path()
+    history_file.write_history_file(file_path, store.get('股票', {}), store.get('同步日期', ''))
+    print(f"历史数据仓库已保存: {file_path} (共{len(store.get('股票', {}))}个股票)")
+
+def export_history_store_json(file_path=None):
+    """把历史数据仓库导出为可读的JSON（调试用），格式与旧版仓库相同
+    Returns:
+        str: 导出的文件路径
+    """
+    store = load_history_store()
+    if file_path is None:
+        file_path = get_history_store_path() + '.json'
+    raw = {'同步日期': store['同步日期'], '股票': {}}
+    for stock_code, prices in store['股票'].items():
+        raw['股票'][stock_code] = [[p['日期'], p['收盘价'], p['涨幅']] for p in prices]
+    with open(file_path, 'w', encoding='utf-8') as f:
+        json.dump(raw, f, ensure_ascii=False, indent=2)
+    print(f'历史数据仓库已导出: {file_path}')
+    return file_path
+
+def merge_history_prices(old_prices, new_prices, window=HISTORY_WINDOW):
+    """把新抓取的K线追加到已有K线后面
+    同一日期以新数据为准（盘中抓到的当天K线会被收盘后的数据覆盖），只保留最近window天
+    """
+    by_date = {p['日期']: p for p in old_prices}
+    for p in new_prices:
+        by_date[p['日期']] = p
+    merged = [by_date[d] for d in sorted(by_date)]
+    return merged[-window:]
+
+def count_missing_days(last_date, today_date):
+    """计算 last_date（不含）到 today_date（含）之间的交易日数（按交易日历，节假日不算），即需要补抓的天数"""
+    start = datetime.strptime(last_date, '%Y-%m-%d').date()
+    end = datetime.strptime(today_date, '%Y-%m-%d').date()
+    return trading_calendar.trading_days_between(start, end)
+
+HISTORY_KLINE_BASE_URL = os.environ.get('THREE_SUN_KLINE_URL', 'https://push2his.eastmoney.com/api/qt/stock/fflow/daykline/get')
+HISTORY_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+HISTORY_CONCURRENCY = 64
+HISTORY_CRAWL_DEADLINE = 120
+HISTORY_REQUEST_TIMEOUT = 10
+HISTORY_RETRY_BASE_DELAY = 0.5
+HISTORY_RETRY_MAX_DELAY = 8
+
+def get_history_kline_url(stock_code, limit=0):
+    """东方财富日K线接口地址，limit为0表示全部K线"""
+    if stock_code.startswith(('0', '2', '3')):
+        secid = 0
+    else:
+        secid = 1
+    stock_code_with_prefix = f'{secid}.{stock_code}'
+    return f'{HISTORY_KLINE_BASE_URL}?lmt={limit}&klt=101&fields1=f1%2Cf2%2Cf3%2Cf7&fields2=f51%2Cf52%2Cf53%2Cf54%2Cf55%2Cf56%2Cf57%2Cf58%2Cf59%2Cf60%2Cf61%2Cf62%2Cf63%2Cf64%2Cf65&ut=b2884a393a59ad64002292a3e90d46a5&secid={stock_code_with_prefix}'
+
+def parse_history_klines(content):
+    """解析东方财富日K线接口的返回（可能带JSONP括号）
+    Returns:
+        list: [{日期, 收盘价, 涨幅}, ...]；接口返回错误码时返回None，没有K线时返回空列表
+    Raises:
+        ValueError: 返回内容不是合法JSON
+    """
+    start = content.find('(')
+    end = content.rfind(')')
+    if start != -1 and end != -1:
+        json_str = content[start + 1:end]
+    else:
+        json_str = content
+    data = json.loads(json_str)
+    if data.get('rc') != 0 or 'data' not in data:
+        return None
+    klines = (data['data'] or {}).get('klines') or []
+    prices = []
+    for kline in klines:
+        parts = kline.split(',')
+        prices.append({'日期': parts[0], '收盘价': float(parts[-4]), '涨幅': float(parts[-3])})
+    return prices
+
+@lazy_retry(5, 2, 5)
+def fetch_history_klines(stock_code, limit=0):
+    """从东方财富抓取日K线（同步版本，单只股票）
+    Args:
+        stock_code: 股票代码（不带前缀）
+        limit: 只取最近多少根K线，0表示全部
+    Returns:
+        list: [{日期, 收盘价, 涨幅}, ...]，失败返回None
+    """
     try:
         session = get_session()
-        if stock_code.startswith(('0', '2', '3')):
-            secid = 0
-        else:
-            secid = 1
-        stock_code_with_prefix = f'{secid}.{stock_code}'
-        url = f'https://push2his.eastmoney.com/api/qt/stock/fflow/daykline/get?lmt=0&klt=101&fields1=f1%2Cf2%2Cf3%2Cf7&fields2=f51%2Cf52%2Cf53%2Cf54%2Cf55%2Cf56%2Cf57%2Cf58%2Cf59%2Cf60%2Cf61%2Cf62%2Cf63%2Cf64%2Cf65&ut=b2884a393a59ad64002292a3e90d46a5&secid={stock_code_with_prefix}'
-        res = session.get(url, timeout=10)
-        content = res.text
-        start = content.find('(')
-        end = content.rfind(')')
-        if start != -1 and end != -1:
-            json_str = content[start + 1:end]
-        else:
-            json_str = content
-        data = json.loads(json_str)
-        if data.get('rc') != 0 or 'data' not in data:
-            return
-        klines = data['data'].get('klines', [])
-        if not klines:
-            return
-        prices = []
-        for kline in klines:
-            parts = kline.split(',')
-            date = parts[0]
-            close_price = float(parts[-4])
-            change_pct = float(parts[-3])
-            prices.append({'日期': date, '收盘价': close_price, '涨幅': change_pct})
-        if len(prices) < 1:
-            return
-        if len(prices) > 61:
-            prices = prices[-61:]
-        prices_for_calc = prices[:-1]
-        if len(prices_for_calc) < 1:
-            return
-        close_prices_for_calc = [p['收盘价'] for p in prices_for_calc]
-        if len(close_prices_for_calc) >= 30:
-            prices_30d = close_prices_for_calc[-30:]
-        else:
-            prices_30d = close_prices_for_calc
-        max_30d = max(prices_30d)
-        min_30d = min(prices_30d)
-        if len(close_prices_for_calc) >= 60:
-            prices_60d = close_prices_for_calc[-60:]
-        else:
-            prices_60d = close_prices_for_calc
-        max_60d = max(prices_60d)
-        min_60d = min(prices_60d)
-        historical_prices = prices
-        time_info = get_current_time_info()
-        weekday = time_info['星期']
-        hour = time_info['小时']
-        minute = time_info['分钟']
-        is_trading_time = weekday < 5 and (hour == 9 and minute >= 15 or 9 < hour < 15 or (hour == 15 and minute == 0))
-        if is_trading_time:
-            yesterday_close = prices[-1]['收盘价'] if len(prices) >= 1 else 0
-            yesterday_change = prices[-1]['涨幅'] if len(prices) >= 1 else 0
-        else:
-            yesterday_close = prices[-2]['收盘价'] if len(prices) >= 2 else prices[-1]['收盘价'] if len(prices) >= 1 else 0
-            yesterday_change = prices[-2]['涨幅'] if len(prices) >= 2 else prices[-1]['涨幅'] if len(prices) >= 1 else 0
-        return {'代码': stock_code, '昨日收盘价': yesterday_close, '昨日涨幅': yesterday_change, '30日最高价': max_30d, '30日最低价': min_30d, '60日最高价': max_60d, '60日最低价': min_60d, '历史价格列表': historical_prices}
-    except json.JSONDecodeError as e:
-        return
+        res = session.get(get_history_kline_url(stock_code, limit), timeout=HISTORY_REQUEST_TIMEOUT)
+        return parse_history_klines(res.text) or None
     except Exception as e:
         return None
 
-def get_history_data(progress_callback=None, strat_index=3, count=20, show_progress=True):
-    """获取历史数据（优先从文件读取，不存在则爬取并保存）
+async def fetch_history_klines_async(session, stock_code, limit, semaphore, deadline):
+    """异步抓取日K线，失败后按带抖动的指数退避重试，直到成功或超过deadline
+    接口正常返回但没有K线时不再重试
+    Args:
+        deadline: time.monotonic() 的截止时间
+    Returns:
+        list: [{日期, 收盘价, 涨幅}, ...]，失败返回None
+    """
+    url = get_history_kline_url(stock_code, limit)
+    attempt = 0
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        try:
+            async with semaphore:
+                content = await adaptive_limiter.fetch_text(session, url, min(HISTORY_REQUEST_TIMEOUT, remaining), deadline)
+            prices = parse_history_klines(content)
+            if prices is not None:
+                return prices or None
+        except Exception as e:
+            pass
+        delay = min(HISTORY_RETRY_MAX_DELAY, HISTORY_RETRY_BASE_DELAY * 2 ** attempt) * random.uniform(0.5, 1.5)
+        if time.monotonic() + delay >= deadline:
+            metrics.increment('失败_历史K线')
+            return None
+        metrics.increment('重试_历史K线')
+        await asyncio.sleep(delay)
+        attempt += 1
+
+async def crawl_history_async(fetch_plan, progress_callback=None, concurrency=HISTORY_CONCURRENCY, deadline_seconds=HISTORY_CRAWL_DEADLINE):
+    """共用一个连接池并发抓取日K线，失败的股票在各自的协程里重试，整体不超过deadline_seconds
+    Args:
+        fetch_plan: [(股票代码, limit), ...]
+        progress_callback: 每完成一只股票调用一次 progress_callback(已完成数, 总数)
+    Returns:
+        dict: {股票代码: K线列表或None}
+    """
+    deadline = time.monotonic() + deadline_seconds
+    connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=concurrency, ttl_dns_cache=600)
+    timeout = aiohttp.ClientTimeout(total=HISTORY_REQUEST_TIMEOUT, connect=5)
+    results = {}
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers={'user-agent': HISTORY_USER_AGENT}) as session:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch_one(stock_code, limit):
+            return (stock_code, await fetch_history_klines_async(session, stock_code, limit, semaphore, deadline))
+        tasks = [fetch_one(stock_code, limit) for stock_code, limit in fetch_plan]
+        for future in asyncio.as_completed(tasks):
+            stock_code, prices = await future
+            results[stock_code] = prices
+            if progress_callback:
+                progress_callback(len(results), len(fetch_plan))
+    return results
+
+def crawl_history(fetch_plan, progress_callback=None, concurrency=HISTORY_CONCURRENCY, deadline_seconds=HISTORY_CRAWL_DEADLINE):
+    """crawl_history_async 的同步入口（在新的事件循环里运行）"""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(crawl_history_async(fetch_plan, progress_callback, concurrency, deadline_seconds))
+    finally:
+        loop.close()
+
+def build_history_record(stock_code, prices, is_trading_time=None):
+    """根据K线列表计算昨日收盘价、30/60日最高最低价等字段
+    Args:
+        is_trading_time: 是否交易时间（决定最后一根K线算不算昨天），None 时按当前时间查交易日历；
+            批量生成时由调用方算一次传进来
+    Returns:
+        dict: 历史数据记录，K线不足两根时返回None
+    """
+    if len(prices) < 1:
+        return
+    if len(prices) > HISTORY_WINDOW:
+        prices = prices[-HISTORY_WINDOW:]
+    prices_for_calc = prices[:-1]
+    if len(prices_for_calc) < 1:
+        return
+    close_prices_for_calc = [p['收盘价'] for p in prices_for_calc]
+    if len(close_prices_for_calc) >= 30:
+        prices_30d = close_prices_for_calc[-30:]
+    else:
+        prices_30d = close_prices_for_calc
+    max_30d = max(prices_30d)
+    min_30d = min(prices_30d)
+    if len(close_prices_for_calc) >= 60:
+        prices_60d = close_prices_for_calc[-60:]
+    else:
+        prices_60d = close_prices_for_calc
+    max_60d = max(prices_60d)
+    min_60d = min(prices_60d)
+    historical_prices = prices
+    if is_trading_time is None:
+        is_trading_time = trading_calendar.is_trading_time()
+    if is_trading_time:
+        yesterday_close = prices[-1]['收盘价'] if len(prices) >= 1 else 0
+        yesterday_change = prices[-1]['涨幅'] if len(prices) >= 1 else 0
+    else:
+        yesterday_close = prices[-2]['收盘价'] if len(prices) >= 2 else prices[-1]['收盘价'] if len(prices) >= 1 else 0
+        yesterday_change = prices[-2]['涨幅'] if len(prices) >= 2 else prices[-1]['涨幅'] if len(prices) >= 1 else 0
+    return {'代码': stock_code, '昨日收盘价': yesterday_close, '昨日涨幅': yesterday_change, '30日最高价': max_30d, '30日最低价': min_30d, '60日最高价': max_60d, '60日最低价': min_60d, '历史价格列表': historical_prices}
+
+def build_history_records(stored_prices, stock_codes, is_trading_time=None):
+    """按仓库里的K线批量生成历史数据记录，没有K线或K线不足的股票跳过
+    Args:
+        stored_prices: {代码: [{日期, 收盘价, 涨幅}, ...]}
+        is_trading_time: 见 build_history_record，None 时按当前时间查一次交易日历
+    Returns:
+        dict: {代码: 历史数据记录}
+    """
+    if is_trading_time is None:
+        is_trading_time = trading_calendar.is_trading_time()
+    records = {}
+    for stock_code in stock_codes:
+        prices = stored_prices.get(stock_code)
+        if not prices:
+            continue
+        record = build_history_record(stock_code, prices, is_trading_time)
+        if record:
+            records[stock_code] = record
+    return records
+
+def load_history_records(stock_codes, is_trading_time=None):
+    """只从历史数据仓库读取这些股票的K线并生成历史数据记录，不请求网络（计算子进程自己读历史数据用）"""
+    return build_history_records(load_history_store(stock_codes)['股票'], stock_codes, is_trading_time)
+
+def fetch_history_single(stock_code, limit=0):
+    prices = fetch_history_klines(stock_code, limit)
+    if not prices:
+        return
+    return build_history_record(stock_code, prices)
+
+def get_history_data(progress_callback=None, strat_index=3, count=20, show_progress=True, is_trading_time=None):
+    """获取历史数据（基于持久化仓库增量更新）
+    仓库里已有的股票只补抓最后一个已知日期之后的K线，新股票才抓取全部K线；
+    当天已经同步过的仓库直接使用，不再请求网络
     Args:
         progress_callback: 进度回调函数
         strat_index: 开始索引
         count: 文件数量
         show_progress: 是否显示进度
+        is_trading_time: 见 build_history_record，None 时按当前时间判断
     Returns:
         dict: 历史数据字典
     """
-    today_date = datetime.now().strftime('%Y-%m-%d')
-    saved_data = load_history_data_from_file(today_date)
-    if saved_data:
-        from datetime import timedelta
-        yesterday = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
-        if len(saved_data) > 0:
-            sample_code = list(saved_data.keys())[0]
-            price_list = saved_data[sample_code].get('历史价格列表', [])
-            if price_list:
-                latest_date = price_list[-1]['日期']
-                if latest_date >= yesterday:
-                    print(f'使用今天的历史数据文件 ({today_date}), 最新日期: {latest_date}')
-                    if progress_callback and show_progress:
-                        total_count = len(saved_data)
-                        progress_callback(total_count, total_count, '从文件加载历史数据完成')
-                    return saved_data
-                print(f'历史数据文件过旧（最新日期: {latest_date}，应至少包含: {yesterday}），重新爬取...')
-                try:
-                    import os
-                    folder_path = get_history_data_folder()
-                    filename = get_history_data_filename(today_date)
-                    file_path = os.path.join(folder_path, filename)
-                    if os.path.exists(file_path):
-                        os.remove(file_path)
-                        print(f'已删除过期缓存文件: {file_path}')
-                except Exception as e:
-                    print(f'删除过期缓存文件失败: {e}')
-            else:
-                print('历史数据文件无效（无价格数据），重新爬取...')
-        else:
-            print('历史数据文件为空，重新爬取...')
-    print('今天的历史数据文件不存在，开始爬取...')
     all_data = get_folder_data(strat_index=strat_index, count=count)
     all_stock_codes = []
-    stock_code_data = {}
-    failed_stocks = []
     for date, stocks_list in all_data.items():
         for stock_data in stocks_list:
             stock_code = stock_data[0]
             all_stock_codes.append(stock_code)
     unique_stock_codes = list(set(all_stock_codes))
-    total_count = len(unique_stock_codes)
-    print(f'开始爬取 {total_count} 个股票的历史数据...')
-    if progress_callback and show_progress:
-        progress_callback(0, total_count, '开始爬取历史数据...')
-    completed = [0]
+    return get_history_for_codes(unique_stock_codes, progress_callback=progress_callback, show_progress=show_progress, is_trading_time=is_trading_time)
 
-    def fetch_with_progress(stock_code):
-        try:
-            result = fetch_history_single(stock_code)
-            completed[0] += 1
-            if progress_callback and show_progress:
-                progress_callback(completed[0], total_count, f'历史数据: {completed[0]}/{total_count}')
-            return (stock_code, result)
-        except Exception as e:
-            completed[0] += 1
-            if progress_callback and show_progress:
-                progress_callback(completed[0], total_count, f'历史数据: {completed[0]}/{total_count}')
-            return (stock_code, None)
-    with ThreadPoolExecutor(max_workers=250) as executor:
-        results = executor.map(fetch_with_progress, unique_stock_codes)
-    for stock_code, result in results:
-        if result:
-            stock_code_data[result['代码']] = result
-        else:
-            failed_stocks.append(stock_code)
-    if failed_stocks:
-        print(f'\n首次采集失败{len(failed_stocks)}个股票，开始二次重试...')
-        retry_success = []
-        retry_failed = []
-        for i, stock_code in enumerate(failed_stocks):
+def get_history_for_codes(unique_stock_codes, progress_callback=None, show_progress=True, export_json=True, is_trading_time=None):
+    """获取指定股票的历史数据（基于持久化仓库增量更新，规则同 get_history_data）
+    Args:
+        unique_stock_codes: 股票代码列表（不重复）
+        export_json: 抓取过网络时是否把结果另存为当天的历史数据json；只补几个股票时传False，避免覆盖整份文件
+        is_trading_time: 见 build_history_record，None 时按当前时间判断；给已有的历史数据补股票时传和已有数据相同的值
+    Returns:
+        dict: 历史数据字典
+    """
+    today_date = datetime.now().strftime('%Y-%m-%d')
+    header = read_history_store_header()
+    partial_store = bool(header) and header['同步日期'] == today_date
+    store = load_history_store(unique_stock_codes if partial_store else None)
+    if not header and (not store['股票']):
+        legacy_data = load_history_data_from_file(today_date)
+        if legacy_data:
+            print('历史数据仓库为空，使用今天的历史数据文件初始化仓库')
+            for stock_code, stock_data in legacy_data.items():
+                store['股票'][stock_code] = stock_data.get('历史价格列表', [])
+    stored_prices = store['股票']
+    synced_today = store['同步日期'] == today_date
+    fetch_plan = []
+    for stock_code in unique_stock_codes:
+        old_prices = stored_prices.get(stock_code)
+        if not old_prices:
+            fetch_plan.append((stock_code, 0))
+        elif not synced_today:
+            missing_days = count_missing_days(old_prices[-1]['日期'], today_date)
+            if missing_days >= HISTORY_WINDOW:
+                fetch_plan.append((stock_code, 0))
+            else:
+                fetch_plan.append((stock_code, missing_days + 1))
+    if fetch_plan and partial_store:
+        store = load_history_store()
+        stored_prices = store['股票']
+    total_count = len(fetch_plan)
+    failed_stocks = []
+    if fetch_plan:
+        full_count = sum((1 for _, limit in fetch_plan if limit == 0))
+        print(f'历史数据仓库需要更新 {total_count} 个股票（全量 {full_count} 个，增量 {total_count - full_count} 个）...')
+        if progress_callback and show_progress:
+            progress_callback(0, total_count, '开始更新历史数据...')
+        crawl_start = time.time()
+
+        def crawl_progress(done, total):
             if progress_callback and show_progress:
-                progress_callback(total_count + i + 1, total_count + len(failed_stocks), f'二次重试: {i + 1}/{len(failed_stocks)}')
-            try:
-                time.sleep(1)
-                result = fetch_history_single(stock_code)
-                if result:
-                    stock_code_data[result['代码']] = result
-                    retry_success.append(stock_code)
-                    print(f'  ✓ {stock_code} 二次重试成功')
-                else:
-                    retry_failed.append(stock_code)
-            except Exception as e:
-                retry_failed.append(stock_code)
-                print(f'  ✗ {stock_code} 二次重试仍失败: {e}')
-        failed_stocks = retry_failed
-        print(f'二次重试完成: 成功{len(retry_success)}个，仍失败{len(retry_failed)}个')
+                progress_callback(done, total, f'历史数据: {done}/{total}')
+        with metrics.timer('抓取_历史K线'):
+            results = crawl_history(fetch_plan, progress_callback=crawl_progress)
+        for stock_code, limit in fetch_plan:
+            prices = results.get(stock_code)
+            if prices:
+                stored_prices[stock_code] = merge_history_prices(stored_prices.get(stock_code, []), prices)
+            else:
+                failed_stocks.append(stock_code)
+        print(f'历史数据抓取完成，用时 {time.time() - crawl_start:.2f} 秒，成功 {total_count - len(failed_stocks)}/{total_count} 个')
+        if failed_stocks:
+            print(f'最终失败{len(failed_stocks)}个股票')
+            save_failed_stocks(failed_stocks, today_date)
+        store['同步日期'] = today_date
+        save_history_store(store)
+    else:
+        print(f'历史数据仓库今天已同步 ({today_date})，无需请求网络')
+        total_count = len(unique_stock_codes)
+    stock_code_data = build_history_records(stored_prices, unique_stock_codes, is_trading_time)
     print(f'\n最终成功获取{len(stock_code_data)}个股票数据')
-    if failed_stocks:
-        print(f'最终失败{len(failed_stocks)}个股票')
-        save_failed_stocks(failed_stocks, today_date)
     if progress_callback and show_progress:
-        progress_callback(total_count, total_count, '历史数据爬取完成')
-    save_history_data_to_file(stock_code_data, today_date)
+        progress_callback(total_count, total_count, '历史数据更新完成')
+    if fetch_plan and export_json and HISTORY_JSON_EXPORT_ENABLED:
+        save_history_data_to_file(stock_code_data, today_date)
     return stock_code_data
 
-def get_current_time_info():
-    now = datetime.now()
-    return {'小时': now.hour, '分钟': now.minute, '秒': now.second, '星期': now.weekday(), '时间': now.strftime('%H:%M:%S'), '日期': now.strftime('%Y-%m-%d')}
-
-def should_use_yesterday_data():
-    time_info = get_current_time_info()
-    hour = time_info['小时']
-    minute = time_info['分钟']
-    if hour < 9 or (hour == 9 and minute < 15):
-        return True
-    return False
-
-def get_data_source_index():
-    time_info = get_current_time_info()
-    weekday = time_info['星期']
-    if weekday == 5:
-        return (2, '周六使用周五数据')
-    if weekday == 6:
-        return (3, '周日使用周五数据')
-    if should_use_yesterday_data():
-        if weekday == 0:
-            return (4, '周一9:15前使用周五数据')
-        return (2, '9:15前使用昨天数据')
-    return (1, '使用最新实时数据')
+def get_current_time_info(now=None):
+    """当前（或指定的 now）时间的各个字段，回放录制的行情时传模拟时钟的时间"""
+    now = now or datetime.now()
+    return {'小时': now.hour, '分钟': now.minute, '秒': now.second, '星期': now.weekday(), '时间': now.strftime('%H:%M:%S'), '日期': now.strftime('%Y-%m-%d'), '交易状态': trading_calendar.session_state(now)}
+
+def should_use_yesterday_data(now=None):
+    """今天还没开盘（9:15前或休市日），应该使用上一个交易日的数据"""
+    return trading_calendar.session_state(now) in (trading_calendar.SESSION_CLOSED, trading_calendar.SESSION_PRE_OPEN)
+
+def get_data_source_index(now=None):
+    """按交易日历选择股票数据文件的起始索引
+
+    开盘后用1；还没开盘或休市时往前数到上一个交易日，索引是1加上距离那天的自然日数
+    （周六2、周日3、周一9:15前4，长假后第一天开盘前按整个假期往前数）
+    Returns:
+        tuple: (索引, 原因)
+    """
+    now = now or datetime.now()
+    if not should_use_yesterday_data(now):
+        return (1, '使用最新实时数据')
+    source_day = trading_calendar.previous_trading_day(now)
+    index = 1 + (now.date() - source_day).days
+    when = '休市日' if not trading_calendar.is_trading_day(now) else '9:15前'
+    return (index, f"{when}使用上一个交易日（{source_day.strftime('%Y-%m-%d')}）的数据")
 
 def check_data_updated(stock_code, old_price):
     try:
@@ -535,7 +1005,7 @@ def check_data_updated(stock_code, old_price):
             prefix_stock = 'sz' + stock_code
         result = fetch_single_stock(prefix_stock)
         if result and result['data']:
-            new_price = result['data'].get('现价', '')
+            new_price = result['data'].price
             return (new_price != old_price, new_price)
         return (False, old_price)
     except:
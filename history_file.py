@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+import mmap
+import os
+import struct
+import numpy as np
+from history_matrix import date_to_int, int_to_date
+
+MAGIC = b'TSHIST01'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<8sIIIii')
+HEADER_SIZE = 64
+CODE_DTYPE = np.dtype('S8')
+
+def _align8(offset):
+    return (offset + 7) // 8 * 8
+
+def _layout(n_stocks, n_dates):
+    """各段在文件中的偏移：头部 | 日期轴 int32[D] | 代码索引 S8[N] | 收盘价 float64[N, D] | 涨幅 float64[N, D]"""
+    dates_offset = HEADER_SIZE
+    codes_offset = dates_offset + 4 * n_dates
+    closes_offset = _align8(codes_offset + CODE_DTYPE.itemsize * n_stocks)
+    changes_offset = closes_offset + 8 * n_stocks * n_dates
+    end = changes_offset + 8 * n_stocks * n_dates
+    return (dates_offset, codes_offset, closes_offset, changes_offset, end)
+
+def write_history_file(file_path, stocks, sync_date=''):
+    """把 {代码: [{日期, 收盘价, 涨幅}, ...]} 写成二进制历史文件（先写临时文件再替换）
+    所有股票共用一条按日期排序的日期轴，某只股票没有K线的日期记为NaN
+    Args:
+        file_path: 目标文件路径
+        stocks: 股票K线字典
+        sync_date: 同步日期 '2025-10-30'，空串表示未同步
+    """
+    codes = list(stocks.keys())
+    date_ints = sorted({date_to_int(p['日期']) for prices in stocks.values() for p in prices})
+    column = {d: j for j, d in enumerate(date_ints)}
+    n_stocks, n_dates = (len(codes), len(date_ints))
+    closes = np.full((n_stocks, n_dates), np.nan)
+    changes = np.full((n_stocks, n_dates), np.nan)
+    for i, stock_code in enumerate(codes):
+        for p in stocks[stock_code]:
+            j = column[date_to_int(p['日期'])]
+            closes[i, j] = p['收盘价']
+            changes[i, j] = p['涨幅']
+    dates_offset, codes_offset, closes_offset, changes_offset, end = _layout(n_stocks, n_dates)
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, n_stocks, n_dates, date_to_int(sync_date) if sync_date else 0, date_ints[-1] if date_ints else 0)
+    tmp_path = file_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(header.ljust(HEADER_SIZE, b'\x00'))
+        f.write(np.array(date_ints, dtype='<i4').tobytes())
+        f.write(np.array([stock_code.encode('ascii') for stock_code in codes], dtype=CODE_DTYPE).tobytes())
+        f.write(b'\x00' * (closes_offset - f.tell()))
+        f.write(closes.astype('<f8').tobytes())
+        f.write(changes.astype('<f8').tobytes())
+    os.replace(tmp_path, file_path)
+
+def read_history_header(file_path):
+    """只读取文件头，用于判断数据是否新鲜
+    Returns:
+        dict: {'同步日期', '最新日期', '股票数', '天数'}，文件不存在或格式不对返回None
+    """
+    try:
+        with open(file_path, 'rb') as f:
+            raw = f.read(HEADER.size)
+    except OSError:
+        return None
+    if len(raw) < HEADER.size:
+        return None
+    magic, version, n_stocks, n_dates, sync_date, latest_date = HEADER.unpack(raw)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        return None
+    return {'同步日期': int_to_date(sync_date) if sync_date else '', '最新日期': int_to_date(latest_date) if latest_date else '', '股票数': n_stocks, '天数': n_dates}
+
+class HistoryFile:
+    """用mmap打开的二进制历史文件
+
+    打开时只解析文件头、日期轴和代码索引，某只股票的K线在读取时才会访问对应的页；
+    用完需要close()（或用with），Windows上文件被映射时不能被替换
+    """
+
+    def __init__(self, file_path):
+        self._file = open(file_path, 'rb')
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f'历史文件为空: {file_path}')
+        magic, version, n_stocks, n_dates, sync_date, latest_date = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self.close()
+            raise ValueError(f'不是可识别的历史文件: {file_path}')
+        dates_offset, codes_offset, closes_offset, changes_offset, end = _layout(n_stocks, n_dates)
+        if len(self._mmap) < end:
+            self.close()
+            raise ValueError(f'历史文件不完整: {file_path}')
+        self.sync_date = int_to_date(sync_date) if sync_date else ''
+        self.latest_date = int_to_date(latest_date) if latest_date else ''
+        self.date_ints = np.frombuffer(self._mmap, dtype='<i4', count=n_dates, offset=dates_offset)
+        self.dates = [int_to_date(d) for d in self.date_ints.tolist()]
+        codes = np.frombuffer(self._mmap, dtype=CODE_DTYPE, count=n_stocks, offset=codes_offset)
+        self.codes = [code.decode('ascii') for code in codes.tolist()]
+        self.index = {stock_code: i for i, stock_code in enumerate(self.codes)}
+        self.closes = np.frombuffer(self._mmap, dtype='<f8', count=n_stocks * n_dates, offset=closes_offset).reshape(n_stocks, n_dates)
+        self.changes = np.frombuffer(self._mmap, dtype='<f8', count=n_stocks * n_dates, offset=changes_offset).reshape(n_stocks, n_dates)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __contains__(self, stock_code):
+        return stock_code in self.index
+
+    def prices(self, stock_code):
+        """读取一只股票的K线，返回 [{日期, 收盘价, 涨幅}, ...]，没有这只股票返回None"""
+        i = self.index.get(stock_code)
+        if i is None:
+            return None
+        closes = self.closes[i]
+        columns = np.flatnonzero(~np.isnan(closes)).tolist()
+        close_values = closes[columns].tolist()
+        change_values = self.changes[i][columns].tolist()
+        dates = self.dates
+        return [{'日期': dates[j], '收盘价': c, '涨幅': p} for j, c, p in zip(columns, close_values, change_values)]
+
+    def close(self):
+        self.date_ints = self.closes = self.changes = None
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
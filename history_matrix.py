@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+STRICT_LIMIT_PCT = 19.8
+LOOSE_LIMIT_PCT = 9.8
+
+def get_limit_threshold(stock_code):
+    """严格标准的涨停阈值：3开头和68开头需19.8%，其他9.8%"""
+    if stock_code.startswith('3') or stock_code.startswith('68'):
+        return STRICT_LIMIT_PCT
+    return LOOSE_LIMIT_PCT
+
+def date_to_int(date_str):
+    """'2025-10-30' -> 20251030"""
+    return int(date_str[0:4]) * 10000 + int(date_str[5:7]) * 100 + int(date_str[8:10])
+
+def int_to_date(value):
+    """20251030 -> '2025-10-30'"""
+    value = int(value)
+    return f'{value // 10000:04d}-{value // 100 % 100:02d}-{value % 100:02d}'
+
+class HistoryMatrix:
+    """历史K线的列式存储（股票 × 天）
+
+    每只股票的K线右对齐放入同一宽度的矩阵，最后一列是每只股票自己的最后一根K线，
+    不足的部分左侧用NaN填充。这样列号之差就等于原来 历史价格列表 里的索引之差，
+    停牌造成的日期缺口不会打断连续涨停的判断。
+    """
+
+    def __init__(self, history_data):
+        self.codes = list(history_data.keys())
+        self.index = {stock_code: i for i, stock_code in enumerate(self.codes)}
+        price_lists = [history_data[stock_code].get('历史价格列表', []) for stock_code in self.codes]
+        rows = len(self.codes)
+        self.width = max((len(price_list) for price_list in price_lists), default=0)
+        self.lengths = np.array([len(price_list) for price_list in price_lists], dtype=np.int32)
+        self.closes = np.full((rows, self.width), np.nan)
+        self.changes = np.full((rows, self.width), np.nan)
+        self.dates = np.zeros((rows, self.width), dtype=np.int32)
+        for i, price_list in enumerate(price_lists):
+            if not price_list:
+                continue
+            offset = self.width - len(price_list)
+            self.closes[i, offset:] = [p['收盘价'] for p in price_list]
+            self.changes[i, offset:] = [p['涨幅'] for p in price_list]
+            self.dates[i, offset:] = [date_to_int(p['日期']) for p in price_list]
+        self.valid = self.dates > 0
+        self.strict_thresholds = np.array([get_limit_threshold(stock_code) for stock_code in self.codes])
+        self.loose_thresholds = np.full(rows, LOOSE_LIMIT_PCT)
+        self.yesterday_close = np.array([float(history_data[stock_code].get('昨日收盘价', 0) or 0) for stock_code in self.codes])
+
+    @classmethod
+    def from_arrays(cls, codes, closes, changes, dates, yesterday_close, strict_thresholds=None):
+        """直接用已经右对齐的矩阵构造（不经过 历史价格列表），回测按天截取历史时使用
+        Args:
+            closes/changes: float64[N, W]，左侧不足的部分为NaN
+            dates: int32[N, W]，yyyymmdd整数，不足的部分为0
+            yesterday_close: float64[N]
+            strict_thresholds: 预先算好的严格阈值向量，None时按代码计算
+        """
+        matrix = cls.__new__(cls)
+        matrix.codes = list(codes)
+        matrix.index = {stock_code: i for i, stock_code in enumerate(matrix.codes)}
+        matrix.width = closes.shape[1]
+        matrix.closes = closes
+        matrix.changes = changes
+        matrix.dates = dates
+        matrix.valid = dates > 0
+        matrix.lengths = matrix.valid.sum(axis=1).astype(np.int32)
+        matrix.strict_thresholds = strict_thresholds if strict_thresholds is not None else np.array([get_limit_threshold(stock_code) for stock_code in matrix.codes])
+        matrix.loose_thresholds = np.full(len(matrix.codes), LOOSE_LIMIT_PCT)
+        matrix.yesterday_close = yesterday_close
+        return matrix
+
+    def limit_up_mask(self, thresholds, concept_dates=None):
+        """涨停日布尔矩阵
+        Args:
+            thresholds: 每只股票的涨停阈值向量
+            concept_dates: 只统计这些日期（'2025-10-30'格式的集合），None表示全部
+        """
+        with np.errstate(invalid='ignore'):
+            mask = self.valid & (self.changes >= thresholds[:, None])
+        if concept_dates:
+            date_ints = np.array(sorted((date_to_int(d) for d in concept_dates)), dtype=np.int32)
+            mask &= np.isin(self.dates, date_ints)
+        return mask
+
+def _run_lengths(mask):
+    """每个位置上以该位置结尾的连续True个数"""
+    runs = np.zeros(mask.shape, dtype=np.int32)
+    if mask.shape[1] == 0:
+        return runs
+    runs[:, 0] = mask[:, 0]
+    for j in range(1, mask.shape[1]):
+        runs[:, j] = (runs[:, j - 1] + 1) * mask[:, j]
+    return runs
+
+def _last_true_column(mask):
+    """每行最后一个True所在的列，没有True时为-1"""
+    width = mask.shape[1]
+    if width == 0:
+        return np.full(mask.shape[0], -1, dtype=np.int64)
+    last = width - 1 - np.argmax(mask[:, ::-1], axis=1)
+    return np.where(mask.any(axis=1), last, -1)
+
+def compute_limit_up_stats(matrix, mask):
+    """一次性计算所有股票的涨停统计
+    Returns:
+        dict: 每个键对应一个长度为股票数的向量
+            全部涨停天数、涨停数（涨停段数）、单日涨停数、最大连续涨停数（不足2记0）、
+            离最新日期天数（无涨停为-1）、最后涨停日期（yyyymmdd整数，无涨停为0）
+    """
+    rows, width = mask.shape
+    prev_mask = np.zeros_like(mask)
+    next_mask = np.zeros_like(mask)
+    if width > 1:
+        prev_mask[:, 1:] = mask[:, :-1]
+        next_mask[:, :-1] = mask[:, 1:]
+    starts = mask & ~prev_mask
+    runs = _run_lengths(mask)
+    max_run = runs.max(axis=1) if width else np.zeros(rows, dtype=np.int32)
+    max_streak = np.where(max_run >= 2, max_run, 0)
+    streak_end_col = _last_true_column(mask & ~next_mask & (runs >= 2))
+    last_limit_col = _last_true_column(mask)
+    ref_col = np.where(max_streak >= 2, streak_end_col, last_limit_col)
+    has_limit = last_limit_col >= 0
+    days_diff = np.where(has_limit, width - 1 - ref_col, -1)
+    last_date = np.where(has_limit, matrix.dates[np.arange(rows), np.maximum(ref_col, 0)], 0) if width else np.zeros(rows, dtype=np.int32)
+    return {'全部涨停天数': mask.sum(axis=1), '涨停数': starts.sum(axis=1), '单日涨停数': (starts & ~next_mask).sum(axis=1), '最大连续涨停数': max_streak, '离最新日期天数': days_diff, '最后涨停日期': last_date}
+
+def compute_trend_stats(matrix):
+    """计算阳天数相关的历史部分
+    Returns:
+        dict: 收盘价连续上涨天数（以最后一根/倒数第二根K线结尾）、
+            前N天阳天数（从倒数第三根K线往前数涨幅>0的连续天数）、最后两根K线的收盘价
+    """
+    rows, width = matrix.closes.shape
+    rising = np.zeros((rows, width), dtype=bool)
+    if width > 1:
+        with np.errstate(invalid='ignore'):
+            rising[:, 1:] = matrix.closes[:, 1:] > matrix.closes[:, :-1]
+    rise_runs = _run_lengths(rising)
+    with np.errstate(invalid='ignore'):
+        positive_runs = _run_lengths(matrix.changes > 0)
+    zeros = np.zeros(rows, dtype=np.int32)
+    nans = np.full(rows, np.nan)
+    return {'上涨天数_最后': rise_runs[:, -1] if width >= 1 else zeros, '上涨天数_倒数第二': rise_runs[:, -2] if width >= 2 else zeros, '前N天阳天数': positive_runs[:, -3] if width >= 3 else zeros, '最后收盘价': matrix.closes[:, -1] if width >= 1 else nans, '倒数第二收盘价': matrix.closes[:, -2] if width >= 2 else nans}
+
+def live_sunny_days(matrix, trend, i, realtime_price):
+    """结合实时价格计算第i只股票的阳天数
+    如果倒数第二根K线就是昨天（收盘价与昨日收盘价一致），说明最后一根是今天盘中的K线，用实时价格替换它；
+    否则把实时价格当作新的一天追加在最后
+    """
+    if matrix.lengths[i] < 2:
+        return 0
+    if realtime_price <= 0:
+        return int(trend['上涨天数_最后'][i])
+    if abs(trend['倒数第二收盘价'][i] - matrix.yesterday_close[i]) < 0.01:
+        if realtime_price > trend['倒数第二收盘价'][i]:
+            return int(trend['上涨天数_倒数第二'][i]) + 1
+        return 0
+    if realtime_price > trend['最后收盘价'][i]:
+        return int(trend['上涨天数_最后'][i]) + 1
+    return 0
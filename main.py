@@ -1,12 +1,31 @@
 # -*- coding: utf-8 -*-
+import startup
 import webview
 import get_xls_data
+import data_snapshot
+import compute_worker
+import quote_engine
+import adaptive_limiter
+import quote_sources
+import metrics
+import trading_calendar
+import functools
 import threading
 import time
-import re
-from datetime import datetime, timedelta
+import json
+import multiprocessing
+from datetime import datetime
 import os
 import sys
+# 依赖numpy的模块第一次用到时才导入，启动时由后台预热提前加载，见 startup.lazy_module
+history_matrix = startup.lazy_module('history_matrix')
+breakthrough_tracker = startup.lazy_module('breakthrough_tracker')
+backtest = startup.lazy_module('backtest')
+stock_query = startup.lazy_module('stock_query')
+merge_engine = startup.lazy_module('merge_engine')
+tick_recorder = startup.lazy_module('tick_recorder')
+WARM_UP_STRAT_INDEX = 3
+WARM_UP_FILE_COUNT = 21
 
 def get_resource_path(relative_path):
     """获取资源文件的绝对路径（用于打包进exe的资源）"""
@@ -24,6 +43,49 @@ def get_data_path(relative_path):
         base_path = os.path.dirname(os.path.abspath(__file__))
     return os.path.join(base_path, relative_path)
 
+
+def diff_rows(old_rows, new_rows, field_level=False):
+    """比较两版 {代码: 行数据}
+    Returns:
+        tuple: (只含变化字段的行, 需要整行替换的行, 被删除的代码列表)；field_level=False 时变化的行都整行替换
+    """
+    changed_fields = {}
+    replaced_rows = {}
+    for code, new_row in new_rows.items():
+        old_row = old_rows.get(code)
+        if old_row is new_row:
+            continue
+        if old_row is None or not field_level or old_row.keys() - new_row.keys():
+            if old_row != new_row:
+                replaced_rows[code] = new_row
+            continue
+        fields = {key: value for key, value in new_row.items() if key not in old_row or old_row[key] != value}
+        if fields:
+            changed_fields[code] = fields
+    removed = [code for code in old_rows if code not in new_rows]
+    return (changed_fields, replaced_rows, removed)
+
+def same_concept_data(old, new):
+    """两份概念数据是否来自同样的xlsx内容
+
+    get_folder_data 对没变的文件返回解析缓存里的同一个列表，所以逐个日期用 is 比较列表；
+    调用方要一直持有上一份概念数据的引用，旧列表不会被回收，不会出现地址被新列表复用的误判
+    """
+    if old is new:
+        return True
+    if old is None or new is None or old.keys() != new.keys():
+        return False
+    return all(old[date] is new[date] for date in new)
+
+def exclusive_update(func):
+    """写入方之间互斥：同一时间只有一个线程在更新工作数据并发布快照，读取快照的方法不受影响"""
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with self._update_lock:
+            return func(self, *args, **kwargs)
+    return wrapper
+
 class Api:
 
     def __init__(self):
@@ -31,23 +93,86 @@ class Api:
         self.history_data = {}
         self.merged_data = {}
         self.concept_data = {}
-        self.stock_tracking = {}
-        self.industry_data = get_xls_data.get_code_industry()
+        # 上面几个是写入方的工作数据；页面读取的是 snapshots 里最近发布的一版
+        self.snapshots = data_snapshot.SnapshotStore()
+        self._update_lock = threading.RLock()
+        self.breakthrough_tracker = None
+        self._merge_engine = None
+        self.compute_worker = None
+        # 计算子进程当前读的是哪一份历史数据，和 history_data 不是同一个对象时要让它重新读仓库
+        self._worker_history = None
+        # 生成 history_data 时用的是否交易时间，补股票和子进程读仓库时用同一个值
+        self._history_trading_time = None
+        self.tick_recorder = None
+        # 回放录制的行情时换成模拟时钟（返回datetime的函数），None表示用系统时间
+        self.clock = None
+        self._stock_table = None
+        self._concept_slices = {}
+        self._unavailable_codes = set()
+        self._push_seq = 0
+        self._pushed_state = None
+        self._force_full_push = True
+        self.quote_engine = quote_engine.QuoteEngine()
+        self._tick_inputs_key = None
+        self._tick_concept_data = None
+        self._high_priority_codes = []
+        self._last_snapshot_version = None
+        self.industry_data = {}
+        self.warm_up = None
         self.auto_update_running = False
         self.update_thread = None
         self.last_update_time = None
         self.data_source_info = ''
         print('API 初始化完成')
 
+    def start_warm_up(self, background=True):
+        """预热：导入numpy/aiohttp/openpyxl等模块，读取行业表、默认参数下的股票数据xlsx和历史数据仓库
+        每一项开始和结束时把进度推送给页面的 onWarmUpProgress（页面没有这个函数时忽略）
+        """
+
+        warmed = {}
+
+        def import_modules():
+            startup.preload(history_matrix, merge_engine, breakthrough_tracker, stock_query, get_xls_data.asyncio, get_xls_data.aiohttp, get_xls_data.openpyxl, get_xls_data.requests)
+            self._get_breakthrough_tracker()
+
+        def load_workbooks():
+            warmed['concept_data'] = get_xls_data.get_folder_data(strat_index=WARM_UP_STRAT_INDEX, count=WARM_UP_FILE_COUNT)
+
+        def load_history_store():
+            header = get_xls_data.read_history_store_header()
+            concept_data = warmed.get('concept_data')
+            if header and concept_data and header['同步日期'] == datetime.now().strftime('%Y-%m-%d'):
+                stock_codes = list({stock_data[0] for stocks_list in concept_data.values() for stock_data in stocks_list})
+                get_xls_data.load_history_store(stock_codes)
+
+        def push_progress(status):
+            try:
+                webview.windows[0].evaluate_js(f'if(window.onWarmUpProgress) onWarmUpProgress({json.dumps(status, ensure_ascii=False)});')
+            except Exception:
+                pass
+        tasks = [('导入模块', import_modules), ('行业数据', self._load_industry_data), ('股票数据文件', load_workbooks), ('历史数据缓存', load_history_store)]
+        self.warm_up = startup.WarmUp(tasks, on_progress=push_progress).start(background)
+        return self.warm_up.status()
+
+    def _load_industry_data(self):
+        # 换了行业数据对象，合并引擎会清掉合并缓存，行业是'-'的行下一轮重新生成
+        self.industry_data = get_xls_data.get_code_industry()
+
+    def get_warm_up_status(self):
+        """预热进度和启动各阶段耗时"""
+        status = self.warm_up.status() if self.warm_up is not None else {'就绪': False}
+        status['启动耗时'] = startup.startup_timings()
+        return status
+
+    def _get_breakthrough_tracker(self):
+        if self.breakthrough_tracker is None:
+            self.breakthrough_tracker = breakthrough_tracker.BreakthroughTracker()
+        return self.breakthrough_tracker
+
     def calculate_workdays(self, start_date, end_date):
-        """计算两个日期之间的工作日天数（排除周六周日）"""
-        days = 0
-        current = start_date + timedelta(days=1)
-        while current <= end_date:
-            if current.weekday() < 5:
-                days += 1
-            current += timedelta(days=1)
-        return days
+        """计算两个日期之间的交易日天数（start_date 不含，排除周末和节假日）"""
+        return trading_calendar.trading_days_between(start_date, end_date)
 
     def is_limit_up(self, stock_code, change_pct):
         """判断是否涨停（严格标准）
@@ -96,8 +221,9 @@ class Api:
                     print(f'  {code} 不在概念数据中')
         return self.concept_data
 
+    @metrics.timed('优先级分类')
     def classify_priority_stocks(self, strat_index=3, count=21):
-        """根据历史数据分类股票优先级
+        """根据历史数据分类股票优先级（打开了计算子进程时在子进程里分类，主进程不建历史特征表）
         Returns:
             dict: {'high_priority': [], 'normal_priority': []}
         """
@@ -109,50 +235,31 @@ class Api:
             auto_index, reason = get_xls_data.get_data_source_index()
             actual_index = strat_index if strat_index else auto_index
             self.concept_data = get_xls_data.get_folder_data(strat_index=actual_index, count=count)
-        high_priority_stocks = []
-        normal_priority_stocks = []
         all_stock_codes = set()
         for date, stocks_list in self.concept_data.items():
             for stock_data in stocks_list:
                 stock_code = stock_data[0]
                 all_stock_codes.add(stock_code)
         print(f'总股票数: {len(all_stock_codes)}')
-        for stock_code in all_stock_codes:
-            if stock_code not in self.history_data:
-                normal_priority_stocks.append(stock_code)
-            else:
-                hist_data = self.history_data[stock_code]
-                price_list = hist_data.get('历史价格列表', [])
-                if not price_list or len(price_list) < 2:
-                    normal_priority_stocks.append(stock_code)
-                else:
-                    closes = [p['收盘价'] for p in price_list]
-                    sunny_days = 0
-                    for i in range(len(closes) - 1, 0, -1):
-                        if closes[i] > closes[i - 1]:
-                            sunny_days += 1
-                        else:
-                            break
-                    has_consecutive_limit_up = False
-                    limit_up_indices = []
-                    for i, price_data in enumerate(price_list):
-                        change_pct = price_data.get('涨幅', 0)
-                        if change_pct >= 9.8:
-                            limit_up_indices.append(i)
-                    if len(limit_up_indices) >= 2:
-                        for i in range(len(limit_up_indices) - 1):
-                            if limit_up_indices[i + 1] - limit_up_indices[i] == 1:
-                                has_consecutive_limit_up = True
-                                break
-                    if sunny_days == 1 and has_consecutive_limit_up:
-                        high_priority_stocks.append(stock_code)
-                    else:
-                        normal_priority_stocks.append(stock_code)
+        high_priority_stocks = None
+        worker = self._get_compute_worker()
+        if worker is not None:
+            try:
+                high_priority_stocks = worker.classify(all_stock_codes)
+            except RuntimeError as e:
+                print(f'计算子进程分类失败，改为在本进程分类: {e}')
+                self.stop_compute_worker()
+        if high_priority_stocks is None:
+            high_priority_stocks, normal_priority_stocks = merge_engine.classify_priority(self._get_history_features(), all_stock_codes)
+        else:
+            high_set = set(high_priority_stocks)
+            normal_priority_stocks = [stock_code for stock_code in all_stock_codes if stock_code not in high_set]
         print(f'高优先级股票（阳天数=1 + 有连续涨停）: {len(high_priority_stocks)}个')
         print(f'普通优先级股票: {len(normal_priority_stocks)}个')
         print('==================================================')
         return {'high_priority': high_priority_stocks, 'normal_priority': normal_priority_stocks}
 
+    @exclusive_update
     def get_real_time_data(self, strat_index=3, count=21, show_progress=True, priority_codes=None):
 
         def test_callback(current, total, msg):
@@ -166,13 +273,25 @@ class Api:
         self.data_source_info = reason
         print(f'数据源选择: {reason}, 使用索引: {actual_index}')
         self.concept_data = get_xls_data.get_folder_data(strat_index=actual_index, count=count)
+        # 完整刷新可能换了xlsx文件，之前缓存的参数切片全部作废
+        self._concept_slices = {(actual_index, count): self.concept_data}
+        self._unavailable_codes = set()
         self.get_history_data(strat_index=actual_index, count=count, show_progress=False)
         classification = self.classify_priority_stocks(strat_index=actual_index, count=count)
         high_priority_codes = classification['high_priority']
-        result = get_xls_data.get_real_time_data(progress_callback=test_callback, strat_index=actual_index, count=count, show_progress=show_progress, top_priority_codes=priority_codes, high_priority_codes=high_priority_codes)
+        deadline = get_xls_data.REALTIME_TICK_DEADLINE if self.real_time_data else None
+        result = get_xls_data.get_real_time_data(progress_callback=test_callback, strat_index=actual_index, count=count, show_progress=show_progress, top_priority_codes=priority_codes, high_priority_codes=high_priority_codes, deadline=deadline)
+        if deadline is not None:
+            universe = {get_xls_data.to_prefix_code(stock_data[0]) for stocks_list in self.concept_data.values() for stock_data in stocks_list}
+            stale = {code: quote for code, quote in self.real_time_data.items() if code in universe and code not in result}
+            if stale:
+                print(f'{len(stale)}个股票本次未在截止时间内返回，沿用上一次的行情')
+                result = {**stale, **result}
         self.real_time_data = result
         self.last_update_time = datetime.now().strftime('%H:%M:%S')
         self.check_breakthrough()
+        self.merge_all_data(min_days=strat_index, max_days=count)
+        snapshot = self._publish_snapshot()
         debug_codes = ['605188', '002337', '600262']
         print('\n【实时数据检查】')
         for code in debug_codes:
@@ -184,8 +303,51 @@ class Api:
                 print(f'  {code} 在实时数据中 (sz{code})')
             else:
                 print(f'  {code} 不在实时数据中')
-        return {'概念数据': self.concept_data, '实时数据': result, '更新时间': self.last_update_time, '数据源': reason}
+        return {'概念数据': snapshot.concept_data, '实时数据': quote_sources.quotes_to_dict(snapshot.real_time_data), '更新时间': snapshot.updated_at, '数据源': reason}
+
+    @exclusive_update
+    def apply_range_params(self, strat_index=3, count=21):
+        """只修改了 preview/back 参数时的快速路径
 
+        概念数据按 (strat_index, count) 缓存，已经加载过历史数据和行情的股票直接复用，
+        只给范围扩大后新出现的股票补读历史数据、补抓行情，再重新合并（行情没变的行直接用合并缓存）；
+        还没有加载过数据时走完整的 get_real_time_data 流程
+        Returns:
+            dict: {'概念数据', '实时数据', '今日涨停', '概念涨停数', '整合数据', '更新时间', '快速路径'}
+        """
+        fast_path = bool(self.history_data and self.real_time_data)
+        if not fast_path:
+            self.get_real_time_data(strat_index=strat_index, count=count)
+            snapshot = self.snapshots.latest()
+        else:
+            with metrics.timer('参数切换'):
+                actual_index = strat_index if strat_index else get_xls_data.get_data_source_index()[0]
+                key = (actual_index, count)
+                concept_data = self._concept_slices.get(key)
+                if concept_data is None:
+                    concept_data = get_xls_data.get_folder_data(strat_index=actual_index, count=count)
+                    self._concept_slices[key] = concept_data
+                self.concept_data = concept_data
+                stock_codes = {stock_data[0] for stocks_list in concept_data.values() for stock_data in stocks_list} - self._unavailable_codes
+                missing_history = [stock_code for stock_code in stock_codes if stock_code not in self.history_data]
+                missing_quotes = [prefix_code for prefix_code in map(get_xls_data.to_prefix_code, stock_codes) if prefix_code and prefix_code not in self.real_time_data]
+                if missing_history:
+                    print(f'参数修改后新增 {len(missing_history)} 个股票没有历史数据，补读历史数据')
+                    history = get_xls_data.get_history_for_codes(missing_history, show_progress=False, export_json=False, is_trading_time=self._history_trading_time)
+                    self.history_data = {**self.history_data, **history}
+                if missing_quotes:
+                    print(f'参数修改后新增 {len(missing_quotes)} 个股票没有行情，补抓行情')
+                    self.real_time_data = {**self.real_time_data, **get_xls_data.get_quotes(missing_quotes, deadline=get_xls_data.REALTIME_TICK_DEADLINE)}
+                    self.check_breakthrough()
+                # 补读一次还是没有历史数据的股票记下来，之后切换参数不再重复读取（没赶上截止时间的行情下一次会合并进来）
+                self._unavailable_codes.update((stock_code for stock_code in missing_history if stock_code not in self.history_data))
+            self.merge_all_data(min_days=strat_index, max_days=count)
+            snapshot = self._publish_snapshot()
+        # 前端直接拿到了全量数据，之后的推送以它为基准重新开始
+        self._force_full_push = True
+        return {'概念数据': snapshot.concept_data, '实时数据': quote_sources.quotes_to_dict(snapshot.real_time_data), '今日涨停': snapshot.today_limit_up, '概念涨停数': snapshot.concept_count, '整合数据': snapshot.merged_data, '更新时间': snapshot.updated_at, '快速路径': fast_path}
+
+    @exclusive_update
     def get_history_data(self, strat_index=3, count=21, show_progress=True):
 
         def history_callback(current, total, msg):
@@ -196,8 +358,10 @@ class Api:
             return None
         auto_index, reason = get_xls_data.get_data_source_index()
         actual_index = strat_index if strat_index else auto_index
-        result = get_xls_data.get_history_data(progress_callback=history_callback, strat_index=actual_index, count=count, show_progress=show_progress)
+        is_trading_time = trading_calendar.is_trading_time()
+        result = get_xls_data.get_history_data(progress_callback=history_callback, strat_index=actual_index, count=count, show_progress=show_progress, is_trading_time=is_trading_time)
         self.history_data = result
+        self._history_trading_time = is_trading_time
         debug_codes = ['605188', '002337', '600262']
         print('\n【历史数据检查】')
         for code in debug_codes:
@@ -208,58 +372,32 @@ class Api:
             else:
                 print(f'  {code} 不在历史数据中')
         self.merge_all_data(min_days=strat_index, max_days=count)
+        self._publish_snapshot()
         return result
 
+    @metrics.timed('突破跟踪')
     def check_breakthrough(self):
-        for prefix_code, real_data in self.real_time_data.items():
-            stock_code = prefix_code[2:]
-            try:
-                current_price = float(real_data.get('现价', 0))
-                current_zhangfu = float(real_data.get('涨幅', 0))
-                if current_price <= 0:
-                    continue
-                max_30d = 0
-                max_60d = 0
-                if stock_code in self.history_data:
-                    max_30d = float(self.history_data[stock_code].get('30日最高价', 0))
-                    max_60d = float(self.history_data[stock_code].get('60日最高价', 0))
-                if stock_code not in self.stock_tracking:
-                    self.stock_tracking[stock_code] = {'初始价格': current_price, '当前最高': current_price, '当前最低': current_price, '突破新高次数': 0, '突破新低次数': 0, '曾经最高涨幅': current_zhangfu, '突破30日新高次数': 0, '上次是否超过30日': False, '已突破60日新高': False}
-                    if max_30d > 0 and current_price > max_30d:
-                        self.stock_tracking[stock_code]['突破30日新高次数'] = 1
-                        self.stock_tracking[stock_code]['上次是否超过30日'] = True
-                        print(f'股票 {stock_code} 首次突破30日新高: {current_price} > {max_30d}')
-                    if max_60d > 0 and current_price > max_60d:
-                        self.stock_tracking[stock_code]['已突破60日新高'] = True
-                        print(f'股票 {stock_code} 突破60日新高: {current_price} > {max_60d}')
-                else:
-                    tracking = self.stock_tracking[stock_code]
-                    if current_price > tracking['当前最高']:
-                        tracking['突破新高次数'] += 1
-                        tracking['当前最高'] = current_price
-                        print(f"股票 {stock_code} 突破新高: {current_price}, 累计{tracking['突破新高次数']}次")
-                    if current_price < tracking['当前最低']:
-                        tracking['突破新低次数'] += 1
-                        tracking['当前最低'] = current_price
-                        print(f"股票 {stock_code} 跌破新低: {current_price}, 累计{tracking['突破新低次数']}次")
-                    if current_zhangfu > tracking['曾经最高涨幅']:
-                        tracking['曾经最高涨幅'] = current_zhangfu
-                        print(f'股票 {stock_code} 创今日最高涨幅: {current_zhangfu}%')
-                    if max_30d > 0:
-                        currently_above_30d = current_price > max_30d
-                        if currently_above_30d and (not tracking['上次是否超过30日']):
-                            tracking['突破30日新高次数'] += 1
-                            tracking['上次是否超过30日'] = True
-                            print(f"股票 {stock_code} 突破30日新高: {current_price} > {max_30d}, 累计{tracking['突破30日新高次数']}次")
-                        elif not currently_above_30d:
-                            tracking['上次是否超过30日'] = False
-                    if max_60d > 0:
-                        if current_price > max_60d:
-                            tracking['已突破60日新高'] = True
-                        else:
-                            tracking['已突破60日新高'] = False
-            except:
-                continue
+        """用本轮实时行情更新盘中突破跟踪，事件写入 breakthrough_tracker 的事件日志"""
+        event_count = self._get_breakthrough_tracker().update(self.real_time_data, self.history_data, now=self._now().timestamp())
+        if event_count:
+            print(f'突破跟踪: 本轮 {event_count} 个事件')
+        return event_count
+
+    def _now(self):
+        return self.clock() if self.clock is not None else datetime.now()
+
+    def get_breakthrough_events(self, limit=100):
+        """获取最近的突破事件（新高、新低、突破30日/60日新高等），新的在前"""
+        return self._get_breakthrough_tracker().recent_events(limit)
+
+    def _get_merge_engine(self):
+        if self._merge_engine is None:
+            self._merge_engine = merge_engine.MergeEngine()
+        return self._merge_engine
+
+    def _get_history_matrix(self):
+        """获取历史数据的列式矩阵，history_data 被替换后自动重建"""
+        return self._get_merge_engine().get_history_matrix(self.history_data)
 
     def analyze_limit_up_streak(self, concept_dates=None, use_loose=False):
         """从历史数据分析连续涨停（基于索引位置判断）
@@ -270,88 +408,30 @@ class Api:
         """
         if not self.history_data:
             return {}
-        result = {}
-        for stock_code, hist_data in self.history_data.items():
-            price_list = hist_data.get('历史价格列表', [])
-            if not price_list:
-                continue
-            limit_up_info = []
-            for i, price_data in enumerate(price_list):
-                date_str = price_data['日期']
-                if concept_dates and date_str not in concept_dates:
-                    continue
-                is_zt = self.is_limit_up_loose(stock_code, price_data['涨幅']) if use_loose else self.is_limit_up(stock_code, price_data['涨幅'])
-                if is_zt:
-                    limit_up_info.append({'index': i, 'date': date_str, 'change': price_data['涨幅']})
-            if not limit_up_info:
-                continue
-            max_streak = 0
-            current_streak = 1
-            last_streak_end_index = None
-            if len(limit_up_info) >= 2:
-                for i in range(1, len(limit_up_info)):
-                    prev_index = limit_up_info[i - 1]['index']
-                    curr_index = limit_up_info[i]['index']
-                    if curr_index - prev_index == 1:
-                        current_streak += 1
-                        if current_streak >= 2:
-                            last_streak_end_index = curr_index
-                    else:
-                        if current_streak >= 2 and max_streak < current_streak:
-                            max_streak = current_streak
-                        current_streak = 1
-                if current_streak >= 2 and max_streak < current_streak:
-                    max_streak = current_streak
-                    last_streak_end_index = limit_up_info[-1]['index']
-            elif len(limit_up_info) == 1:
-                pass
-            last_index_in_full_list = len(price_list) - 1
-            last_limit_up_index = limit_up_info[-1]['index']
-            if max_streak >= 2 and last_streak_end_index is not None:
-                days_diff = last_index_in_full_list - last_streak_end_index
-                last_date = price_list[last_streak_end_index]['日期']
-            else:
-                days_diff = last_index_in_full_list - last_limit_up_index
-                last_date = price_list[last_limit_up_index]['日期']
-            result[stock_code] = {'最大连续涨停数': max_streak, '最后涨停日期': last_date, '离最新日期天数': days_diff}
-        return result
+        matrix = self._get_history_matrix()
+        thresholds = matrix.loose_thresholds if use_loose else matrix.strict_thresholds
+        stats = history_matrix.compute_limit_up_stats(matrix, matrix.limit_up_mask(thresholds, concept_dates))
+        return merge_engine.limit_stats_to_dict(matrix, stats)
 
-    def _count_single_day_segments(self, indices):
-        """计算长度为1的涨停段个数（单日涨停）"""
-        if not indices:
-            return 0
-        singles = 0
-        run_len = 1
-        for i in range(1, len(indices)):
-            if indices[i] == indices[i - 1] + 1:
-                run_len += 1
-            else:
-                if run_len == 1:
-                    singles += 1
-                run_len = 1
-        if run_len == 1:
-            singles += 1
-        return singles
+    def _get_history_features(self):
+        """获取只依赖历史数据的特征表（每天随 history_data 更新一次）
 
+        Returns:
+            dict: {'matrix', 'trend', 'strict_info', 'loose_info', 'rows': {代码: 合并结果中的历史字段}}
+        """
+        return self._get_merge_engine().get_history_features(self.history_data)
+
+    @metrics.timed('合并')
     def merge_all_data(self, min_days=3, max_days=21):
         """合并所有数据
+
+        历史特征表每天只算一次，这里只对行情有变化的股票重新计算实时字段，
+        行情没变的股票直接复用上一轮的结果；打开了计算子进程时在子进程里合并，出错时退回本进程
         
         Args:
             min_days: 离涨停天数的最小值（用于计算总涨停数）
             max_days: 离涨停天数的最大值（用于计算总涨停数）
         """
-        merged = {}
-        concept_dates = set()
-        for date_str in self.concept_data.keys():
-            match = re.match('(\\d+)月(\\d+)', date_str)
-            if match:
-                month = int(match.group(1))
-                day = int(match.group(2))
-                year = 2025
-                concept_dates.add(f'{year:04d}-{month:02d}-{day:02d}')
-        # 连续涨停数基于全部60天历史数据，不受Excel日期范围限制
-        limit_up_info_strict = self.analyze_limit_up_streak(None, use_loose=False)
-        limit_up_info_loose = self.analyze_limit_up_streak(None, use_loose=True)
         # 调试：检查002792是否在数据中
         print(f'\n【数据检查】')
         print(f'  real_time_data 总数: {len(self.real_time_data)}')
@@ -362,349 +442,300 @@ class Api:
             hist = self.history_data['002792']
             plist = hist.get('历史价格列表', [])
             print(f'  002792 历史价格列表长度: {len(plist)}')
-        for prefix_code, real_data in self.real_time_data.items():
-            stock_code = prefix_code[2:]
-            tracking = self.stock_tracking.get(stock_code, {})
-            limit_info_strict = limit_up_info_strict.get(stock_code, {})
-            limit_info_loose = limit_up_info_loose.get(stock_code, {})
-            sunny_days = 0
-            if stock_code in self.history_data:
-                hist_data = self.history_data[stock_code]
-                price_list = hist_data.get('历史价格列表', [])
-                if price_list and len(price_list) >= 2:
-                    closes = [p['收盘价'] for p in price_list]
-                    yesterday_close_from_hist = hist_data.get('昨日收盘价', 0)
-                    try:
-                        realtime_price = float(real_data.get('现价', 0))
-                        if realtime_price > 0:
-                            if len(price_list) >= 2 and abs(price_list[-2]['收盘价'] - yesterday_close_from_hist) < 0.01:
-                                closes[-1] = realtime_price
-                            else:
-                                closes.append(realtime_price)
-                    except Exception:
-                        pass
-                    for i in range(len(closes) - 1, 0, -1):
-                        current_close = closes[i]
-                        prev_close = closes[i - 1]
-                        if current_close > prev_close:
-                            sunny_days += 1
-                        else:
-                            break
-            # 计算前N天连续阳涨幅天数（跳过最后两天，从倒数第三天开始往前数）
-            prev_positive_days = 0
-            if stock_code in self.history_data:
-                hist_data = self.history_data[stock_code]
-                price_list = hist_data.get('历史价格列表', [])
-                if price_list and len(price_list) >= 3:
-                    for i in range(len(price_list) - 3, -1, -1):
-                        change = price_list[i].get('涨幅', 0)
-                        if change > 0:
-                            prev_positive_days += 1
-                        else:
-                            break
-            limit_up_count_strict = 0
-            limit_up_count_loose = 0
-            single_count_strict = 0
-            single_count_loose = 0
-            total_all_limit_days_strict = 0
-            total_all_limit_days_loose = 0
-            # 统计全部60天的涨停天数，不依赖concept_dates
-            if stock_code in self.history_data:
-                hist_data = self.history_data[stock_code]
-                price_list = hist_data.get('历史价格列表', [])
-                limit_up_indices_strict = []
-                for i, price_data in enumerate(price_list):
-                    is_zt_strict = self.is_limit_up(stock_code, price_data['涨幅'])
-                    # 统计全部60天内的涨停，不限制日期范围
-                    if is_zt_strict:
-                        limit_up_indices_strict.append(i)
-                if limit_up_indices_strict:
-                    limit_up_count_strict = 1
-                    for i in range(1, len(limit_up_indices_strict)):
-                        if limit_up_indices_strict[i] - limit_up_indices_strict[i - 1] > 1:
-                            limit_up_count_strict += 1
-                limit_up_indices_loose = []
-                for i, price_data in enumerate(price_list):
-                    is_zt_loose = self.is_limit_up_loose(stock_code, price_data['涨幅'])
-                    # 统计全部60天内的涨停，不限制日期范围
-                    if is_zt_loose:
-                        limit_up_indices_loose.append(i)
-                if limit_up_indices_loose:
-                    limit_up_count_loose = 1
-                    for i in range(1, len(limit_up_indices_loose)):
-                        if limit_up_indices_loose[i] - limit_up_indices_loose[i - 1] > 1:
-                            limit_up_count_loose += 1
-                single_count_strict = self._count_single_day_segments(limit_up_indices_strict)
-                single_count_loose = self._count_single_day_segments(limit_up_indices_loose)
-                total_all_limit_days_strict = len(limit_up_indices_strict)
-                total_all_limit_days_loose = len(limit_up_indices_loose)
-                # 调试：打印002792的涨停统计
-                if stock_code == '002792':
-                    print(f'\n【002792 涨停统计调试】')
-                    print(f'  history_data中存在: True')
-                    print(f'  price_list长度: {len(price_list)}')
-                    print(f'  涨停日索引(严格): {limit_up_indices_strict}')
-                    print(f'  全部涨停天数(严格): {total_all_limit_days_strict}')
-                    print(f'  连续涨停数(严格): {limit_info_strict.get("最大连续涨停数", 0)}')
-                    print(f'  涨停日详情:')
-                    for idx in limit_up_indices_strict:
-                        p = price_list[idx]
-                        print(f'    索引{idx}: {p["日期"]} 涨幅{p["涨幅"]}%')
-            total_limit_up_days_in_range_strict = 0
-            total_limit_up_days_in_range_loose = 0
-            if stock_code in self.history_data and concept_dates:
-                hist_data = self.history_data[stock_code]
-                price_list = hist_data.get('历史价格列表', [])
-                consecutive_limit_up_strict = limit_info_strict.get('最大连续涨停数', 0)
-                consecutive_limit_up_loose = limit_info_loose.get('最大连续涨停数', 0)
-                days_from_limit_strict = limit_info_strict.get('离最新日期天数', '无涨停')
-                days_from_limit_loose = limit_info_loose.get('离最新日期天数', '无涨停')
-                should_count_strict = False
-                should_count_loose = False
-                if consecutive_limit_up_strict >= 2 and days_from_limit_strict != '无涨停':
-                    try:
-                        days_strict = int(days_from_limit_strict)
-                        if min_days <= days_strict <= max_days:
-                            should_count_strict = True
-                    except (ValueError, TypeError):
-                        pass
-                if consecutive_limit_up_loose >= 2 and days_from_limit_loose != '无涨停':
-                    try:
-                        days_loose = int(days_from_limit_loose)
-                        if min_days <= days_loose <= max_days:
-                            should_count_loose = True
-                    except (ValueError, TypeError):
-                        pass
-                total_all_limit_up_days_strict = 0
-                total_all_limit_up_days_loose = 0
-                if should_count_strict:
-                    for i, price_data in enumerate(price_list):
-                        date_in_concept = price_data['日期'] in concept_dates
-                        is_zt_strict = self.is_limit_up(stock_code, price_data['涨幅'])
-                        if date_in_concept and is_zt_strict:
-                            total_all_limit_up_days_strict += 1
-                    total_limit_up_days_in_range_strict = max(0, total_all_limit_up_days_strict - consecutive_limit_up_strict)
-                if should_count_loose:
-                    for i, price_data in enumerate(price_list):
-                        date_in_concept = price_data['日期'] in concept_dates
-                        is_zt_loose = self.is_limit_up_loose(stock_code, price_data['涨幅'])
-                        if date_in_concept and is_zt_loose:
-                            total_all_limit_up_days_loose += 1
-                    total_limit_up_days_in_range_loose = max(0, total_all_limit_up_days_loose - consecutive_limit_up_loose)
-            time_info = get_xls_data.get_current_time_info()
-            weekday = time_info['星期']
-            hour = time_info['小时']
-            minute = time_info['分钟']
-            is_trading_time = weekday < 5 and (hour == 9 and minute >= 15 or 9 < hour < 15 or (hour == 15 and minute == 0))
-            if is_trading_time:
-                current_change = real_data.get('涨幅', '')
-            elif stock_code in self.history_data:
-                hist_data = self.history_data[stock_code]
-                price_list = hist_data.get('历史价格列表', [])
-                current_change = price_list[-1]['涨幅'] if price_list else ''
-            else:
-                current_change = ''
-            merged[stock_code] = {'代码': stock_code, '名称': real_data.get('名称', ''), '行业': self.industry_data.get(stock_code, {}).get('行业', '-'), '现价': real_data.get('现价', ''), '涨幅': current_change, '换手率': real_data.get('换手率', ''), '流通市值': real_data.get('流通市值', ''), '今日最高价': real_data.get('今日最高价', ''), '今日最低价': real_data.get('今日最低价', ''), '涨停数_严格': limit_up_count_strict, '涨停数_宽松': limit_up_count_loose, '单日涨停数_严格': single_count_strict, '单日涨停数_宽松': single_count_loose, '连续涨停数_严格': limit_info_strict.get('最大连续涨停数', 0), '连续涨停数_宽松': limit_info_loose.get('最大连续涨停数', 0), '总涨停数_严格': max(0, total_all_limit_days_strict - limit_info_strict.get('最大连续涨停数', 0)), '总涨停数_宽松': max(0, total_all_limit_days_loose - limit_info_loose.get('最大连续涨停数', 0)), '全部涨停天数_严格': total_all_limit_days_strict, '全部涨停天数_宽松': total_all_limit_days_loose, '总涨停数_天数_严格': max(0, total_all_limit_days_strict - limit_info_strict.get('最大连续涨停数', 0)), '总涨停数_天数_宽松': max(0, total_all_limit_days_loose - limit_info_loose.get('最大连续涨停数', 0)), '离涨停多少天_严格': limit_info_strict.get('离最新日期天数', '无涨停'), '离涨停多少天_宽松': limit_info_loose.get('离最新日期天数', '无涨停'), '阳天数': sunny_days, '前N天阳天数': prev_positive_days}
-            if stock_code in self.history_data:
-                hist_data = self.history_data[stock_code]
-                merged[stock_code].update({'昨日收盘价': hist_data.get('昨日收盘价', ''), '昨日涨幅': hist_data.get('昨日涨幅', ''), '30日最高价': hist_data.get('30日最高价', ''), '30日最低价': hist_data.get('30日最低价', ''), '60日最高价': hist_data.get('60日最高价', ''), '60日最低价': hist_data.get('60日最低价', '')})
-            if stock_code in ['605188', '002337', '600262', '600403']:
-                print('\n============================================================')
-                print(f'{stock_code} 调试信息')
-                print('============================================================')
-                print(f'股票代码: {stock_code}')
-                print(f"股票名称: {real_data.get('名称', '')}")
-                print(f"现价: {real_data.get('现价', '')}")
-                print(f"涨幅: {real_data.get('涨幅', '')}%")
-                days_from_limit_strict = limit_info_strict.get('离最新日期天数', '无涨停')
-                days_from_limit_loose = limit_info_loose.get('离最新日期天数', '无涨停')
-                print('\n【离涨停天数】')
-                print(f'  严格版: {days_from_limit_strict}')
-                print(f'  宽松版: {days_from_limit_loose}')
-                if days_from_limit_strict != '无涨停':
-                    in_range_strict = 3 <= int(days_from_limit_strict) <= 21
-                    print(f'  严格版是否在3-21范围内: {in_range_strict}')
-                else:
-                    print('  严格版是否在3-21范围内: False (无涨停记录)')
-                if days_from_limit_loose != '无涨停':
-                    in_range_loose = 3 <= int(days_from_limit_loose) <= 21
-                    print(f'  宽松版是否在3-21范围内: {in_range_loose}')
-                else:
-                    print('  宽松版是否在3-21范围内: False (无涨停记录)')
-                print(f'\n【阳天数】: {sunny_days}')
-                print(f'  是否等于1: {sunny_days == 1}')
-                if stock_code in self.history_data:
-                    hist_data = self.history_data[stock_code]
-                    yesterday_close = hist_data.get('昨日收盘价', 0)
-                    realtime_price = float(real_data.get('现价', 0))
-                    print(f'  昨日收盘价: {yesterday_close}')
-                    print(f'  今日现价: {realtime_price}')
-                    print(f"  今天vs昨天: {('上涨' if realtime_price > yesterday_close else '下跌')}")
-                consecutive_limit_strict = limit_info_strict.get('最大连续涨停数', 0)
-                consecutive_limit_loose = limit_info_loose.get('最大连续涨停数', 0)
-                print('\n【连续涨停数】')
-                print(f'  严格版（3/68开头需19.8%）: {consecutive_limit_strict}')
-                print(f'  宽松版（统一9.8%）: {consecutive_limit_loose}')
-                print(f'  严格版是否>=2: {consecutive_limit_strict >= 2}')
-                print(f'  宽松版是否>=2: {consecutive_limit_loose >= 2}')
-                if consecutive_limit_strict >= 2:
-                    print(f"  严格版最后涨停日期: {limit_info_strict.get('最后涨停日期', '')}")
-                if consecutive_limit_loose >= 2:
-                    print(f"  宽松版最后涨停日期: {limit_info_loose.get('最后涨停日期', '')}")
-                if stock_code in self.history_data:
-                    hist_data = self.history_data[stock_code]
-                    price_list = hist_data.get('历史价格列表', [])
-                    concept_dates = set()
-                    for date_str in self.concept_data.keys():
-                        match = re.match('(\\d+)月(\\d+)', date_str)
-                        if match:
-                            month = int(match.group(1))
-                            day = int(match.group(2))
-                            year = 2025
-                            concept_dates.add(f'{year:04d}-{month:02d}-{day:02d}')
-                    print('\n【所有涨停日信息（宽松版）】')
-                    limit_up_dates_loose = []
-                    for i, price_data in enumerate(price_list):
-                        date_str = price_data['日期']
-                        if concept_dates and date_str not in concept_dates:
-                            continue
-                        is_zt_loose = self.is_limit_up_loose(stock_code, price_data['涨幅'])
-                        if is_zt_loose:
-                            limit_up_dates_loose.append({'index': i, 'date': date_str, 'change': price_data['涨幅']})
-                    print(f'  涨停日总数: {len(limit_up_dates_loose)}')
-                    if len(limit_up_dates_loose) > 0:
-                        print('  涨停日列表:')
-                        for idx, item in enumerate(limit_up_dates_loose[:10]):
-                            print(f"    索引{item['index']}: 日期{item['date']}, 涨幅{item['change']}%")
-                        if len(limit_up_dates_loose) > 10:
-                            print(f'    ... (还有{len(limit_up_dates_loose) - 10}个)')
-                    if len(limit_up_dates_loose) >= 2:
-                        print('\n【连续涨停段分析】')
-                        current_streak = 1
-                        max_streak_found = 0
-                        streak_start = 0
-                        for i in range(1, len(limit_up_dates_loose)):
-                            prev_index = limit_up_dates_loose[i - 1]['index']
-                            curr_index = limit_up_dates_loose[i]['index']
-                            if curr_index - prev_index == 1:
-                                current_streak += 1
-                                if current_streak > max_streak_found:
-                                    max_streak_found = current_streak
-                            else:
-                                if current_streak >= 2:
-                                    print(f'  发现连续涨停段: {current_streak}天')
-                                current_streak = 1
-                        if current_streak >= 2:
-                            if current_streak > max_streak_found:
-                                max_streak_found = current_streak
-                            print(f'  最后连续涨停段: {current_streak}天')
-                        print(f'  最大连续涨停数: {max_streak_found}')
-                if stock_code in self.history_data:
-                    hist_data = self.history_data[stock_code]
-                    max_30d = hist_data.get('30日最高价', 0)
-                    current_price = float(real_data.get('现价', 0))
-                    if max_30d > 0:
-                        percent_from_30d_high = (current_price - max_30d) / max_30d * 100
-                        print('\n【突破30日新高】')
-                        print(f'  30日最高价: {max_30d}')
-                        print(f'  当前价格: {current_price}')
-                        print(f'  离30日新高%: {percent_from_30d_high:.2f}%')
-                        print(f'  是否>=100%: {percent_from_30d_high >= 100}')
-                print('\n【涨停数】')
-                print(f'  严格版: {limit_up_count_strict}')
-                print(f'  宽松版: {limit_up_count_loose}')
-                print('  (在参数范围内的涨停段数)')
-                print('\n【其他筛选条件】')
-                in_concept = False
-                for date_str, stocks_list in self.concept_data.items():
-                    for stock_data in stocks_list:
-                        if stock_data[0] == stock_code:
-                            in_concept = True
-                            break
-                    if in_concept:
-                        break
-                print(f'  是否在概念数据中: {in_concept}')
-                print('\n【综合判断】')
-                cond1_strict = days_from_limit_strict != '无涨停' and 2 <= int(days_from_limit_strict) <= 20
-                cond1_loose = days_from_limit_loose != '无涨停' and 2 <= int(days_from_limit_loose) <= 20
-                cond2 = sunny_days == 1
-                cond3_strict = consecutive_limit_strict >= 2
-                cond3_loose = consecutive_limit_loose >= 2
-                cond4 = in_concept
-                cond5 = True
-                if stock_code in self.history_data:
-                    hist_data = self.history_data[stock_code]
-                    max_30d = hist_data.get('30日最高价', 0)
-                    current_price = float(real_data.get('现价', 0))
-                    if max_30d > 0:
-                        percent_from_30d_high = (current_price - max_30d) / max_30d * 100
-                        cond5 = percent_from_30d_high >= 100
-                        print(f'  突破30日新高>=100%: {cond5} (实际: {percent_from_30d_high:.2f}%)')
-                print(f'  离涨停3-21天（严格版）: {cond1_strict}')
-                print(f'  离涨停3-21天（宽松版）: {cond1_loose}')
-                print(f'  阳天数=1: {cond2}')
-                print(f'  连续涨停>=2（严格版）: {cond3_strict}')
-                print(f'  连续涨停>=2（宽松版）: {cond3_loose}')
-                print(f'  在概念数据中: {cond4}')
-                print(f'  前端全部满足（严格版）: {cond1_strict and cond2 and cond3_strict and cond4 and cond5}')
-                print(f'  前端全部满足（宽松版）: {cond1_loose and cond2 and cond3_loose and cond4 and cond5}')
-                print('============================================================\n')
+        is_trading_time = trading_calendar.is_trading_time(self._now())
+        merged = None
+        merged_in_worker = False
+        worker = self._get_compute_worker()
+        if worker is not None:
             try:
-                current_price = float(merged[stock_code].get('现价', 0))
-                today_high = float(merged[stock_code].get('今日最高价', 0))
-                today_low = float(merged[stock_code].get('今日最低价', 0))
-                max_30d = float(merged[stock_code].get('30日最高价', 0))
-                max_60d = float(merged[stock_code].get('60日最高价', 0))
-                if current_price > 0 and today_high > 0:
-                    merged[stock_code]['离最高价%'] = f'{(current_price - today_high) / today_high * 100:.2f}'
-                else:
-                    merged[stock_code]['离最高价%'] = '0.00'
-                if current_price > 0 and today_low > 0:
-                    merged[stock_code]['离最低价%'] = f'{(current_price - today_low) / today_low * 100:.2f}'
-                else:
-                    merged[stock_code]['离最低价%'] = '0.00'
-                if current_price > 0 and max_30d > 0:
-                    percent_to_30d = (current_price - max_30d) / max_30d * 100
-                    merged[stock_code]['离30日新高%'] = f'{percent_to_30d:.2f}'
-                else:
-                    merged[stock_code]['离30日新高%'] = '0.00'
-                if current_price > 0 and max_60d > 0:
-                    percent_to_60d = (current_price - max_60d) / max_60d * 100
-                    merged[stock_code]['离60日新高%'] = f'{percent_to_60d:.2f}'
-                else:
-                    merged[stock_code]['离60日新高%'] = '0.00'
-            except:
-                merged[stock_code]['离最高价%'] = '0.00'
-                merged[stock_code]['离最低价%'] = '0.00'
-                merged[stock_code]['离30日新高%'] = '0.00'
-                merged[stock_code]['离60日新高%'] = '0.00'
+                merged, recomputed = worker.merge(self.real_time_data, self.industry_data, is_trading_time)
+                merged_in_worker = True
+            except RuntimeError as e:
+                print(f'计算子进程合并失败，改为在本进程合并: {e}')
+                self.stop_compute_worker()
+        if merged is None:
+            merged, recomputed = self._get_merge_engine().merge(self.real_time_data, self.history_data, self.industry_data, is_trading_time)
+        # 调试输出要用历史特征表，在子进程里合并时主进程不建这张表，跳过
+        for prefix_code in ([] if merged_in_worker else recomputed):
+            stock_code = prefix_code[2:]
+            if stock_code == '002792' or stock_code in ['605188', '002337', '600262', '600403']:
+                self._print_merge_debug(stock_code, self.real_time_data[prefix_code], merged[stock_code], self._get_history_features())
+        print(f'合并完成: {len(merged)} 个股票，其中 {len(recomputed)} 个行情有变化')
         self.merged_data = merged
         return merged
 
+    def _print_merge_debug(self, stock_code, real_data, merged_row, features):
+        """打印个别股票的合并调试信息"""
+        limit_info_strict = features['strict_info'].get(stock_code, {})
+        limit_info_loose = features['loose_info'].get(stock_code, {})
+        sunny_days = merged_row['阳天数']
+        limit_up_count_strict = merged_row['涨停数_严格']
+        limit_up_count_loose = merged_row['涨停数_宽松']
+        # 调试：打印002792的涨停统计
+        if stock_code == '002792' and stock_code in self.history_data:
+            price_list = self.history_data[stock_code].get('历史价格列表', [])
+            limit_up_indices_strict = [i for i, p in enumerate(price_list) if self.is_limit_up(stock_code, p['涨幅'])]
+            print(f'\n【002792 涨停统计调试】')
+            print(f'  history_data中存在: True')
+            print(f'  price_list长度: {len(price_list)}')
+            print(f'  涨停日索引(严格): {limit_up_indices_strict}')
+            print(f'  全部涨停天数(严格): {merged_row["全部涨停天数_严格"]}')
+            print(f'  连续涨停数(严格): {limit_info_strict.get("最大连续涨停数", 0)}')
+            print(f'  涨停日详情:')
+            for idx in limit_up_indices_strict:
+                p = price_list[idx]
+                print(f'    索引{idx}: {p["日期"]} 涨幅{p["涨幅"]}%')
+        if stock_code not in ['605188', '002337', '600262', '600403']:
+            return
+        print('\n============================================================')
+        print(f'{stock_code} 调试信息')
+        print('============================================================')
+        print(f'股票代码: {stock_code}')
+        print(f'股票名称: {real_data.name}')
+        print(f'现价: {real_data.price}')
+        print(f'涨幅: {real_data.change}%')
+        days_from_limit_strict = limit_info_strict.get('离最新日期天数', '无涨停')
+        days_from_limit_loose = limit_info_loose.get('离最新日期天数', '无涨停')
+        print('\n【离涨停天数】')
+        print(f'  严格版: {days_from_limit_strict}')
+        print(f'  宽松版: {days_from_limit_loose}')
+        if days_from_limit_strict != '无涨停':
+            in_range_strict = 3 <= int(days_from_limit_strict) <= 21
+            print(f'  严格版是否在3-21范围内: {in_range_strict}')
+        else:
+            print('  严格版是否在3-21范围内: False (无涨停记录)')
+        if days_from_limit_loose != '无涨停':
+            in_range_loose = 3 <= int(days_from_limit_loose) <= 21
+            print(f'  宽松版是否在3-21范围内: {in_range_loose}')
+        else:
+            print('  宽松版是否在3-21范围内: False (无涨停记录)')
+        print(f'\n【阳天数】: {sunny_days}')
+        print(f'  是否等于1: {sunny_days == 1}')
+        if stock_code in self.history_data:
+            hist_data = self.history_data[stock_code]
+            yesterday_close = hist_data.get('昨日收盘价', 0)
+            realtime_price = real_data.price
+            print(f'  昨日收盘价: {yesterday_close}')
+            print(f'  今日现价: {realtime_price}')
+            print(f"  今天vs昨天: {('上涨' if realtime_price > yesterday_close else '下跌')}")
+        consecutive_limit_strict = limit_info_strict.get('最大连续涨停数', 0)
+        consecutive_limit_loose = limit_info_loose.get('最大连续涨停数', 0)
+        print('\n【连续涨停数】')
+        print(f'  严格版（3/68开头需19.8%）: {consecutive_limit_strict}')
+        print(f'  宽松版（统一9.8%）: {consecutive_limit_loose}')
+        print(f'  严格版是否>=2: {consecutive_limit_strict >= 2}')
+        print(f'  宽松版是否>=2: {consecutive_limit_loose >= 2}')
+        if consecutive_limit_strict >= 2:
+            print(f"  严格版最后涨停日期: {limit_info_strict.get('最后涨停日期', '')}")
+        if consecutive_limit_loose >= 2:
+            print(f"  宽松版最后涨停日期: {limit_info_loose.get('最后涨停日期', '')}")
+        if stock_code in self.history_data:
+            hist_data = self.history_data[stock_code]
+            price_list = hist_data.get('历史价格列表', [])
+            concept_dates = set()
+            today = self._now().date()
+            for date_str in self.concept_data.keys():
+                iso_date = trading_calendar.concept_date_to_iso(date_str, today)
+                if iso_date:
+                    concept_dates.add(iso_date)
+            print('\n【所有涨停日信息（宽松版）】')
+            limit_up_dates_loose = []
+            for i, price_data in enumerate(price_list):
+                date_str = price_data['日期']
+                if concept_dates and date_str not in concept_dates:
+                    continue
+                is_zt_loose = self.is_limit_up_loose(stock_code, price_data['涨幅'])
+                if is_zt_loose:
+                    limit_up_dates_loose.append({'index': i, 'date': date_str, 'change': price_data['涨幅']})
+            print(f'  涨停日总数: {len(limit_up_dates_loose)}')
+            if len(limit_up_dates_loose) > 0:
+                print('  涨停日列表:')
+                for idx, item in enumerate(limit_up_dates_loose[:10]):
+                    print(f"    索引{item['index']}: 日期{item['date']}, 涨幅{item['change']}%")
+                if len(limit_up_dates_loose) > 10:
+                    print(f'    ... (还有{len(limit_up_dates_loose) - 10}个)')
+            if len(limit_up_dates_loose) >= 2:
+                print('\n【连续涨停段分析】')
+                current_streak = 1
+                max_streak_found = 0
+                streak_start = 0
+                for i in range(1, len(limit_up_dates_loose)):
+                    prev_index = limit_up_dates_loose[i - 1]['index']
+                    curr_index = limit_up_dates_loose[i]['index']
+                    if curr_index - prev_index == 1:
+                        current_streak += 1
+                        if current_streak > max_streak_found:
+                            max_streak_found = current_streak
+                    else:
+                        if current_streak >= 2:
+                            print(f'  发现连续涨停段: {current_streak}天')
+                        current_streak = 1
+                if current_streak >= 2:
+                    if current_streak > max_streak_found:
+                        max_streak_found = current_streak
+                    print(f'  最后连续涨停段: {current_streak}天')
+                print(f'  最大连续涨停数: {max_streak_found}')
+        if stock_code in self.history_data:
+            hist_data = self.history_data[stock_code]
+            max_30d = hist_data.get('30日最高价', 0)
+            current_price = real_data.price
+            if max_30d > 0:
+                percent_from_30d_high = (current_price - max_30d) / max_30d * 100
+                print('\n【突破30日新高】')
+                print(f'  30日最高价: {max_30d}')
+                print(f'  当前价格: {current_price}')
+                print(f'  离30日新高%: {percent_from_30d_high:.2f}%')
+                print(f'  是否>=100%: {percent_from_30d_high >= 100}')
+        print('\n【涨停数】')
+        print(f'  严格版: {limit_up_count_strict}')
+        print(f'  宽松版: {limit_up_count_loose}')
+        print('  (在参数范围内的涨停段数)')
+        print('\n【其他筛选条件】')
+        in_concept = False
+        for date_str, stocks_list in self.concept_data.items():
+            for stock_data in stocks_list:
+                if stock_data[0] == stock_code:
+                    in_concept = True
+                    break
+            if in_concept:
+                break
+        print(f'  是否在概念数据中: {in_concept}')
+        print('\n【综合判断】')
+        cond1_strict = days_from_limit_strict != '无涨停' and 2 <= int(days_from_limit_strict) <= 20
+        cond1_loose = days_from_limit_loose != '无涨停' and 2 <= int(days_from_limit_loose) <= 20
+        cond2 = sunny_days == 1
+        cond3_strict = consecutive_limit_strict >= 2
+        cond3_loose = consecutive_limit_loose >= 2
+        cond4 = in_concept
+        cond5 = True
+        if stock_code in self.history_data:
+            hist_data = self.history_data[stock_code]
+            max_30d = hist_data.get('30日最高价', 0)
+            current_price = real_data.price
+            if max_30d > 0:
+                percent_from_30d_high = (current_price - max_30d) / max_30d * 100
+                cond5 = percent_from_30d_high >= 100
+                print(f'  突破30日新高>=100%: {cond5} (实际: {percent_from_30d_high:.2f}%)')
+        print(f'  离涨停3-21天（严格版）: {cond1_strict}')
+        print(f'  离涨停3-21天（宽松版）: {cond1_loose}')
+        print(f'  阳天数=1: {cond2}')
+        print(f'  连续涨停>=2（严格版）: {cond3_strict}')
+        print(f'  连续涨停>=2（宽松版）: {cond3_loose}')
+        print(f'  在概念数据中: {cond4}')
+        print(f'  前端全部满足（严格版）: {cond1_strict and cond2 and cond3_strict and cond4 and cond5}')
+        print(f'  前端全部满足（宽松版）: {cond1_loose and cond2 and cond3_loose and cond4 and cond5}')
+        print('============================================================\n')
+
+    def start_compute_worker(self):
+        """启动计算子进程，之后的合并都在子进程里做（子进程出错时自动退回本进程合并）"""
+        with self._update_lock:
+            if self.compute_worker is None:
+                self.compute_worker = compute_worker.ComputeWorker()
+                print(f'计算子进程已启动: pid={self.compute_worker.status()["进程号"]}')
+        return {'状态': '已启动', '消息': '合并在计算子进程里进行'}
+
+    def stop_compute_worker(self):
+        with self._update_lock:
+            worker = self.compute_worker
+            self.compute_worker = None
+            self._worker_history = None
+        if worker is not None:
+            worker.stop()
+        return {'状态': '已停止', '消息': '合并改回在本进程里进行'}
+
+    def _get_compute_worker(self):
+        """返回计算子进程，history_data 换了时先让子进程从历史数据仓库重新读
+        没有启动或者子进程读历史数据失败（失败时停掉子进程）时返回None，由调用方在本进程计算
+        """
+        with self._update_lock:
+            worker = self.compute_worker
+            history_data = self.history_data
+            if worker is None or self._worker_history is history_data:
+                return worker
+            try:
+                worker.load_history(history_data.keys(), self._history_trading_time)
+            except RuntimeError as e:
+                print(f'计算子进程读取历史数据失败，改为在本进程计算: {e}')
+                self.stop_compute_worker()
+                return None
+            self._worker_history = history_data
+            return worker
+
     def get_merged_data(self, min_days=3, max_days=21):
-        """获取合并后的数据
+        """获取合并后的数据（最近发布的快照，不重新合并；合并在刷新数据时已经做过）
+        只读快照，不改推送状态；页面用返回值替换本地数据后要调用 request_full_sync，让下一次推送发全量
         
         Args:
-            min_days: 离涨停天数的最小值（用于计算总涨停数）
-            max_days: 离涨停天数的最大值（用于计算总涨停数）
+            min_days: 离涨停天数的最小值（保留参数，和 get_real_time_data 的参数一致）
+            max_days: 离涨停天数的最大值（保留参数，和 get_real_time_data 的参数一致）
+        """
+        return self.snapshots.latest().merged_data
+
+    def _publish_snapshot(self):
+        """把当前的工作数据发布成新的只读快照（调用前 merged_data 要已经按当前的行情合并过）"""
+        tracker_columns = self.breakthrough_tracker.columns() if self.breakthrough_tracker is not None else None
+        return self.snapshots.publish(self.concept_data, self.real_time_data, self.history_data, self.merged_data, self._count_concepts(self.concept_data), self._count_today_limit_up(self.concept_data, self.real_time_data), self.last_update_time, self.data_source_info, tracker_columns)
+
+    def get_snapshot_version(self):
+        """最近发布的快照版本号和更新时间，页面可以用来判断数据有没有变化"""
+        snapshot = self.snapshots.latest()
+        return {'版本': snapshot.version, '更新时间': snapshot.updated_at}
+
+    def request_full_sync(self):
+        """前端发现增量序号对不上时调用，下一次推送改为全量"""
+        self._force_full_push = True
+        return {'状态': '已请求', '消息': '下一次推送将发送全量数据'}
+
+    def _build_push_payload(self, snapshot):
+        """生成推送给前端的数据包
+
+        第一次推送或需要重新同步时发送全量数据；之后只发送和上一次推送相比有变化的行，
+        merged 里只带变化的字段，概念数据只在换了文件后才重新发送。
+        前端用 base 校验自己是否持有上一版数据，对不上就请求全量同步。
         """
-        self.merge_all_data(min_days=min_days, max_days=max_days)
-        return self.merged_data
+        self._push_seq += 1
+        merged_data = snapshot.merged_data
+        concept_count = snapshot.concept_count
+        today_limit_up = snapshot.today_limit_up
+        previous = self._pushed_state
+        if self._force_full_push or previous is None:
+            payload = {'seq': self._push_seq, 'full': True, 'merged': merged_data, 'realtime': quote_sources.quotes_to_dict(snapshot.real_time_data), 'concept': snapshot.concept_data, 'conceptCount': concept_count, 'todayLimitUp': today_limit_up}
+        else:
+            merged_fields, merged_rows, merged_removed = diff_rows(previous['merged'], merged_data, field_level=True)
+            _, realtime_rows, realtime_removed = diff_rows(previous['realtime'], snapshot.real_time_data)
+            realtime_rows = quote_sources.quotes_to_dict(realtime_rows)
+            payload = {'seq': self._push_seq, 'base': self._push_seq - 1, 'full': False, 'merged': merged_fields, 'mergedRows': merged_rows, 'mergedRemoved': merged_removed, 'realtimeRows': realtime_rows, 'realtimeRemoved': realtime_removed}
+            if not same_concept_data(previous['concept'], snapshot.concept_data):
+                payload['concept'] = snapshot.concept_data
+                payload['conceptCount'] = concept_count
+            if today_limit_up != previous['todayLimitUp']:
+                payload['todayLimitUp'] = today_limit_up
+        self._pushed_state = {'merged': merged_data, 'realtime': snapshot.real_time_data, 'concept': snapshot.concept_data, 'todayLimitUp': today_limit_up}
+        self._force_full_push = False
+        return payload
 
     def get_concept_count(self):
+        """每个概念的股票数（最近发布的快照）"""
+        return self.snapshots.latest().concept_count
+
+    def get_today_limit_up_count(self):
+        """每个概念的今日涨停数（最近发布的快照）"""
+        return self.snapshots.latest().today_limit_up
+
+    def _count_concepts(self, concept_data):
         concept_count = {}
-        for date, stocks_list in self.concept_data.items():
+        for date, stocks_list in concept_data.items():
             for stock_data in stocks_list:
                 concept = stock_data[3]
                 if concept and concept != '其他':
                     concept_count[concept] = concept_count.get(concept, 0) + 1
         return concept_count
 
-    def get_today_limit_up_count(self):
+    def _count_today_limit_up(self, concept_data, real_time_data):
         """统计每个概念的今日涨停数（使用严格标准：300/688需19.8%，其他9.8%）"""
         today_limit_up = {}
         counted_stocks = set()
-        for date, stocks_list in self.concept_data.items():
+        for date, stocks_list in concept_data.items():
             for stock_data in stocks_list:
                 stock_code = stock_data[0]
                 concept = stock_data[3]
@@ -714,10 +745,10 @@ class Api:
                         prefix_code = f'sh{stock_code}'
                     elif stock_code.startswith(('0', '3', '2')):
                         prefix_code = f'sz{stock_code}'
-                    if prefix_code and prefix_code in self.real_time_data:
-                        real_data = self.real_time_data[prefix_code]
+                    if prefix_code and prefix_code in real_time_data:
+                        real_data = real_time_data[prefix_code]
                         try:
-                            change_pct = float(real_data.get('涨幅', 0))
+                            change_pct = real_data.change
                             if self.is_limit_up(stock_code, change_pct):
                                 today_limit_up[concept] = today_limit_up.get(concept, 0) + 1
                                 counted_stocks.add(stock_code)
@@ -725,10 +756,21 @@ class Api:
                             continue
         return today_limit_up
 
-    def start_auto_update(self, interval=5):
+    def start_auto_update(self, interval=5, top_interval=1, high_interval=3, normal_interval=15, max_requests_per_second=20):
+        """启动后台自动更新
+
+        Args:
+            interval: 合并并推送到前端的间隔（秒）
+            top_interval: 表格中显示的股票的行情刷新间隔（秒）
+            high_interval: 高优先级股票的行情刷新间隔（秒）
+            normal_interval: 其他股票的行情刷新间隔（秒）
+            max_requests_per_second: 行情请求的全局每秒上限
+        """
+        self.quote_engine.configure(tier_intervals={quote_engine.TIER_TOP: float(top_interval), quote_engine.TIER_HIGH: float(high_interval), quote_engine.TIER_NORMAL: float(normal_interval)}, max_requests_per_second=max_requests_per_second)
         if self.auto_update_running:
             return {'状态': '已运行', '消息': '自动更新已在运行'}
         self.auto_update_running = True
+        self.quote_engine.start()
         self.update_thread = threading.Thread(target=self._auto_update_loop, args=(interval,), daemon=True)
         self.update_thread.start()
         print('后台自动更新已启动')
@@ -736,33 +778,48 @@ class Api:
 
     def stop_auto_update(self):
         self.auto_update_running = False
+        self.quote_engine.stop()
+        if self.tick_recorder is not None:
+            self.tick_recorder.close()
         return {'状态': '已停止', '消息': '自动更新已停止'}
 
     def _auto_update_loop(self, interval):
+        """按交易日历调度：交易中（以及收盘后到16:00）每 interval 秒更新一次，9:14:30 检查数据是否已更新，
+        午间休市、收盘后和休市日一直睡到下一次开盘前
+        """
         print('后台自动更新任务启动')
         while self.auto_update_running:
-            time_info = get_xls_data.get_current_time_info()
-            hour = time_info['小时']
-            minute = time_info['分钟']
-            second = time_info['秒']
-            is_trading_time = False
-            if hour == 9 and minute >= 15:
-                is_trading_time = True
-            elif 10 <= hour <= 15:
-                is_trading_time = True
-            elif hour == 16 and minute == 0:
-                is_trading_time = True
-            if hour == 9 and minute == 14 and (second >= 30):
-                print(f"[{time_info['时间']}] 开始检查数据更新...")
+            now = datetime.now()
+            state = trading_calendar.session_state(now)
+            now_time = now.strftime('%H:%M:%S')
+            if state == trading_calendar.SESSION_PRE_OPEN and now.time() >= trading_calendar.PRE_OPEN_CHECK_TIME:
+                print(f'[{now_time}] 开始检查数据更新...')
                 self._check_and_update_data()
                 time.sleep(10)
-            elif is_trading_time:
-                print(f"[{time_info['时间']}] 交易时间更新数据...")
+            elif state == trading_calendar.SESSION_OPEN or (state == trading_calendar.SESSION_AFTER_CLOSE and now.time() < trading_calendar.AFTER_CLOSE_UPDATE_END):
+                print(f'[{now_time}] 交易时间更新数据...')
+                tick_start = time.perf_counter()
                 self._update_all_data()
+                tick_seconds = time.perf_counter() - tick_start
+                metrics.observe('刷新总耗时', tick_seconds)
+                if tick_seconds > interval:
+                    metrics.increment('超出刷新预算')
+                    print(f'本轮刷新用时 {tick_seconds:.2f} 秒，超过 {interval} 秒的预算，各阶段耗时见 get_metrics()')
                 time.sleep(interval)
             else:
-                print(f"[{time_info['时间']}] 非交易时间，暂停更新...")
-                time.sleep(60)
+                wake_at = trading_calendar.next_open(now)
+                if wake_at.time() == trading_calendar.OPEN_TIME:
+                    wake_at = datetime.combine(wake_at.date(), trading_calendar.PRE_OPEN_CHECK_TIME)
+                print(f"[{now_time}] {state}，暂停更新到 {wake_at.strftime('%Y-%m-%d %H:%M:%S')}")
+                self._sleep_until(wake_at)
+
+    def _sleep_until(self, wake_at):
+        """睡到 wake_at，每分钟醒一次看自动更新是否已停止（也能跟上系统时间的调整）"""
+        while self.auto_update_running:
+            remaining = (wake_at - datetime.now()).total_seconds()
+            if remaining <= 0:
+                return
+            time.sleep(min(remaining, 60))
 
     def _check_and_update_data(self):
         try:
@@ -773,7 +830,7 @@ class Api:
             updated = False
             for prefix_code in sample_codes:
                 stock_code = prefix_code[2:]
-                old_price = self.real_time_data[prefix_code].get('现价', '')
+                old_price = self.real_time_data[prefix_code].price
                 is_updated, new_price = get_xls_data.check_data_updated(stock_code, old_price)
                 if is_updated:
                     print(f'检测到数据更新: {stock_code} {old_price} -> {new_price}')
@@ -787,43 +844,113 @@ class Api:
         except Exception as e:
             print(f'检查数据更新失败: {e}')
 
+    def _prepare_tick_inputs(self, count):
+        """准备自动更新用的概念数据、历史数据和优先级分类
+        概念数据每轮读取（有解析缓存），历史数据和分类只在日期、数据源或xlsx文件变化时重新加载
+        """
+        auto_index, reason = get_xls_data.get_data_source_index()
+        self.data_source_info = reason
+        with metrics.timer('读取xlsx'):
+            self.concept_data = get_xls_data.get_folder_data(strat_index=auto_index, count=count)
+        inputs_key = (datetime.now().strftime('%Y-%m-%d'), auto_index, count)
+        if inputs_key != self._tick_inputs_key or not same_concept_data(self._tick_concept_data, self.concept_data):
+            print(f'数据源选择: {reason}, 使用索引: {auto_index}，重新加载历史数据和优先级分类')
+            with metrics.timer('加载历史数据'):
+                self.get_history_data(strat_index=auto_index, count=count, show_progress=False)
+            classification = self.classify_priority_stocks(strat_index=auto_index, count=count)
+            self._high_priority_codes = classification['high_priority']
+            self._tick_inputs_key = inputs_key
+            self._tick_concept_data = self.concept_data
+            self._concept_slices = {}
+
+    @exclusive_update
+    def _subscribe_quotes(self, count, priority_codes):
+        """按当前的股票范围和优先级更新行情引擎的订阅"""
+        self._prepare_tick_inputs(count)
+        all_stock_codes = set()
+        for date, stocks_list in self.concept_data.items():
+            for stock_data in stocks_list:
+                all_stock_codes.add(stock_data[0])
+        prefix_codes = [code for code in map(get_xls_data.to_prefix_code, all_stock_codes) if code]
+        top_priority = [code for code in map(get_xls_data.to_prefix_code, priority_codes) if code]
+        high_priority = [code for code in map(get_xls_data.to_prefix_code, self._high_priority_codes) if code]
+        self.quote_engine.subscribe(prefix_codes, top_priority=top_priority, high_priority=high_priority)
+
+    def _refresh_from_engine(self):
+        """读取行情引擎最新的行情快照（不等待网络，订阅见 _subscribe_quotes）
+        Returns:
+            int: 快照版本号
+        """
+        version, quotes, updated_at = self.quote_engine.snapshot()
+        self.real_time_data = quotes
+        if version != self._last_snapshot_version and quotes:
+            self._record_tick(quotes, updated_at)
+        if updated_at:
+            self.last_update_time = datetime.fromtimestamp(updated_at).strftime('%H:%M:%S')
+        self.check_breakthrough()
+        return version
+
+    def _record_tick(self, quotes, updated_at):
+        """把新的行情快照追加到当天的录制文件（见 tick_recorder），写文件出错时录制器当天不再录制"""
+        if not tick_recorder.TICK_RECORDING_ENABLED:
+            return
+        if self.tick_recorder is None:
+            self.tick_recorder = tick_recorder.TickRecorder()
+        with metrics.timer('行情录制'):
+            self.tick_recorder.record(quotes, updated_at or None)
+
     def _update_all_data(self):
+        """自动更新一轮：读取页面参数、更新订阅，等到第一份行情快照后再加锁合并和推送
+
+        等待行情不持有 _update_lock，启动时这段等待最长15秒，期间 apply_range_params 等写入方照常执行
+        """
         try:
+            js_start = time.perf_counter()
             previewValue = int(webview.windows[0].evaluate_js('document.querySelector(".preview").value'))
             backValue = int(webview.windows[0].evaluate_js('document.querySelector(".back").value'))
             priority_codes_js = webview.windows[0].evaluate_js('window.getCurrentDisplayedStocks ? window.getCurrentDisplayedStocks() : []')
             priority_codes = priority_codes_js if priority_codes_js else []
+            metrics.observe('推送_读取前端参数', time.perf_counter() - js_start)
             print(f'自动更新使用参数: preview={previewValue}, back={backValue}, 表格股票数={len(priority_codes)}')
         except Exception as e:
             print(f'获取前端参数失败，使用默认值: {e}')
             previewValue = 3
             backValue = 21
             priority_codes = []
-        result = self.get_real_time_data(strat_index=None, count=backValue, show_progress=False, priority_codes=priority_codes)
-        concept_count = self.get_concept_count()
+        self._subscribe_quotes(backValue, priority_codes)
+        if not self.quote_engine.buffer.wait_first(timeout=15):
+            print('[行情引擎] 还没有拿到第一份行情快照')
+        self._merge_and_push(previewValue, backValue)
+
+    @exclusive_update
+    def _merge_and_push(self, previewValue, backValue):
+        """用最新的行情快照合并、发布并推送到页面（行情没有更新时跳过）"""
+        snapshot_version = self._refresh_from_engine()
+        if snapshot_version == self._last_snapshot_version:
+            print('行情快照没有更新，跳过本轮合并和推送')
+            return
+        self._last_snapshot_version = snapshot_version
         print(f'数据更新完成: {self.last_update_time} - {self.data_source_info}')
         try:
-            webview.windows[0].evaluate_js('if(window.hideProgress) hideProgress();')
+            with metrics.timer('推送_hideProgress'):
+                webview.windows[0].evaluate_js('if(window.hideProgress) hideProgress();')
         except Exception as e:
             pass
         try:
-            import json
-            merged_data = self.get_merged_data(min_days=previewValue, max_days=backValue)
-            real_time_data = self.real_time_data
-            concept_data = self.concept_data
-            today_limit_up = self.get_today_limit_up_count()
-            merged_json = json.dumps(merged_data, ensure_ascii=False)
-            real_time_json = json.dumps(real_time_data, ensure_ascii=False)
-            concept_data_json = json.dumps(concept_data, ensure_ascii=False)
-            concept_count_json = json.dumps(concept_count, ensure_ascii=False)
-            today_limit_up_json = json.dumps(today_limit_up, ensure_ascii=False)
-            webview.windows[0].evaluate_js(f'window.mergedData = {merged_json}')
-            webview.windows[0].evaluate_js(f'window.realTimeData = {real_time_json}')
-            webview.windows[0].evaluate_js(f'window.conceptData = {concept_data_json}')
-            webview.windows[0].evaluate_js(f'window.conceptCount = {concept_count_json}')
-            webview.windows[0].evaluate_js(f'window.todayLimitUp = {today_limit_up_json}')
-            webview.windows[0].evaluate_js('if(window.fillStockTable) fillStockTable();')
+            self.merge_all_data(min_days=previewValue, max_days=backValue)
+            snapshot = self._publish_snapshot()
+            with metrics.timer('构建推送数据'):
+                payload = self._build_push_payload(snapshot)
+            with metrics.timer('序列化'):
+                payload_json = json.dumps(payload, ensure_ascii=False)
+            metrics.increment('推送字节数', len(payload_json))
+            mode = '全量' if payload['full'] else '增量'
+            print(f"推送{mode}数据 #{payload['seq']}: {len(payload_json) // 1024}KB")
+            with metrics.timer('推送_数据'):
+                webview.windows[0].evaluate_js(f'if(window.applyDataPatch && applyDataPatch({payload_json}) && window.fillStockTable) fillStockTable();')
         except Exception as e:
+            metrics.increment('推送失败')
+            self._force_full_push = True
             print(f'推送数据到前端失败: {e}')
         except Exception as e:
             print(f'更新数据失败: {e}')
@@ -832,8 +959,65 @@ class Api:
             except:
                 pass
 
+    def get_metrics(self):
+        """刷新流程各阶段的耗时统计（次数、平均、p50/p95/p99、最大，毫秒）和请求/重试/失败计数"""
+        return metrics.snapshot()
+
+    def start_metrics_server(self, port=9108):
+        """启动本地 Prometheus 文本格式的指标接口，返回地址"""
+        return metrics.start_http_server(port)
+
+    def query_stocks(self, filters=None, sort=None, limit=100):
+        """在后端按表格的筛选条件查询，只返回符合条件、排好序的行
+
+        Args:
+            filters: 与页面 currentFilterConditions 相同的字典，可额外带 boardStandard: {'主板'/'创业板'/'科创板': '严格'/'宽松'}
+            sort: 页面的 currentSort {column, direction}
+            limit: 最多返回多少行，0表示全部
+        Returns:
+            dict: {'总数', '股票': [合并结果行 + 概念 + 盘中突破字段]}
+        """
+        snapshot = self.snapshots.latest()
+        cached = self._stock_table
+        if cached is not None and cached[0] is snapshot:
+            table = cached[1]
+        else:
+            with metrics.timer('建立查询索引'):
+                table = stock_query.StockTable(snapshot.merged_data, snapshot.concept_data, snapshot.tracker_columns)
+            # 和快照放在同一个元组里一起替换，并发的查询不会拿到对不上的索引
+            self._stock_table = (snapshot, table)
+        with metrics.timer('查询'):
+            return table.query(filters, sort, limit)
+
+    def run_backtest(self, filters=None, days=250, horizons=(1, 3, 5, 10), refresh=False):
+        """用历史日K线回测表格筛选条件，返回汇总和每天的命中股票及之后N日收益
+
+        Args:
+            filters: 筛选条件 {名称: 值}，如 {'连续涨停数至少': 2, '前N天阳天数': 3}，名称见 backtest.SUPPORTED_FILTERS
+            days: 回放最近多少个交易日
+            horizons: 计算收益的持有天数
+            refresh: 重新抓取回测K线
+        """
+        try:
+            return backtest.run_backtest(filters, days, horizons, refresh=refresh)
+        except ValueError as e:
+            return {'错误': str(e)}
+
     def get_update_status(self):
-        return {'运行中': self.auto_update_running, '最后更新': self.last_update_time, '数据源': self.data_source_info, '时间信息': get_xls_data.get_current_time_info()}
-api = Api()
-webview.create_window(title='股票爬虫程序', url=get_resource_path('index.html'), width=800, height=600, resizable=True, fullscreen=False, js_api=api)
-webview.start(debug=True)
\ No newline at end of file
+        engine = self.quote_engine
+        engine_status = {'运行中': engine.running, '订阅数': len(engine.get_subscribed()), '分层股票数': engine.get_tier_counts(), '分层刷新间隔': dict(engine.tier_intervals), '每秒请求上限': engine.max_requests_per_second, '已发请求': engine.requests_sent, '超预算延后': engine.requests_deferred, '发布次数': engine.rounds}
+        return {'运行中': self.auto_update_running, '最后更新': self.last_update_time, '数据源': self.data_source_info, '时间信息': get_xls_data.get_current_time_info(), '行情引擎': engine_status, '自适应限流': adaptive_limiter.get_status(), '限流事件': adaptive_limiter.get_recent_events(), '行情源': quote_sources.get_status(), '计算子进程': self.compute_worker.status() if self.compute_worker is not None else {'运行中': False}, '行情录制': self.tick_recorder.status() if self.tick_recorder is not None else {}}
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    if os.environ.get('THREE_SUN_METRICS_PORT'):
+        metrics.start_http_server(int(os.environ['THREE_SUN_METRICS_PORT']))
+    startup.mark('模块导入完成')
+    api = Api()
+    # THREE_SUN_EAGER_STARTUP=1 时按原来的方式在窗口创建之前同步读完所有数据
+    api.start_warm_up(background=not startup.EAGER_STARTUP)
+    if compute_worker.COMPUTE_WORKER_ENABLED:
+        api.start_compute_worker()
+    window = webview.create_window(title='股票爬虫程序', url=get_resource_path('index.html'), width=800, height=600, resizable=True, fullscreen=False, js_api=api)
+    startup.mark('窗口已创建')
+    window.events.loaded += lambda: startup.mark('页面加载完成')
+    webview.start(debug=True)
\ No newline at end of file
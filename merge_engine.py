@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""合并引擎：历史特征表 + 按实时行情增量合并
+
+历史特征表只依赖历史数据，每天随 history_data 更新一次；实时字段只对行情有变化的股票重新计算，
+行情没变的行直接复用上一轮的结果。Api 在本进程里用它合并，compute_worker 在计算子进程里用同一份代码
+"""
+import history_matrix
+
+HISTORY_STAT_FIELDS = ('涨停数_严格', '涨停数_宽松', '单日涨停数_严格', '单日涨停数_宽松', '连续涨停数_严格', '连续涨停数_宽松', '总涨停数_严格', '总涨停数_宽松', '全部涨停天数_严格', '全部涨停天数_宽松', '总涨停数_天数_严格', '总涨停数_天数_宽松', '离涨停多少天_严格', '离涨停多少天_宽松')
+HISTORY_PRICE_FIELDS = ('昨日收盘价', '昨日涨幅', '30日最高价', '30日最低价', '60日最高价', '60日最低价')
+QUOTE_ROW_FIELDS = ('代码', '名称', '行业', '现价', '涨幅', '换手率', '流通市值', '今日最高价', '今日最低价')
+PRICE_DISTANCE_FIELDS = ('离最高价%', '离最低价%', '离30日新高%', '离60日新高%')
+# merge_row 生成的全部字段（按生成顺序），compute_worker 按这个顺序把行打包成值的元组
+MERGED_FIELDS = QUOTE_ROW_FIELDS + HISTORY_STAT_FIELDS + ('阳天数', '前N天阳天数') + HISTORY_PRICE_FIELDS + PRICE_DISTANCE_FIELDS
+EMPTY_HISTORY_STATS = {'涨停数_严格': 0, '涨停数_宽松': 0, '单日涨停数_严格': 0, '单日涨停数_宽松': 0, '连续涨停数_严格': 0, '连续涨停数_宽松': 0, '总涨停数_严格': 0, '总涨停数_宽松': 0, '全部涨停天数_严格': 0, '全部涨停天数_宽松': 0, '总涨停数_天数_严格': 0, '总涨停数_天数_宽松': 0, '离涨停多少天_严格': '无涨停', '离涨停多少天_宽松': '无涨停'}
+
+def limit_stats_to_dict(matrix, stats):
+    """把向量化的涨停统计转换为 {代码: {最大连续涨停数, 最后涨停日期, 离最新日期天数}}，无涨停的股票不出现"""
+    result = {}
+    days_diff = stats['离最新日期天数']
+    for i, stock_code in enumerate(matrix.codes):
+        if days_diff[i] < 0:
+            continue
+        result[stock_code] = {'最大连续涨停数': int(stats['最大连续涨停数'][i]), '最后涨停日期': history_matrix.int_to_date(stats['最后涨停日期'][i]), '离最新日期天数': int(days_diff[i])}
+    return result
+
+def classify_priority(features, stock_codes):
+    """按历史特征表给股票分优先级：阳天数=1且有连续涨停（宽松版>=2）的是高优先级
+    Returns:
+        tuple: ([高优先级代码], [普通优先级代码])
+    """
+    matrix = features['matrix']
+    sunny_days = features['trend']['上涨天数_最后']
+    high_priority = []
+    normal_priority = []
+    for stock_code in stock_codes:
+        row = matrix.index.get(stock_code)
+        if row is not None and matrix.lengths[row] >= 2 and sunny_days[row] == 1 and features['rows'][stock_code]['连续涨停数_宽松'] >= 2:
+            high_priority.append(stock_code)
+        else:
+            normal_priority.append(stock_code)
+    return (high_priority, normal_priority)
+
+class MergeEngine:
+    """持有历史特征表和上一轮合并结果的缓存；history_data、industry_data 按对象判断是否换了，换了才重建"""
+
+    def __init__(self):
+        self._matrix = None
+        self._matrix_source = None
+        self._features = None
+        self._features_source = None
+        self._industry_data = {}
+        self._row_cache = {}
+
+    def get_history_matrix(self, history_data):
+        """获取历史数据的列式矩阵，history_data 被替换后自动重建"""
+        if self._matrix is None or self._matrix_source is not history_data:
+            self._matrix = history_matrix.HistoryMatrix(history_data)
+            self._matrix_source = history_data
+        return self._matrix
+
+    def get_history_features(self, history_data):
+        """获取只依赖历史数据的特征表（每天随 history_data 更新一次）
+
+        Returns:
+            dict: {'matrix', 'trend', 'strict_info', 'loose_info', 'rows': {代码: 合并结果中的历史字段}}
+        """
+        if self._features is not None and self._features_source is history_data:
+            return self._features
+        # 连续涨停数基于全部60天历史数据，不受Excel日期范围限制
+        matrix = self.get_history_matrix(history_data)
+        strict_stats = history_matrix.compute_limit_up_stats(matrix, matrix.limit_up_mask(matrix.strict_thresholds))
+        loose_stats = history_matrix.compute_limit_up_stats(matrix, matrix.limit_up_mask(matrix.loose_thresholds))
+        trend_stats = history_matrix.compute_trend_stats(matrix)
+        strict_info = limit_stats_to_dict(matrix, strict_stats)
+        loose_info = limit_stats_to_dict(matrix, loose_stats)
+        rows = {}
+        for i, stock_code in enumerate(matrix.codes):
+            hist_data = history_data[stock_code]
+            price_list = hist_data.get('历史价格列表', [])
+            streak_strict = strict_info.get(stock_code, {}).get('最大连续涨停数', 0)
+            streak_loose = loose_info.get(stock_code, {}).get('最大连续涨停数', 0)
+            total_strict = int(strict_stats['全部涨停天数'][i])
+            total_loose = int(loose_stats['全部涨停天数'][i])
+            rows[stock_code] = {'涨停数_严格': int(strict_stats['涨停数'][i]), '涨停数_宽松': int(loose_stats['涨停数'][i]), '单日涨停数_严格': int(strict_stats['单日涨停数'][i]), '单日涨停数_宽松': int(loose_stats['单日涨停数'][i]), '连续涨停数_严格': streak_strict, '连续涨停数_宽松': streak_loose, '总涨停数_严格': max(0, total_strict - streak_strict), '总涨停数_宽松': max(0, total_loose - streak_loose), '全部涨停天数_严格': total_strict, '全部涨停天数_宽松': total_loose, '总涨停数_天数_严格': max(0, total_strict - streak_strict), '总涨停数_天数_宽松': max(0, total_loose - streak_loose), '离涨停多少天_严格': strict_info.get(stock_code, {}).get('离最新日期天数', '无涨停'), '离涨停多少天_宽松': loose_info.get(stock_code, {}).get('离最新日期天数', '无涨停'), '前N天阳天数': int(trend_stats['前N天阳天数'][i]), '收盘涨幅': price_list[-1]['涨幅'] if price_list else '', '昨日收盘价': hist_data.get('昨日收盘价', ''), '昨日涨幅': hist_data.get('昨日涨幅', ''), '30日最高价': hist_data.get('30日最高价', ''), '30日最低价': hist_data.get('30日最低价', ''), '60日最高价': hist_data.get('60日最高价', ''), '60日最低价': hist_data.get('60日最低价', '')}
+        self._features = {'matrix': matrix, 'trend': trend_stats, 'strict_info': strict_info, 'loose_info': loose_info, 'rows': rows}
+        self._features_source = history_data
+        self._row_cache = {}
+        print(f'历史特征表已重建: {len(rows)} 个股票')
+        return self._features
+
+    def merge_row(self, stock_code, real_data, features, is_trading_time):
+        """用实时行情和历史特征生成单只股票的合并结果（只计算依赖实时价格的字段）"""
+        hist_row = features['rows'].get(stock_code)
+        sunny_days = 0
+        quote_fields = real_data.to_dict()
+        if hist_row is not None:
+            sunny_days = history_matrix.live_sunny_days(features['matrix'], features['trend'], features['matrix'].index[stock_code], real_data.price)
+        if is_trading_time:
+            current_change = quote_fields['涨幅']
+        elif hist_row is not None:
+            current_change = hist_row['收盘涨幅']
+        else:
+            current_change = ''
+        merged_row = {'代码': stock_code, '名称': real_data.name, '行业': self._industry_data.get(stock_code, {}).get('行业', '-'), '现价': quote_fields['现价'], '涨幅': current_change, '换手率': quote_fields['换手率'], '流通市值': quote_fields['流通市值'], '今日最高价': quote_fields['今日最高价'], '今日最低价': quote_fields['今日最低价']}
+        if hist_row is not None:
+            for key in HISTORY_STAT_FIELDS:
+                merged_row[key] = hist_row[key]
+        else:
+            merged_row.update(EMPTY_HISTORY_STATS)
+        merged_row['阳天数'] = sunny_days
+        merged_row['前N天阳天数'] = hist_row['前N天阳天数'] if hist_row is not None else 0
+        if hist_row is not None:
+            for key in HISTORY_PRICE_FIELDS:
+                merged_row[key] = hist_row[key]
+        try:
+            current_price = real_data.price
+            today_high = real_data.high
+            today_low = real_data.low
+            max_30d = float(merged_row.get('30日最高价', 0))
+            max_60d = float(merged_row.get('60日最高价', 0))
+            if current_price > 0 and today_high > 0:
+                merged_row['离最高价%'] = f'{(current_price - today_high) / today_high * 100:.2f}'
+            else:
+                merged_row['离最高价%'] = '0.00'
+            if current_price > 0 and today_low > 0:
+                merged_row['离最低价%'] = f'{(current_price - today_low) / today_low * 100:.2f}'
+            else:
+                merged_row['离最低价%'] = '0.00'
+            if current_price > 0 and max_30d > 0:
+                percent_to_30d = (current_price - max_30d) / max_30d * 100
+                merged_row['离30日新高%'] = f'{percent_to_30d:.2f}'
+            else:
+                merged_row['离30日新高%'] = '0.00'
+            if current_price > 0 and max_60d > 0:
+                percent_to_60d = (current_price - max_60d) / max_60d * 100
+                merged_row['离60日新高%'] = f'{percent_to_60d:.2f}'
+            else:
+                merged_row['离60日新高%'] = '0.00'
+        except:
+            merged_row['离最高价%'] = '0.00'
+            merged_row['离最低价%'] = '0.00'
+            merged_row['离30日新高%'] = '0.00'
+            merged_row['离60日新高%'] = '0.00'
+        return merged_row
+
+    def merge(self, real_time_data, history_data, industry_data, is_trading_time):
+        """合并所有股票
+        Args:
+            real_time_data: {带前缀代码: Quote}
+            industry_data: {代码: {'行业': ...}}，换了对象会清掉合并缓存
+            is_trading_time: 交易时间用实时涨幅，否则用历史数据里的收盘涨幅
+        Returns:
+            tuple: ({代码: 合并结果}, [本轮重新计算的带前缀代码])
+        """
+        features = self.get_history_features(history_data)
+        if industry_data is not self._industry_data:
+            # 行业数据到达之前合并出的行里行业是'-'，换了行业数据要重新生成
+            self._industry_data = industry_data
+            self._row_cache = {}
+        merged = {}
+        row_cache = {}
+        recomputed = []
+        for prefix_code, real_data in real_time_data.items():
+            stock_code = prefix_code[2:]
+            cache_key = (real_data, is_trading_time)
+            cached = self._row_cache.get(stock_code)
+            if cached is not None and cached[0] == cache_key:
+                merged[stock_code] = cached[1]
+                row_cache[stock_code] = cached
+                continue
+            merged_row = self.merge_row(stock_code, real_data, features, is_trading_time)
+            merged[stock_code] = merged_row
+            row_cache[stock_code] = (cache_key, merged_row)
+            recomputed.append(prefix_code)
+        self._row_cache = row_cache
+        return (merged, recomputed)
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+import functools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+HISTOGRAM_WINDOW = 500
+QUANTILES = (0.5, 0.95, 0.99)
+
+class StageHistogram:
+    """单个阶段的滚动耗时统计：最近 window 次的样本用于分位数，累计次数和总耗时一直保留"""
+
+    def __init__(self, window=HISTOGRAM_WINDOW):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+        self.last = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+        self.last = seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+    def summary(self):
+        """Returns:
+            dict: 次数、平均/最近/最大/p50/p95/p99耗时（毫秒）
+        """
+        recent_mean = sum(self.samples) / len(self.samples) if self.samples else 0.0
+        return {'次数': self.count, '平均毫秒': round(recent_mean * 1000, 2), '最近毫秒': round(self.last * 1000, 2), '最大毫秒': round(self.max * 1000, 2), 'p50毫秒': round(self.quantile(0.5) * 1000, 2), 'p95毫秒': round(self.quantile(0.95) * 1000, 2), 'p99毫秒': round(self.quantile(0.99) * 1000, 2)}
+
+_lock = threading.Lock()
+_stages = {}
+_counters = {}
+_started_at = time.time()
+
+def observe(stage, seconds):
+    """记录一次阶段耗时（秒）"""
+    with _lock:
+        histogram = _stages.get(stage)
+        if histogram is None:
+            histogram = _stages[stage] = StageHistogram()
+        histogram.observe(seconds)
+
+@contextmanager
+def timer(stage):
+    """计时上下文：with metrics.timer('合并'): ...，出异常时也会记录"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+def timed(stage):
+    """计时装饰器，每次调用被装饰的函数都记录一次 stage 的耗时"""
+
+    def decorator(func):
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def increment(name, amount=1):
+    """计数器加 amount"""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+def snapshot():
+    """Returns:
+        dict: {'运行秒数', '阶段耗时': {阶段: 统计}, '计数器': {名称: 次数}}
+    """
+    with _lock:
+        stages = {stage: histogram.summary() for stage, histogram in _stages.items()}
+        counters = dict(_counters)
+    return {'运行秒数': round(time.time() - _started_at, 1), '阶段耗时': stages, '计数器': counters}
+
+def reset():
+    with _lock:
+        _stages.clear()
+        _counters.clear()
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def prometheus_text():
+    """Prometheus 文本格式（阶段耗时为summary，计数器为counter）"""
+    with _lock:
+        stages = [(stage, list(histogram.samples), histogram.count, histogram.total) for stage, histogram in _stages.items()]
+        counters = list(_counters.items())
+    lines = ['# HELP three_sun_stage_seconds 刷新流程各阶段耗时', '# TYPE three_sun_stage_seconds summary']
+    for stage, samples, count, total in stages:
+        label = _escape_label(stage)
+        ordered = sorted(samples)
+        for q in QUANTILES:
+            value = ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))] if ordered else 0.0
+            lines.append(f'three_sun_stage_seconds{{stage="{label}",quantile="{q}"}} {value:.6f}')
+        lines.append(f'three_sun_stage_seconds_sum{{stage="{label}"}} {total:.6f}')
+        lines.append(f'three_sun_stage_seconds_count{{stage="{label}"}} {count}')
+    lines.append('# HELP three_sun_events_total 请求、重试、失败等计数')
+    lines.append('# TYPE three_sun_events_total counter')
+    for name, value in counters:
+        lines.append(f'three_sun_events_total{{name="{_escape_label(name)}"}} {value}')
+    return '\n'.join(lines) + '\n'
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = prometheus_text().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+_server = None
+
+def start_http_server(port=9108, host='127.0.0.1'):
+    """在后台线程启动 /metrics 接口（Prometheus文本格式），重复调用返回已启动的地址"""
+    global _server
+    with _lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            threading.Thread(target=_server.serve_forever, name='metrics-http', daemon=True).start()
+            print(f'指标接口已启动: http://{host}:{_server.server_address[1]}/metrics')
+        return f'http://{host}:{_server.server_address[1]}/metrics'
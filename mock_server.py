@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+"""本地模拟行情服务器
+
+模拟腾讯实时行情(q=sh600000,...)、东方财富push2批量行情和东方财富日K线接口，
+股票池是按代码确定性生成的合成数据，可以配置延迟、错误率和限流，用于压测和离线调试。
+
+用法:
+    python mock_server.py --port 8900 --latency 0.03 --error-rate 0.01 --max-rps 200
+然后设置环境变量让程序连到本地:
+    THREE_SUN_TENCENT_URL=http://127.0.0.1:8900/q=
+    THREE_SUN_EASTMONEY_URL=http://127.0.0.1:8900/api/qt/ulist.np/get
+    THREE_SUN_KLINE_URL=http://127.0.0.1:8900/api/qt/stock/fflow/daykline/get
+"""
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from aiohttp import web
+
+class MockConfig:
+    """模拟服务器的故障注入参数
+    Args:
+        latency: 每个请求的基础延迟（秒）
+        jitter: 在基础延迟上叠加 0~jitter 秒的随机延迟
+        error_rate: 返回502的概率
+        slow_rate: 变成慢请求的概率
+        slow_latency: 慢请求的延迟（秒）
+        max_rps: 每秒最多处理的请求数，超出返回503，0表示不限流
+    """
+
+    def __init__(self, latency=0.03, jitter=0.02, error_rate=0.0, slow_rate=0.0, slow_latency=3.0, max_rps=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.max_rps = max_rps
+
+def trading_days(count, end=None):
+    """截止到end（含）的最近count个工作日，'2025-10-30'格式，从早到晚"""
+    day = end or datetime.now()
+    days = []
+    while len(days) < count:
+        if day.weekday() < 5:
+            days.append(day.strftime('%Y-%m-%d'))
+        day -= timedelta(days=1)
+    return days[::-1]
+
+def make_universe(size, seed=1):
+    """生成size个合成股票代码，沪深主板、创业板、科创板按比例混合"""
+    rnd = random.Random(seed)
+    prefixes = ['600', '601', '603', '000', '002', '300', '688']
+    codes = set()
+    while len(codes) < size:
+        codes.add(rnd.choice(prefixes) + f'{rnd.randrange(1000):03d}')
+    return sorted(codes)
+
+class MockMarket:
+    """合成行情：每只股票一条确定性的日K线随机游走，实时价格在最后收盘价附近波动"""
+
+    def __init__(self, seed=1, days=80):
+        self.seed = seed
+        self.dates = trading_days(days)
+        self._klines = {}
+        self._live = {}
+        self._lock = threading.Lock()
+
+    def klines(self, stock_code):
+        """[(日期, 收盘价, 涨幅), ...]"""
+        rows = self._klines.get(stock_code)
+        if rows is None:
+            rnd = random.Random(int(stock_code) * 7919 + self.seed)
+            limit_pct = 20.0 if stock_code.startswith(('3', '68')) else 10.0
+            close = round(rnd.uniform(3, 80), 2)
+            rows = []
+            for date in self.dates:
+                if rnd.random() < 0.04:
+                    change = limit_pct
+                else:
+                    change = round(rnd.gauss(0.2, 2.5), 2)
+                close = max(0.5, round(close * (1 + change / 100), 2))
+                rows.append((date, close, change))
+            self._klines[stock_code] = rows
+        return rows
+
+    def quote(self, stock_code):
+        """当前实时行情，每次调用都有一定概率小幅变动
+        Returns:
+            dict: 名称、现价、涨幅、换手率、流通市值(亿元)、最高、最低
+        """
+        with self._lock:
+            live = self._live.get(stock_code)
+            if live is None:
+                rows = self.klines(stock_code)
+                yesterday = rows[-2][1]
+                rnd = random.Random(int(stock_code) + self.seed)
+                live = {'名称': f'模拟{stock_code}', '昨收': yesterday, '现价': rows[-1][1], '最高': rows[-1][1], '最低': rows[-1][1], '换手率': round(rnd.uniform(0.5, 15), 2), '流通市值': round(rnd.uniform(20, 800), 2)}
+                self._live[stock_code] = live
+            elif random.random() < 0.3:
+                price = max(0.5, round(live['现价'] * (1 + random.gauss(0, 0.003)), 2))
+                live['现价'] = price
+                live['最高'] = max(live['最高'], price)
+                live['最低'] = min(live['最低'], price)
+            result = dict(live)
+        result['涨幅'] = round((result['现价'] / result['昨收'] - 1) * 100, 2)
+        return result
+
+class MockServer:
+    """在后台线程里运行的模拟服务器"""
+
+    def __init__(self, host='127.0.0.1', port=8900, config=None, market=None):
+        self.host = host
+        self.port = port
+        self.config = config or MockConfig()
+        self.market = market or MockMarket()
+        self.requests = 0
+        self.errors = 0
+        self.throttled = 0
+        self._window_start = time.monotonic()
+        self._window_count = 0
+        self._loop = None
+        self._runner = None
+        self._thread = None
+        self._ready = threading.Event()
+
+    @property
+    def base_url(self):
+        return f'http://{self.host}:{self.port}'
+
+    def endpoint_env(self):
+        """让程序连到本服务器所需的环境变量"""
+        return {'THREE_SUN_TENCENT_URL': f'{self.base_url}/q=', 'THREE_SUN_EASTMONEY_URL': f'{self.base_url}/api/qt/ulist.np/get', 'THREE_SUN_KLINE_URL': f'{self.base_url}/api/qt/stock/fflow/daykline/get'}
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_get('/api/qt/ulist.np/get', self.handle_eastmoney_quotes)
+        app.router.add_get('/api/qt/stock/fflow/daykline/get', self.handle_klines)
+        app.router.add_get('/{query}', self.handle_tencent_quotes)
+        return app
+
+    async def _inject_faults(self):
+        """按配置模拟延迟、错误和限流，返回需要直接返回的错误响应或None"""
+        self.requests += 1
+        config = self.config
+        if config.max_rps:
+            now = time.monotonic()
+            if now - self._window_start >= 1:
+                self._window_start = now
+                self._window_count = 0
+            self._window_count += 1
+            if self._window_count > config.max_rps:
+                self.throttled += 1
+                return web.Response(status=503, text='too many requests')
+        delay = config.slow_latency if random.random() < config.slow_rate else config.latency + random.uniform(0, config.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if random.random() < config.error_rate:
+            self.errors += 1
+            return web.Response(status=502, text='bad gateway')
+        return None
+
+    async def handle_tencent_quotes(self, request):
+        query = request.match_info['query']
+        if not query.startswith('q='):
+            raise web.HTTPNotFound()
+        error = await self._inject_faults()
+        if error is not None:
+            return error
+        lines = []
+        for prefix_code in query[2:].split(','):
+            stock_code = prefix_code[2:]
+            if not stock_code.isdigit():
+                lines.append('v_pv_none_match="1";')
+                continue
+            q = self.market.quote(stock_code)
+            parts = ['0'] * 88
+            parts[0] = '1'
+            parts[1] = q['名称']
+            parts[2] = stock_code
+            parts[3] = f"{q['现价']:.2f}"
+            parts[4] = f"{q['昨收']:.2f}"
+            parts[31] = f"{q['现价'] - q['昨收']:.2f}"
+            parts[32] = f"{q['涨幅']:.2f}"
+            parts[33] = f"{q['最高']:.2f}"
+            parts[34] = f"{q['最低']:.2f}"
+            parts[38] = f"{q['换手率']:.2f}"
+            parts[44] = f"{q['流通市值']:.2f}"
+            lines.append(f"v_{prefix_code}=\"{'~'.join(parts)}\";")
+        return web.Response(text='\n'.join(lines), content_type='text/plain', charset='gbk')
+
+    async def handle_eastmoney_quotes(self, request):
+        error = await self._inject_faults()
+        if error is not None:
+            return error
+        diff = []
+        for secid in request.query.get('secids', '').split(','):
+            if '.' not in secid:
+                continue
+            market, stock_code = secid.split('.', 1)
+            q = self.market.quote(stock_code)
+            diff.append({'f2': q['现价'], 'f3': q['涨幅'], 'f8': q['换手率'], 'f12': stock_code, 'f13': int(market), 'f14': q['名称'], 'f15': q['最高'], 'f16': q['最低'], 'f21': round(q['流通市值'] * 100000000)})
+        return web.json_response({'rc': 0, 'data': {'total': len(diff), 'diff': diff}})
+
+    async def handle_klines(self, request):
+        error = await self._inject_faults()
+        if error is not None:
+            return error
+        secid = request.query.get('secid', '')
+        stock_code = secid.split('.', 1)[-1]
+        limit = int(request.query.get('lmt', 0) or 0)
+        rows = self.market.klines(stock_code) if stock_code.isdigit() else []
+        if limit:
+            rows = rows[-limit:]
+        klines = [f'{date},0,0,0,0,0,0,0,0,0,0,{close:.2f},{change:.2f},0,0' for date, close, change in rows]
+        body = json.dumps({'rc': 0, 'data': {'code': stock_code, 'klines': klines}})
+        callback = request.query.get('cb')
+        if callback:
+            body = f'{callback}({body});'
+        return web.Response(text=body, content_type='application/json')
+
+    def start(self):
+        """在后台线程启动服务器，返回自身"""
+        self._thread = threading.Thread(target=self._thread_main, name='mock-server', daemon=True)
+        self._thread.start()
+        if not self._ready.wait(10):
+            raise RuntimeError('模拟服务器启动超时')
+        return self
+
+    def _thread_main(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._runner = web.AppRunner(self.make_app(), access_log=None)
+        self._loop.run_until_complete(self._runner.setup())
+        site = web.TCPSite(self._runner, self.host, self.port)
+        self._loop.run_until_complete(site.start())
+        if self.port == 0:
+            self.port = site._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self._loop.run_forever()
+        self._loop.run_until_complete(self._runner.cleanup())
+        self._loop.close()
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=10)
+
+def main():
+    parser = argparse.ArgumentParser(description='本地模拟行情服务器')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency', type=float, default=0.03, help='基础延迟（秒）')
+    parser.add_argument('--jitter', type=float, default=0.02, help='随机附加延迟上限（秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回502的概率')
+    parser.add_argument('--slow-rate', type=float, default=0.0, help='慢请求的概率')
+    parser.add_argument('--slow-latency', type=float, default=3.0, help='慢请求的延迟（秒）')
+    parser.add_argument('--max-rps', type=int, default=0, help='每秒最多处理的请求数，0表示不限')
+    args = parser.parse_args()
+    config = MockConfig(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, slow_rate=args.slow_rate, slow_latency=args.slow_latency, max_rps=args.max_rps)
+    server = MockServer(args.host, args.port, config).start()
+    print(f'模拟行情服务器已启动: {server.base_url}')
+    for key, value in server.endpoint_env().items():
+        print(f'  {key}={value}')
+    try:
+        while True:
+            time.sleep(5)
+            print(f'  请求 {server.requests}，错误 {server.errors}，限流 {server.throttled}')
+    except KeyboardInterrupt:
+        server.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+import get_xls_data
+import metrics
+from startup import lazy_module
+asyncio = lazy_module('asyncio')
+aiohttp = lazy_module('aiohttp')
+
+class QuoteSnapshotBuffer:
+    """实时行情快照缓冲区（线程安全）
+
+    后台线程每轮抓取后发布一个新的 {带前缀代码: 行情} 字典，发布后不再修改，
+    读取方拿到的永远是某一轮完整的结果，不需要加锁遍历
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._quotes = {}
+        self._version = 0
+        self._updated_at = None
+        self._first_published = threading.Event()
+
+    def publish(self, updates, subscribed):
+        """合并本轮抓到的行情，只保留仍在订阅中的股票
+        Args:
+            updates: 本轮成功抓到的 {带前缀代码: 行情}
+            subscribed: 当前订阅的带前缀代码列表
+        """
+        with self._lock:
+            old_quotes = self._quotes
+            quotes = {}
+            for prefix_code in subscribed:
+                quote = updates.get(prefix_code)
+                if quote is None:
+                    quote = old_quotes.get(prefix_code)
+                if quote is not None:
+                    quotes[prefix_code] = quote
+            self._quotes = quotes
+            self._version += 1
+            self._updated_at = time.time()
+        self._first_published.set()
+
+    def wait_first(self, timeout=None):
+        """等待第一份快照发布，返回是否已经有快照"""
+        return self._first_published.wait(timeout)
+
+    def latest(self):
+        """Returns:
+            tuple: (版本号, 行情字典, 发布时间戳)
+        """
+        with self._lock:
+            return (self._version, self._quotes, self._updated_at)
+
+TIER_TOP = 'top'
+TIER_HIGH = 'high'
+TIER_NORMAL = 'normal'
+TIER_ORDER = {TIER_TOP: 0, TIER_HIGH: 1, TIER_NORMAL: 2}
+DEFAULT_TIER_INTERVALS = {TIER_TOP: 1.0, TIER_HIGH: 3.0, TIER_NORMAL: 15.0}
+DEFAULT_MAX_REQUESTS_PER_SECOND = 20
+DEFAULT_REQUEST_DEADLINE = 12.0
+
+class RequestBudget:
+    """全局请求预算（令牌桶），每秒补充 rate 个令牌，最多积攒 rate 个
+
+    每个真正发出的HTTP请求（包括拆分重试、逐个补抓和对冲到备用来源的请求）都在发出前 acquire 一个令牌，
+    只在行情引擎自己的事件循环里使用
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._tokens = float(rate)
+        self._last = time.monotonic()
+        self.charged = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(float(self.rate), self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def available(self):
+        """当前可用的整数令牌数（不取出）"""
+        self._refill()
+        return int(self._tokens)
+
+    def take(self, wanted):
+        """尝试取出 wanted 个令牌，返回实际取到的个数"""
+        self._refill()
+        granted = min(wanted, int(self._tokens))
+        self._tokens -= granted
+        self.charged += granted
+        return granted
+
+    async def acquire(self):
+        """取出一个令牌，不够时等到补充出来"""
+        while not self.take(1):
+            await asyncio.sleep(max(0.01, (1 - self._tokens) / max(self.rate, 1)))
+
+class QuoteEngine:
+    """常驻的实时行情引擎
+
+    在独立线程里持有一个事件循环和一个长连接池，按优先级分层轮询订阅的股票并把结果发布到快照缓冲区，
+    避免每次刷新都重新创建事件循环、重新建立TCP/TLS连接。
+    每层有自己的刷新间隔（表格里显示的股票最勤），所有HTTP请求共用一个每秒请求预算，
+    到期的批量请求只按当前剩余的预算发出，发出后的拆分重试和对冲请求同样在发出前扣预算。
+    每轮只发布已经到达的结果（批量请求拆分重试时，先回来的一半会先发布），不会等待慢请求；
+    超过 request_deadline 还没返回的请求会被放弃，相应股票到期后重新请求
+    """
+
+    def __init__(self, tier_intervals=None, max_requests_per_second=DEFAULT_MAX_REQUESTS_PER_SECOND, batch_size=get_xls_data.QUOTE_BATCH_SIZE, concurrency=50, tick_seconds=0.2, request_deadline=DEFAULT_REQUEST_DEADLINE):
+        self.tier_intervals = dict(DEFAULT_TIER_INTERVALS)
+        if tier_intervals:
+            self.tier_intervals.update(tier_intervals)
+        self.max_requests_per_second = max_requests_per_second
+        self.budget = RequestBudget(max_requests_per_second)
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.tick_seconds = tick_seconds
+        self.request_deadline = request_deadline
+        self.buffer = QuoteSnapshotBuffer()
+        self._subscribed = []
+        self._tiers = {}
+        self._subscribe_lock = threading.Lock()
+        self._thread = None
+        self._loop = None
+        self._stop_event = None
+        self._stop_requested = False
+        self._next_due = {}
+        self._in_flight = set()
+        self._arrived = {}
+        self.rounds = 0
+        self.requests_deferred = 0
+        self.requests_abandoned = 0
+        self.last_round_seconds = None
+
+    @property
+    def requests_sent(self):
+        """已经发出的HTTP请求数（按预算扣掉的令牌计）"""
+        return self.budget.charged
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def configure(self, tier_intervals=None, max_requests_per_second=None):
+        """修改各层刷新间隔（秒）和每秒请求预算，运行中也可以调用"""
+        if tier_intervals:
+            self.tier_intervals.update(tier_intervals)
+        if max_requests_per_second:
+            self.max_requests_per_second = max_requests_per_second
+
+    def subscribe(self, prefix_codes, top_priority=None, high_priority=None):
+        """设置要轮询的股票和它们所在的优先级层
+        Args:
+            prefix_codes: 所有带前缀的股票代码
+            top_priority: 最高优先级的带前缀代码（表格显示的股票）
+            high_priority: 高优先级的带前缀代码
+        """
+        ordered = []
+        tiers = {}
+        for tier, group in ((TIER_TOP, top_priority or []), (TIER_HIGH, high_priority or []), (TIER_NORMAL, prefix_codes)):
+            for prefix_code in group:
+                if prefix_code not in tiers:
+                    tiers[prefix_code] = tier
+                    ordered.append(prefix_code)
+        with self._subscribe_lock:
+            self._subscribed = ordered
+            self._tiers = tiers
+
+    def get_subscribed(self):
+        with self._subscribe_lock:
+            return list(self._subscribed)
+
+    def get_tier_counts(self):
+        with self._subscribe_lock:
+            counts = {tier: 0 for tier in TIER_ORDER}
+            for tier in self._tiers.values():
+                counts[tier] += 1
+            return counts
+
+    def snapshot(self):
+        """获取最新的行情快照，不会阻塞等待网络"""
+        return self.buffer.latest()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop_requested = False
+        self._thread = threading.Thread(target=self._thread_main, name='quote-engine', daemon=True)
+        self._thread.start()
+        print('[行情引擎] 已启动')
+
+    def stop(self):
+        if not self.running:
+            return
+        self._stop_requested = True
+        if self._loop is not None and self._stop_event is not None:
+            self._loop.call_soon_threadsafe(self._stop_event.set)
+        self._thread.join(timeout=15)
+        print('[行情引擎] 已停止')
+
+    def _thread_main(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self._poll_forever())
+        except Exception as e:
+            print(f'[行情引擎] 异常退出: {e}')
+        finally:
+            self._loop.close()
+            self._loop = None
+
+    async def _poll_forever(self):
+        self._stop_event = asyncio.Event()
+        self._next_due = {}
+        self._in_flight = set()
+        self._arrived = {}
+        budget = self.budget
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.concurrency, keepalive_timeout=60, ttl_dns_cache=600)
+        timeout = aiohttp.ClientTimeout(total=10, connect=5)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            semaphore = asyncio.Semaphore(self.concurrency)
+            pending = set()
+            while not self._stop_requested and (not self._stop_event.is_set()):
+                round_start = time.time()
+                budget.rate = self.max_requests_per_second
+                pending |= self._schedule_due(session, semaphore, budget)
+                self._abandon_stragglers(pending)
+                done = {task for task in pending if task.done()}
+                pending -= done
+                if done or self._arrived:
+                    self._publish_done(done)
+                    self.rounds += 1
+                    self.last_round_seconds = time.time() - round_start
+                try:
+                    await asyncio.wait_for(self._stop_event.wait(), timeout=self.tick_seconds)
+                except asyncio.TimeoutError:
+                    pass
+            for task in pending:
+                task.cancel()
+
+    def _schedule_due(self, session, semaphore, budget):
+        """挑出到期的股票，按层级和到期时间排序后打包成批量请求，最多发出当前剩余预算个
+        令牌在请求真正发出时才扣（见 RequestBudget.acquire），这里只看剩余多少
+        Returns:
+            set: 新发出的请求任务
+        """
+        with self._subscribe_lock:
+            tiers = self._tiers
+        now = time.monotonic()
+        due = [prefix_code for prefix_code in tiers if prefix_code not in self._in_flight and self._next_due.get(prefix_code, 0) <= now]
+        if not due:
+            return set()
+        due.sort(key=lambda prefix_code: (TIER_ORDER[tiers[prefix_code]], self._next_due.get(prefix_code, 0)))
+        chunks = [due[i:i + self.batch_size] for i in range(0, len(due), self.batch_size)]
+        granted = min(len(chunks), budget.available())
+        self.requests_deferred += len(chunks) - granted
+        tasks = set()
+        for chunk in chunks[:granted]:
+            for prefix_code in chunk:
+                self._in_flight.add(prefix_code)
+                self._next_due[prefix_code] = now + self.tier_intervals[tiers[prefix_code]]
+            task = asyncio.ensure_future(get_xls_data.fetch_stock_chunk_async(session, chunk, semaphore, on_results=self._on_results, budget=budget))
+            task.chunk = chunk
+            task.started = now
+            task.tier = tiers[chunk[0]]
+            tasks.add(task)
+        return tasks
+
+    def _on_results(self, results):
+        """批量请求（或拆分后的某一部分）拿到结果时立即记下，等本轮发布"""
+        for result in results:
+            self._arrived[result['code']] = result['data']
+
+    def _abandon_stragglers(self, pending):
+        """取消超过 request_deadline 还没完成的请求，已经到达的部分结果保留"""
+        now = time.monotonic()
+        for task in pending:
+            if not task.done() and now - task.started > self.request_deadline:
+                task.cancel()
+                self.requests_abandoned += 1
+                metrics.increment('行情引擎放弃请求')
+
+    def _publish_done(self, done):
+        now = time.monotonic()
+        for task in done:
+            self._in_flight.difference_update(task.chunk)
+            metrics.observe(f'行情请求_{task.tier}', now - task.started)
+        updates = self._arrived
+        self._arrived = {}
+        self.buffer.publish(updates, self.get_subscribed())
@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import threading
+import time
+from collections import deque
+import adaptive_limiter
+import metrics
+from startup import lazy_module
+asyncio = lazy_module('asyncio')
+
+def parse_quote_number(text):
+    """行情数值字段转float，空串或非法值记为0"""
+    try:
+        return float(text)
+    except (TypeError, ValueError):
+        return 0.0
+
+class Quote:
+    """单只股票的实时行情
+
+    数值字段在解析时只转换一次float，后面的计算直接用属性；
+    to_dict() 按原来的中文键和两位小数字符串输出，给前端用
+    """
+    __slots__ = ('name', 'price', 'change', 'turnover', 'float_cap', 'high', 'low')
+
+    def __init__(self, name, price, change, turnover, float_cap, high, low):
+        self.name = name
+        self.price = price
+        self.change = change
+        self.turnover = turnover
+        self.float_cap = float_cap
+        self.high = high
+        self.low = low
+
+    def as_tuple(self):
+        return (self.name, self.price, self.change, self.turnover, self.float_cap, self.high, self.low)
+
+    def __eq__(self, other):
+        return isinstance(other, Quote) and self.as_tuple() == other.as_tuple()
+    __hash__ = None
+
+    def __repr__(self):
+        return f'Quote({self.name!r}, 现价={self.price}, 涨幅={self.change})'
+
+    def to_dict(self):
+        return {'现价': f'{self.price:.2f}', '涨幅': f'{self.change:.2f}', '换手率': f'{self.turnover:.2f}', '流通市值': f'{self.float_cap:.2f}', '名称': self.name, '今日最高价': f'{self.high:.2f}', '今日最低价': f'{self.low:.2f}'}
+
+def quotes_to_dict(quotes):
+    """把 {带前缀代码: Quote} 转换为前端使用的 {带前缀代码: {现价, 涨幅, ...}}"""
+    return {prefix_code: quote.to_dict() for prefix_code, quote in quotes.items()}
+
+def parse_quote_fields(prefix_stock, parts):
+    """把腾讯行情按~拆分后的字段转换为实时数据记录 {'code': 带前缀代码, 'data': Quote}"""
+    return {'code': prefix_stock, 'data': Quote(parts[1], parse_quote_number(parts[3]), parse_quote_number(parts[32]), parse_quote_number(parts[38]), parse_quote_number(parts[44]), parse_quote_number(parts[33]), parse_quote_number(parts[34]))}
+
+def parse_quote_response(content):
+    """解析腾讯行情接口的多行返回
+    Args:
+        content: 形如 v_sh600000="1~浦发银行~600000~...";（每个股票一行）的文本
+    Returns:
+        list: [{'code': 'sh600000', 'data': Quote}, ...]，无效行会被跳过
+    """
+    results = []
+    for line in content.split('\n'):
+        line = line.strip().rstrip(';')
+        if not line.startswith('v_') or '=' not in line:
+            continue
+        key, value = line.split('=', 1)
+        prefix_stock = key[2:]
+        parts = value.strip('"').split('~')
+        if len(parts) < 45:
+            continue
+        results.append(parse_quote_fields(prefix_stock, parts))
+    return results
+
+class QuoteSource:
+    """实时行情来源
+
+    子类负责拼接批量请求的地址，并把返回内容解析成统一的 {'code': 带前缀代码, 'data': Quote} 记录
+    """
+    name = ''
+
+    def build_url(self, prefix_codes):
+        raise NotImplementedError
+
+    def parse(self, content):
+        raise NotImplementedError
+
+class TencentQuoteSource(QuoteSource):
+    """腾讯行情 qt.gtimg.cn，一个请求可以带多个逗号分隔的代码"""
+    name = '腾讯'
+    base_url = os.environ.get('THREE_SUN_TENCENT_URL', 'https://qt.gtimg.cn/q=')
+
+    def build_url(self, prefix_codes):
+        return self.base_url + ','.join(prefix_codes)
+
+    def parse(self, content):
+        return parse_quote_response(content)
+
+class EastmoneyQuoteSource(QuoteSource):
+    """东方财富 push2 批量行情接口
+    f2现价 f3涨幅 f8换手率 f12代码 f13市场(1沪/0深) f14名称 f15最高 f16最低 f21流通市值(元，换算成亿元与腾讯一致)
+    """
+    name = '东方财富'
+    base_url = os.environ.get('THREE_SUN_EASTMONEY_URL', 'https://push2.eastmoney.com/api/qt/ulist.np/get')
+    fields = 'f2,f3,f8,f12,f13,f14,f15,f16,f21'
+
+    def build_url(self, prefix_codes):
+        secids = ','.join((('1.' if prefix_code.startswith('sh') else '0.') + prefix_code[2:] for prefix_code in prefix_codes))
+        return f'{self.base_url}?fltt=2&invt=2&fields={self.fields}&secids={secids}'
+
+    def parse(self, content):
+        start = content.find('(')
+        end = content.rfind(')')
+        if start != -1 and end != -1:
+            content = content[start + 1:end]
+        data = json.loads(content)
+        if data.get('rc') != 0 or not data.get('data'):
+            return []
+        rows = data['data'].get('diff') or []
+        if isinstance(rows, dict):
+            rows = list(rows.values())
+        results = []
+        for row in rows:
+            stock_code = str(row.get('f12', ''))
+            if not stock_code:
+                continue
+            prefix_code = ('sh' if row.get('f13') == 1 else 'sz') + stock_code
+            quote = Quote(row.get('f14', ''), parse_quote_number(row.get('f2')), parse_quote_number(row.get('f3')), parse_quote_number(row.get('f8')), parse_quote_number(row.get('f21')) / 100000000, parse_quote_number(row.get('f15')), parse_quote_number(row.get('f16')))
+            results.append({'code': prefix_code, 'data': quote})
+        return results
+
+class QuoteSourceStats:
+    """单个行情来源的延迟样本和错误率"""
+
+    def __init__(self, sample_size=200):
+        self.latencies = deque(maxlen=sample_size)
+        self.error_rate = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.degraded_until = 0.0
+
+    def record(self, ok, latency):
+        self.requests += 1
+        self.error_rate = self.error_rate * 0.9 + (0.0 if ok else 0.1)
+        if ok:
+            self.latencies.append(latency)
+        else:
+            self.failures += 1
+
+    def percentile(self, q):
+        """延迟的q分位数（秒），样本不足20个时返回None"""
+        if len(self.latencies) < 20:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+class QuoteRouter:
+    """在多个行情来源之间对冲和故障切换
+
+    请求先发给当前首选来源；超过它p95延迟还没返回（或者直接失败）时，再向备用来源发同样的请求，先成功的为准，另一个取消。
+    某个来源的错误率超过 failover_error_rate 时降级 failover_cooldown 秒，期间备用来源变为首选
+    """
+
+    def __init__(self, sources, hedge_min_delay=0.3, hedge_default_delay=1.0, failover_error_rate=0.5, failover_cooldown=60.0):
+        self.sources = list(sources)
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_default_delay = hedge_default_delay
+        self.failover_error_rate = failover_error_rate
+        self.failover_cooldown = failover_cooldown
+        self.stats = {source.name: QuoteSourceStats() for source in self.sources}
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+        self._lock = threading.Lock()
+
+    def ordered_sources(self):
+        """健康的来源在前，按配置顺序；全部降级时保持配置顺序"""
+        now = time.monotonic()
+        healthy = [source for source in self.sources if self.stats[source.name].degraded_until <= now]
+        return healthy + [source for source in self.sources if source not in healthy]
+
+    def hedge_delay(self, source):
+        p95 = self.stats[source.name].percentile(0.95)
+        if p95 is None:
+            return self.hedge_default_delay
+        return max(self.hedge_min_delay, p95)
+
+    def _record(self, source, ok, latency):
+        with self._lock:
+            stats = self.stats[source.name]
+            stats.record(ok, latency)
+            if not ok and stats.requests >= 10 and stats.error_rate > self.failover_error_rate and stats.degraded_until <= time.monotonic():
+                stats.degraded_until = time.monotonic() + self.failover_cooldown
+                self.failovers += 1
+                metrics.increment('行情源切换')
+                print(f'[行情源] {source.name} 错误率 {stats.error_rate:.0%}，切换到备用来源 {self.failover_cooldown:.0f} 秒')
+
+    async def _fetch_from(self, source, session, prefix_codes, budget=None):
+        """向一个来源发出请求；响应正常但解析不出行情（代码不存在、已退市）时返回空列表，不算来源出错"""
+        if budget is not None:
+            await budget.acquire()
+        start = time.monotonic()
+        try:
+            content = await adaptive_limiter.fetch_text(session, source.build_url(prefix_codes))
+            results = source.parse(content)
+        except asyncio.CancelledError:
+            raise
+        except adaptive_limiter.CircuitOpenError:
+            raise
+        except Exception:
+            self._record(source, False, time.monotonic() - start)
+            raise
+        self._record(source, True, time.monotonic() - start)
+        return results
+
+    async def fetch(self, session, prefix_codes, budget=None):
+        """获取一批股票的行情，必要时对冲到备用来源
+        Args:
+            budget: 请求预算（有 async acquire() 的对象），每个发出的请求（包括对冲请求）扣一个，None表示不限
+        Returns:
+            list: [{'code': 带前缀代码, 'data': Quote}, ...]，这些代码都没有行情时为空列表
+        Raises:
+            Exception: 所有来源都失败（网络或HTTP错误、返回内容无法解析）时抛出最后一个异常
+        """
+        sources = self.ordered_sources()
+        primary = asyncio.ensure_future(self._fetch_from(sources[0], session, prefix_codes, budget))
+        if len(sources) == 1:
+            return await primary
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_delay(sources[0]))
+            if primary in done and primary.exception() is None:
+                return primary.result()
+            if primary in done:
+                tasks = set()
+            alternate = asyncio.ensure_future(self._fetch_from(sources[1], session, prefix_codes, budget))
+            alternate.hedge = True
+            tasks.add(alternate)
+            self.hedged += 1
+            metrics.increment('行情对冲请求')
+            error = primary.exception() if primary in done else None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if getattr(task, 'hedge', False):
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def status(self):
+        now = time.monotonic()
+        sources = {}
+        for source in self.sources:
+            stats = self.stats[source.name]
+            p95 = stats.percentile(0.95)
+            sources[source.name] = {'请求数': stats.requests, '失败数': stats.failures, '错误率': round(stats.error_rate, 3), 'p95延迟': round(p95, 3) if p95 is not None else None, '已降级': stats.degraded_until > now}
+        return {'首选来源': self.ordered_sources()[0].name, '对冲次数': self.hedged, '对冲胜出': self.hedge_wins, '故障切换次数': self.failovers, '来源': sources}
+
+default_router = QuoteRouter([TencentQuoteSource(), EastmoneyQuoteSource()])
+
+async def fetch_quotes(session, prefix_codes, budget=None):
+    """通过默认的行情路由获取一批股票的行情"""
+    return await default_router.fetch(session, prefix_codes, budget)
+
+def get_status():
+    return default_router.status()
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""启动加速：延迟导入、启动耗时打点和后台预热
+
+openpyxl、requests、tenacity、aiohttp、numpy 等模块导入要几百毫秒，窗口出来之前用不到，
+用 lazy_module 换成第一次访问属性时才真正导入的占位对象；
+行业表、股票数据xlsx和历史数据仓库放到后台预热线程里读，状态通过 WarmUp.status() 报告给页面。
+设置环境变量 THREE_SUN_EAGER_STARTUP=1 可以恢复原来的启动方式（导入时全部加载、预热同步执行），用于对比启动耗时。
+"""
+import functools
+import importlib
+import os
+import sys
+import threading
+import time
+
+EAGER_STARTUP = os.environ.get('THREE_SUN_EAGER_STARTUP') == '1'
+_process_start = time.perf_counter()
+_marks = []
+
+class _LazyModule:
+    """模块的占位对象，第一次访问属性时才导入真正的模块（加锁，多个线程同时访问也只导入一次）"""
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            with _import_lock:
+                module = self.__dict__['_module']
+                if module is None:
+                    module = importlib.import_module(self.__dict__['_name'])
+                    self.__dict__['_module'] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        return f"<延迟导入的模块 {self.__dict__['_name']}>"
+
+_import_lock = threading.RLock()
+
+def lazy_module(name):
+    """返回延迟导入的模块：第一次访问属性时才导入，已经导入过的直接返回模块本身"""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    if EAGER_STARTUP:
+        return importlib.import_module(name)
+    return _LazyModule(name)
+
+def preload(*modules):
+    """真正导入若干个延迟导入的模块（预热时调用，避免第一次用到时卡住）"""
+    for module in modules:
+        if isinstance(module, _LazyModule):
+            module._load()
+
+def lazy_retry(attempts, wait_min, wait_max):
+    """等同于 tenacity 的 @retry(stop=stop_after_attempt(attempts), wait=wait_random(wait_min, wait_max))，
+    第一次调用被装饰的函数时才导入tenacity"""
+
+    def decorator(func):
+        wrapped = []
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not wrapped:
+                from tenacity import retry, stop_after_attempt, wait_random
+                wrapped.append(retry(stop=stop_after_attempt(attempts), wait=wait_random(wait_min, wait_max))(func))
+            return wrapped[0](*args, **kwargs)
+        return wrapper
+    return decorator
+
+def mark(stage):
+    """记录一个启动阶段，时间从本模块被导入（进程启动后最早的导入）开始算"""
+    elapsed = time.perf_counter() - _process_start
+    _marks.append((stage, elapsed))
+    print(f'[启动] {stage}: {elapsed * 1000:.0f} 毫秒')
+    return elapsed
+
+def startup_timings():
+    """Returns:
+        dict: {阶段: 距启动的毫秒数}
+    """
+    return {stage: round(elapsed * 1000, 1) for stage, elapsed in _marks}
+
+class WarmUp:
+    """后台预热任务：按顺序执行 (名称, 函数) 列表，记录每一项的状态和耗时
+    单项失败只记录错误，不影响后面的项；on_progress(status) 在每一项开始和结束时调用
+    """
+
+    def __init__(self, tasks, on_progress=None):
+        self.tasks = list(tasks)
+        self.on_progress = on_progress
+        self.states = {name: '等待' for name, _ in self.tasks}
+        self.seconds = {}
+        self.errors = {}
+        self.current = ''
+        self.done = threading.Event()
+        self._thread = None
+
+    def start(self, background=True):
+        """开始预热，background=False 时在当前线程执行完才返回"""
+        if background:
+            self._thread = threading.Thread(target=self.run, name='warm-up', daemon=True)
+            self._thread.start()
+        else:
+            self.run()
+        return self
+
+    def run(self):
+        for name, func in self.tasks:
+            self.current = name
+            self.states[name] = '进行中'
+            self._notify()
+            start = time.perf_counter()
+            try:
+                func()
+                self.states[name] = '完成'
+            except Exception as e:
+                self.states[name] = '失败'
+                self.errors[name] = str(e)
+                print(f'预热 {name} 失败: {e}')
+            self.seconds[name] = time.perf_counter() - start
+        self.current = ''
+        mark('预热完成')
+        self.done.set()
+        self._notify()
+
+    def wait(self, timeout=None):
+        return self.done.wait(timeout)
+
+    def status(self):
+        """Returns:
+            dict: {'就绪', '当前', '已完成', '总数', '各项': {名称: 状态}, '耗时毫秒': {名称: 毫秒}, '错误': {名称: 信息}}
+        """
+        finished = sum((1 for state in self.states.values() if state in ('完成', '失败')))
+        return {'就绪': self.done.is_set(), '当前': self.current, '已完成': finished, '总数': len(self.tasks), '各项': dict(self.states), '耗时毫秒': {name: round(seconds * 1000, 1) for name, seconds in self.seconds.items()}, '错误': dict(self.errors)}
+
+    def _notify(self):
+        if self.on_progress:
+            try:
+                self.on_progress(self.status())
+            except Exception:
+                pass
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""合并结果的列式查询
+
+把 merge_all_data 的结果按页面表格的股票范围（概念数据里出现过的股票，按日期顺序去重）转换成列向量，
+筛选条件用布尔掩码组合，区间条件通过每列的排序索引二分查找，排序直接沿排序索引取满足条件的行。
+筛选条件的格式和页面 fillStockTable 里的 currentFilterConditions 一样（复选框 + 输入框的字符串值），
+页面可以把它原样传过来，只拿回符合条件、排好序的几十行数据。
+"""
+import numpy as np
+
+BOARD_MAIN = '主板'
+BOARD_CHINEXT = '创业板'
+BOARD_STAR = '科创板'
+STANDARD_STRICT = '严格'
+STANDARD_LOOSE = '宽松'
+# 页面的默认规则：3开头和68开头用严格版（19.8%），其他用宽松版（9.8%）
+DEFAULT_BOARD_STANDARD = {BOARD_MAIN: STANDARD_LOOSE, BOARD_CHINEXT: STANDARD_STRICT, BOARD_STAR: STANDARD_STRICT}
+# 区分严格版/宽松版的涨停字段，查询时按板块取其中一个，列名不带后缀
+BOARD_FIELDS = ('离涨停多少天', '连续涨停数', '全部涨停天数', '总涨停数_天数', '涨停数', '单日涨停数', '总涨停数')
+# 来自盘中突破跟踪的字段：合并结果里没有，页面之前一直按0处理
+TRACKER_FIELDS = {'今天创新高次数': 'new_high_count', '今天创新低次数': 'new_low_count', '曾经最高涨幅': 'max_change', '30日新高次数': 'break_30d_count', '已突破60日新高': 'above_60d'}
+TEXT_COLUMNS = ('代码', '名称', '行业', '概念')
+
+def get_board(stock_code):
+    if stock_code.startswith('68'):
+        return BOARD_STAR
+    if stock_code.startswith('3'):
+        return BOARD_CHINEXT
+    return BOARD_MAIN
+
+def _to_float(value):
+    """数字和数字字符串转为float，其他（''、'-'、'无涨停'）为NaN"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+def _js_int(value, default):
+    """与页面的 parseInt(value) || default 一致（0也会变成默认值）"""
+    try:
+        result = int(float(value))
+    except (TypeError, ValueError):
+        return default
+    return result or default
+
+def _js_float(value, default):
+    """与页面的 parseFloat(value) || default 一致"""
+    try:
+        result = float(value)
+    except (TypeError, ValueError):
+        return default
+    return result if result and result == result else default
+
+def _column_key(name, board_standard):
+    if name not in BOARD_FIELDS:
+        return name
+    return (name, tuple(sorted((board_standard or DEFAULT_BOARD_STANDARD).items())))
+
+class StockTable:
+    """一版合并结果的列式视图
+
+    列向量在第一次用到时才从行数据里转换，排序索引也是第一次按该列筛选或排序时才建立，
+    之后同一版数据的查询都复用
+    """
+
+    def __init__(self, merged_data, concept_data, tracker_columns=None):
+        """tracker_columns 是快照里盘中突破跟踪状态的副本（BreakthroughTracker.columns），None时这几列按0处理"""
+        self.codes = []
+        self.concepts = []
+        self.rows = []
+        seen = set()
+        for stocks_list in concept_data.values():
+            for stock_data in stocks_list:
+                stock_code = stock_data[0]
+                if stock_code in seen:
+                    continue
+                seen.add(stock_code)
+                merged = merged_data.get(stock_code)
+                if not merged:
+                    continue
+                self.codes.append(stock_code)
+                self.concepts.append(stock_data[3] if len(stock_data) > 3 else '')
+                self.rows.append(merged)
+        self.boards = np.array([get_board(stock_code) for stock_code in self.codes], dtype=object)
+        self.tracker_columns = {column: np.zeros(len(self.codes)) for column in TRACKER_FIELDS}
+        if tracker_columns is not None:
+            index = tracker_columns['index']
+            slots = np.array([index.get(stock_code, -1) for stock_code in self.codes], dtype=np.int64)
+            tracked = slots >= 0
+            if index:
+                tracked &= tracker_columns['initialized'][np.maximum(slots, 0)]
+            if tracked.any():
+                for column, attribute in TRACKER_FIELDS.items():
+                    self.tracker_columns[column][tracked] = tracker_columns[attribute][slots[tracked]]
+        self._columns = {}
+        self._sorted = {}
+
+    def __len__(self):
+        return len(self.codes)
+
+    def column(self, name, board_standard=None):
+        """数值列（不能转换为数字的为NaN）；BOARD_FIELDS 里的列按 board_standard 逐个板块取严格版或宽松版"""
+        key = _column_key(name, board_standard)
+        values = self._columns.get(key)
+        if values is None:
+            if name in BOARD_FIELDS:
+                standard = board_standard or DEFAULT_BOARD_STANDARD
+                use_strict = np.array([standard.get(board, STANDARD_LOOSE) == STANDARD_STRICT for board in self.boards], dtype=bool)
+                values = np.where(use_strict, self.column(name + '_严格'), self.column(name + '_宽松'))
+            elif name in self.tracker_columns:
+                values = self.tracker_columns[name]
+            else:
+                values = np.array([_to_float(row.get(name)) for row in self.rows], dtype=float)
+            self._columns[key] = values
+        return values
+
+    def text_column(self, name):
+        if name == '代码':
+            return self.codes
+        if name == '概念':
+            return self.concepts
+        return [str(row.get(name) or '') for row in self.rows]
+
+    def sorted_index(self, name, board_standard=None):
+        """(按该列升序排列的行号, 排好序的值)，NaN排在最后"""
+        key = _column_key(name, board_standard)
+        cached = self._sorted.get(key)
+        if cached is None:
+            values = self.column(name, board_standard)
+            order = np.argsort(values, kind='stable')
+            cached = (order, values[order])
+            self._sorted[key] = cached
+        return cached
+
+    def range_mask(self, name, low=-np.inf, high=np.inf, board_standard=None):
+        """low <= 值 <= high 的行，用排序索引二分查找，不逐行比较"""
+        order, ordered = self.sorted_index(name, board_standard)
+        start = np.searchsorted(ordered, low, side='left')
+        end = np.searchsorted(ordered, high, side='right')
+        mask = np.zeros(len(self.codes), dtype=bool)
+        mask[order[start:end]] = True
+        return mask
+
+    def build_mask(self, filters):
+        """按页面 fillStockTable 的规则把筛选条件组合成布尔掩码
+        Args:
+            filters: 与页面 currentFilterConditions 相同的字典，另外可以带 boardStandard: {板块: '严格'/'宽松'}
+        """
+        standard = dict(DEFAULT_BOARD_STANDARD)
+        standard.update(filters.get('boardStandard') or {})
+        days = self.column('离涨停多少天', standard)
+        consecutive = self.column('连续涨停数', standard)
+        has_limit = ~np.isnan(days)
+        price = self.column('现价')
+        change = self.column('涨幅')
+        with np.errstate(invalid='ignore'):
+            mask = self.range_mask('离涨停多少天', _js_int(filters.get('preview'), 3), _js_int(filters.get('back'), 21), standard)
+            if filters.get('sunDayCheck'):
+                sun_day = _js_int(filters.get('sunDay'), 0)
+                mask &= self.range_mask('阳天数', sun_day, sun_day)
+                if sun_day > 0:
+                    mask &= change > 0
+            if filters.get('upCheck'):
+                mask &= self.range_mask('涨幅', _js_float(filters.get('upTo'), 0))
+            if filters.get('todayHighCheck'):
+                today_high = self.column('今日最高价')
+                mask &= ~np.isnan(today_high) & ~(price < today_high)
+            if filters.get('highCountCheck'):
+                mask &= self.range_mask('今天创新高次数', _js_int(filters.get('highCount'), 0))
+            if filters.get('lowCheck'):
+                today_low = self.column('今日最低价')
+                mask &= ~np.isnan(today_low) & ~(price > today_low)
+            if filters.get('lowCountCheck'):
+                mask &= self.range_mask('今天创新低次数', _js_int(filters.get('lowCount'), 0))
+            if filters.get('everUpCheck'):
+                mask &= self.range_mask('曾经最高涨幅', _js_float(filters.get('everUp'), 0))
+            if filters.get('break30Check'):
+                max_30d = self.column('30日最高价')
+                ratio = np.where(max_30d > 0, np.nan_to_num(price) / np.where(max_30d > 0, max_30d, 1) * 100, np.inf)
+                mask &= ratio >= _js_float(filters.get('break30'), 100)
+            if filters.get('break30CountCheck'):
+                mask &= self.range_mask('30日新高次数', _js_int(filters.get('break30Count'), 0))
+            if filters.get('break60Check'):
+                mask &= self.range_mask('已突破60日新高', 1)
+            if filters.get('limitUpGte2Check'):
+                value = _js_int(filters.get('limitUpGte2'), 2)
+                if value != 1:
+                    mask &= np.nan_to_num(consecutive) >= value
+            if filters.get('limitUp2Check'):
+                # 与页面一致：输入1用严格版（300/688需19.8%），输入2及以上用宽松版（统一9.8%）
+                value = _js_int(filters.get('limitUp2'), 2)
+                mask &= self.range_mask('连续涨停数_严格' if value == 1 else '连续涨停数_宽松', value, value)
+            if filters.get('totalLimitUpCheck'):
+                value = _js_int(filters.get('totalLimitUp'), 1)
+                single_day = (np.nan_to_num(consecutive) == 0) & has_limit
+                all_limit_days = np.nan_to_num(self.column('全部涨停天数', standard))
+                total_days = np.nan_to_num(self.column('总涨停数_天数', standard))
+                mask &= np.where(single_day, np.maximum(0, all_limit_days - 1), total_days) == value
+            if filters.get('yesterdayNegativeCheck'):
+                mask &= np.nan_to_num(self.column('昨日涨幅')) < 0
+            if filters.get('prevDaysPositiveCheck'):
+                mask &= self.range_mask('前N天阳天数', _js_int(filters.get('prevDaysPositive'), 3))
+        return mask
+
+    def ordered_rows(self, mask, sort=None, board_standard=None):
+        """满足掩码的行号，sort 为页面的 currentSort {column, direction}，没有排序时保持概念数据里的顺序"""
+        column = (sort or {}).get('column')
+        direction = (sort or {}).get('direction')
+        if not column or not direction:
+            return np.flatnonzero(mask)
+        if column in TEXT_COLUMNS:
+            texts = self.text_column(column)
+            rows = sorted(np.flatnonzero(mask).tolist(), key=lambda i: texts[i], reverse=direction != 'asc')
+            return np.array(rows, dtype=np.int64)
+        order, ordered = self.sorted_index(column, board_standard)
+        numeric = ~np.isnan(ordered)
+        # 和页面一样，数字按大小排，不是数字的排在后面；页面的排序是稳定的，相同的值保持概念数据里的顺序
+        selected = order[numeric][mask[order[numeric]]]
+        if direction != 'asc':
+            selected = selected[np.argsort(-self.column(column, board_standard)[selected], kind='stable')]
+        return np.concatenate([selected, order[~numeric][mask[order[~numeric]]]])
+
+    def row(self, i):
+        """返回给页面的行：合并结果 + 概念 + 盘中突破跟踪的字段（不修改原来的行）"""
+        result = dict(self.rows[i])
+        result['概念'] = self.concepts[i]
+        for column, values in self.tracker_columns.items():
+            value = values[i]
+            result[column] = bool(value) if column == '已突破60日新高' else round(float(value), 2) if column == '曾经最高涨幅' else int(value)
+        return result
+
+    def query(self, filters=None, sort=None, limit=100):
+        """Returns:
+            dict: {'总数': 满足条件的股票数, '股票': [行, ...]}，最多 limit 行
+        """
+        filters = filters or {}
+        mask = self.build_mask(filters)
+        standard = dict(DEFAULT_BOARD_STANDARD)
+        standard.update(filters.get('boardStandard') or {})
+        selected = self.ordered_rows(mask, sort, standard)
+        if limit:
+            selected = selected[:limit]
+        return {'总数': int(mask.sum()), '股票': [self.row(i) for i in selected.tolist()]}
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""自适应并发限制和熔断器的检查
+
+运行: python -m pytest -q test_adaptive_limiter.py
+"""
+import asyncio
+import time
+import pytest
+from adaptive_limiter import BREAKER_CLOSED, BREAKER_HALF_OPEN, BREAKER_OPEN, AdaptiveLimiter, CircuitOpenError
+
+def _fail(limiter, times):
+    for _ in range(times):
+        asyncio.run(limiter.acquire())
+        limiter.release(False, 0.01)
+
+def test_breaker_opens_after_consecutive_failures():
+    limiter = AdaptiveLimiter('test.local', initial=4, breaker_failures=3, breaker_cooldown=60)
+    _fail(limiter, 2)
+    assert limiter.state == BREAKER_CLOSED
+    _fail(limiter, 1)
+    assert limiter.state == BREAKER_OPEN
+    assert limiter.trip_count == 1
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(limiter.acquire())
+    # 截止时间在冷却结束之前，同样不等待
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(limiter.acquire(deadline=time.monotonic() + 1))
+
+def test_success_resets_consecutive_failures():
+    limiter = AdaptiveLimiter('test.local', initial=4, breaker_failures=3)
+    _fail(limiter, 2)
+    asyncio.run(limiter.acquire())
+    limiter.release(True, 0.01)
+    _fail(limiter, 2)
+    assert limiter.state == BREAKER_CLOSED
+
+def test_half_open_admits_one_probe():
+    limiter = AdaptiveLimiter('test.local', initial=8, minimum=2, breaker_failures=2, breaker_cooldown=0.05)
+    _fail(limiter, 2)
+    time.sleep(0.06)
+    assert limiter._try_acquire(time.monotonic()) == 0
+    assert limiter.state == BREAKER_HALF_OPEN
+    # 试探请求还没回来时，其他请求不放行
+    assert limiter._try_acquire(time.monotonic()) < 0
+    limiter.release(False, 0.01)
+    assert limiter.state == BREAKER_OPEN
+    assert limiter.trip_count == 2
+    time.sleep(0.06)
+    asyncio.run(limiter.acquire(deadline=time.monotonic() + 1))
+    limiter.release(True, 0.01)
+    assert limiter.state == BREAKER_CLOSED
+    assert int(limiter.limit) == 2
+
+def test_cancelled_probe_frees_the_slot():
+    limiter = AdaptiveLimiter('test.local', breaker_failures=1, breaker_cooldown=0.01)
+    _fail(limiter, 1)
+    time.sleep(0.02)
+    asyncio.run(limiter.acquire())
+    limiter.release(None, 0)
+    assert limiter.state == BREAKER_HALF_OPEN
+    assert limiter._try_acquire(time.monotonic()) == 0
+
+def test_limit_grows_additively_and_halves_once_per_interval():
+    limiter = AdaptiveLimiter('test.local', initial=10, maximum=20, decrease_interval=60, breaker_failures=100)
+    for _ in range(30):
+        asyncio.run(limiter.acquire())
+        limiter.release(True, 0.01)
+    assert 12 <= int(limiter.limit) <= 13
+    grown = limiter.limit
+    _fail(limiter, 3)
+    assert limiter.limit == pytest.approx(grown * 0.5)
+    # 慢请求同样减小上限，但同一个间隔内已经减过
+    asyncio.run(limiter.acquire())
+    limiter.release(True, 10.0)
+    assert limiter.limit == pytest.approx(grown * 0.5)
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""批量实时行情抓取的检查（不联网，用假的 session 返回腾讯行情格式）
+
+运行: python -m pytest -q test_get_xls_data.py
+"""
+import asyncio
+import time
+import get_xls_data
+import quote_engine
+import quote_sources
+
+def _tencent_line(prefix_code):
+    parts = ['1'] + ['0'] * 49
+    parts[1] = '股票' + prefix_code[2:]
+    parts[3] = '10.50'
+    parts[32] = '1.25'
+    return f'v_{prefix_code}="' + '~'.join(parts) + '";'
+
+class _Response:
+
+    def __init__(self, text, status=200):
+        self._text = text
+        self.status = status
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise RuntimeError(f'HTTP {self.status}')
+
+    async def text(self):
+        return self._text
+
+class _FakeTencentSession:
+    """按 q= 后面的代码返回行情，unknown 里的代码返回 v_pv_none_match，超过 max_codes 个代码的请求返回502"""
+
+    def __init__(self, unknown=(), max_codes=None):
+        self.unknown = set(unknown)
+        self.max_codes = max_codes
+        self.requests = []
+
+    def get(self, url, timeout=None):
+        prefix_codes = url.split('q=', 1)[1].split(',')
+        self.requests.append(prefix_codes)
+        if self.max_codes is not None and len(prefix_codes) > self.max_codes:
+            return _Response('', 502)
+        lines = ['v_pv_none_match="1";' if prefix_code in self.unknown else _tencent_line(prefix_code) for prefix_code in prefix_codes]
+        return _Response('\n'.join(lines))
+
+def test_batch_with_unknown_code_does_not_retry(monkeypatch):
+    router = quote_sources.QuoteRouter([quote_sources.TencentQuoteSource()])
+    monkeypatch.setattr(quote_sources, 'default_router', router)
+    codes = [f'sh6000{i:02d}' for i in range(20)]
+    session = _FakeTencentSession(['sh600007'])
+    start = time.monotonic()
+    results = asyncio.run(get_xls_data.fetch_stocks_batch_async(codes, session=session))
+    assert time.monotonic() - start < 1.0
+    assert sorted(result['code'] for result in results) == [code for code in codes if code != 'sh600007']
+    # 一次批量请求，加上对缺少的代码补抓一次，不再重试
+    assert session.requests == [codes, ['sh600007']]
+    assert router.stats['腾讯'].failures == 0
+
+def test_split_retries_are_charged_to_the_budget(monkeypatch):
+    router = quote_sources.QuoteRouter([quote_sources.TencentQuoteSource()])
+    monkeypatch.setattr(quote_sources, 'default_router', router)
+    codes = [f'sz0000{i:02d}' for i in range(40)]
+    session = _FakeTencentSession(max_codes=10)
+    budget = quote_engine.RequestBudget(1000)
+
+    async def fetch():
+        return await get_xls_data.fetch_stock_chunk_async(session, codes, asyncio.Semaphore(10), budget=budget)
+    results = asyncio.run(fetch())
+    assert len(results) == len(codes)
+    # 40 -> 20+20 -> 4个10，一共7个请求，每个都扣了预算
+    assert len(session.requests) == 7
+    assert budget.charged == len(session.requests)
+
+def test_request_budget_waits_for_tokens():
+    budget = quote_engine.RequestBudget(20)
+    assert budget.take(25) == 20
+    start = time.monotonic()
+    asyncio.run(budget.acquire())
+    assert time.monotonic() - start >= 0.03
+    assert budget.charged == 21
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""二进制历史文件的写入和读取检查
+
+运行: python -m pytest -q test_history_file.py
+"""
+import os
+import pytest
+from history_file import HistoryFile, read_history_header, write_history_file
+
+def _stocks():
+    """三只股票：完整K线、中间停牌两天、只有最近两天"""
+    dates = [f'2025-10-{day:02d}' for day in (13, 14, 15, 16, 17, 20)]
+    full = [{'日期': date_str, '收盘价': 10.0 + i * 0.11, '涨幅': 1.1 * (i % 3 - 1)} for i, date_str in enumerate(dates)]
+    suspended = [{'日期': date_str, '收盘价': 20.5 - i, '涨幅': -4.88} for i, date_str in enumerate(dates) if date_str not in ('2025-10-15', '2025-10-16')]
+    recent = [{'日期': date_str, '收盘价': 5.0, '涨幅': 10.0} for date_str in dates[-2:]]
+    return ({'600000': full, '300750': suspended, '688981': recent}, dates)
+
+def test_history_file_round_trip(tmp_path):
+    stocks, dates = _stocks()
+    file_path = str(tmp_path / '历史数据.bin')
+    write_history_file(file_path, stocks, '2025-10-20')
+    assert not os.path.exists(file_path + '.tmp')
+    assert read_history_header(file_path) == {'同步日期': '2025-10-20', '最新日期': '2025-10-20', '股票数': 3, '天数': len(dates)}
+    with HistoryFile(file_path) as hf:
+        assert hf.codes == list(stocks)
+        assert hf.dates == dates
+        assert hf.sync_date == '2025-10-20'
+        assert '300750' in hf and '000001' not in hf
+        assert hf.prices('000001') is None
+        for stock_code, prices in stocks.items():
+            assert hf.prices(stock_code) == prices, stock_code
+
+def test_history_file_rewrite_replaces_contents(tmp_path):
+    stocks, dates = _stocks()
+    file_path = str(tmp_path / '历史数据.bin')
+    write_history_file(file_path, stocks)
+    assert read_history_header(file_path)['同步日期'] == ''
+    write_history_file(file_path, {'600000': stocks['600000'][:3]}, '2025-10-15')
+    with HistoryFile(file_path) as hf:
+        assert hf.codes == ['600000']
+        assert hf.latest_date == '2025-10-15'
+        assert hf.prices('600000') == stocks['600000'][:3]
+
+def test_unrecognized_files_are_rejected(tmp_path):
+    other = tmp_path / 'other.bin'
+    other.write_bytes(b'\x00' * 64)
+    empty = tmp_path / 'empty.bin'
+    empty.write_bytes(b'')
+    assert read_history_header(str(other)) is None
+    assert read_history_header(str(tmp_path / 'missing.bin')) is None
+    with pytest.raises(ValueError):
+        HistoryFile(str(other))
+    with pytest.raises(ValueError):
+        HistoryFile(str(empty))
+
+def test_truncated_history_file_is_rejected(tmp_path):
+    stocks, dates = _stocks()
+    file_path = tmp_path / '历史数据.bin'
+    write_history_file(str(file_path), stocks, '2025-10-20')
+    file_path.write_bytes(file_path.read_bytes()[:-8])
+    with pytest.raises(ValueError):
+        HistoryFile(str(file_path))
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""历史K线矩阵的向量化统计和逐只股票循环的参考实现对比
+
+运行: python -m pytest -q test_history_matrix.py
+"""
+import math
+from history_matrix import HistoryMatrix, compute_limit_up_stats, compute_trend_stats, date_to_int, get_limit_threshold
+
+DATES = [f'2025-10-{day:02d}' for day in range(1, 21)]
+
+def _price_list(changes, dates=DATES, start=10.0):
+    """按涨幅序列生成 历史价格列表，日期取 dates 的最后 len(changes) 个"""
+    prices = []
+    close = start
+    for date_str, change in zip(dates[-len(changes):], changes):
+        close = round(close * (1 + change / 100), 2)
+        prices.append({'日期': date_str, '收盘价': close, '涨幅': change})
+    return prices
+
+def _fixture():
+    """几只涨跌形态固定的股票：连板、单日涨停、创业板阈值、停牌缺口、K线不足"""
+    stocks = {
+        '600001': _price_list([1.0, 10.0, 10.0, 10.0, -2.0, 10.0, 1.0, 2.0, 3.0, -1.0, 10.0, 10.0, 0.5, 0.8, 1.2]),
+        '000002': _price_list([10.0, -1.0, 10.0, 2.0, 3.0, 4.0, 5.0, -3.0, 6.0, 7.0]),
+        '300003': _price_list([10.5, 10.5, 20.0, 20.0, 19.9, -5.0, 20.0, 1.0, 1.0, 1.0, 1.0, 2.0]),
+        '688004': _price_list([1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0, 8.0]),
+        '600005': _price_list([10.0, 10.0], DATES[:2]) + _price_list([10.0, 2.0, 3.0, 10.0, 10.0], DATES[10:], start=13.0),
+        '000006': _price_list([5.0, 10.0]),
+        '000007': _price_list([]),
+    }
+    return {stock_code: {'历史价格列表': prices, '昨日收盘价': prices[-2]['收盘价'] if len(prices) >= 2 else 0} for stock_code, prices in stocks.items()}
+
+def _reference_limit_up(stock_code, price_list, loose):
+    """逐只股票循环的参考实现（按 历史价格列表 的索引判断连续）"""
+    threshold = 9.8 if loose else get_limit_threshold(stock_code)
+    indices = [i for i, p in enumerate(price_list) if p['涨幅'] >= threshold]
+    if not indices:
+        return None
+    runs = []
+    for i in indices:
+        if runs and i == runs[-1][-1] + 1:
+            runs[-1].append(i)
+        else:
+            runs.append([i])
+    max_streak = max(len(run) for run in runs)
+    max_streak = max_streak if max_streak >= 2 else 0
+    ref = [run for run in runs if len(run) >= 2][-1][-1] if max_streak else indices[-1]
+    return {'全部涨停天数': len(indices), '涨停数': len(runs), '单日涨停数': sum(1 for run in runs if len(run) == 1), '最大连续涨停数': max_streak, '离最新日期天数': len(price_list) - 1 - ref, '最后涨停日期': date_to_int(price_list[ref]['日期'])}
+
+def _run_ending_at(flags, end):
+    count = 0
+    for i in range(end, -1, -1):
+        if not flags[i]:
+            break
+        count += 1
+    return count
+
+def _reference_trend(price_list):
+    closes = [p['收盘价'] for p in price_list]
+    rising = [False] + [closes[i] > closes[i - 1] for i in range(1, len(closes))]
+    positive = [p['涨幅'] > 0 for p in price_list]
+    n = len(price_list)
+    return {'上涨天数_最后': _run_ending_at(rising, n - 1) if n >= 1 else 0, '上涨天数_倒数第二': _run_ending_at(rising, n - 2) if n >= 2 else 0, '前N天阳天数': _run_ending_at(positive, n - 3) if n >= 3 else 0, '最后收盘价': closes[-1] if n >= 1 else math.nan, '倒数第二收盘价': closes[-2] if n >= 2 else math.nan}
+
+def test_limit_up_stats_match_reference():
+    history_data = _fixture()
+    matrix = HistoryMatrix(history_data)
+    for loose in (False, True):
+        stats = compute_limit_up_stats(matrix, matrix.limit_up_mask(matrix.loose_thresholds if loose else matrix.strict_thresholds))
+        for stock_code, hist_data in history_data.items():
+            i = matrix.index[stock_code]
+            expected = _reference_limit_up(stock_code, hist_data['历史价格列表'], loose)
+            actual = {key: int(values[i]) for key, values in stats.items()}
+            if expected is None:
+                assert actual['全部涨停天数'] == 0 and actual['离最新日期天数'] == -1 and actual['最后涨停日期'] == 0, stock_code
+            else:
+                assert actual == expected, (stock_code, loose)
+
+def test_limit_up_stats_concept_dates():
+    history_data = _fixture()
+    matrix = HistoryMatrix(history_data)
+    concept_dates = set(DATES[-6:])
+    stats = compute_limit_up_stats(matrix, matrix.limit_up_mask(matrix.loose_thresholds, concept_dates))
+    for stock_code, hist_data in history_data.items():
+        price_list = hist_data['历史价格列表']
+        expected = sum(1 for p in price_list if p['日期'] in concept_dates and p['涨幅'] >= 9.8)
+        assert int(stats['全部涨停天数'][matrix.index[stock_code]]) == expected, stock_code
+
+def test_trend_stats_match_reference():
+    history_data = _fixture()
+    matrix = HistoryMatrix(history_data)
+    trend = compute_trend_stats(matrix)
+    for stock_code, hist_data in history_data.items():
+        i = matrix.index[stock_code]
+        expected = _reference_trend(hist_data['历史价格列表'])
+        for key, value in expected.items():
+            actual = float(trend[key][i])
+            if math.isnan(value):
+                assert math.isnan(actual), (stock_code, key)
+            else:
+                assert actual == value, (stock_code, key)
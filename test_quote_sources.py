@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""实时行情解析、对冲和故障切换的检查（不联网，用假的 session）
+
+运行: python -m pytest -q test_quote_sources.py
+"""
+import asyncio
+import json
+import time
+import pytest
+from urllib.parse import urlsplit
+import adaptive_limiter
+from quote_sources import EastmoneyQuoteSource, Quote, QuoteRouter, TencentQuoteSource, parse_quote_number, parse_quote_response, quotes_to_dict
+
+def _tencent_line(prefix_code, name, price, change, turnover, float_cap, high, low):
+    parts = ['1'] + [''] * 49
+    parts[1] = name
+    parts[2] = prefix_code[2:]
+    parts[3] = price
+    parts[32] = change
+    parts[33] = high
+    parts[34] = low
+    parts[38] = turnover
+    parts[44] = float_cap
+    return f'v_{prefix_code}="' + '~'.join(parts) + '";'
+
+def test_parse_quote_response_reads_fields_and_skips_invalid_lines():
+    content = '\n'.join([_tencent_line('sh600000', '浦发银行', '10.52', '1.25', '0.31', '3087.65', '10.60', '10.30'), 'v_pv_none_match="1";', 'v_sz000001="1~平安银行~000001";', '', 'garbage', _tencent_line('sz300750', '宁德时代', '250.00', '-2.5', '', '9876.5', '256.1', '248')])
+    results = parse_quote_response(content)
+    assert [result['code'] for result in results] == ['sh600000', 'sz300750']
+    assert results[0]['data'] == Quote('浦发银行', 10.52, 1.25, 0.31, 3087.65, 10.6, 10.3)
+    # 空字段记为0
+    assert results[1]['data'] == Quote('宁德时代', 250.0, -2.5, 0.0, 9876.5, 256.1, 248.0)
+
+def test_parse_quote_number():
+    assert parse_quote_number('3.5') == 3.5
+    assert parse_quote_number('') == 0.0
+    assert parse_quote_number(None) == 0.0
+    assert parse_quote_number('-') == 0.0
+
+def test_quote_to_dict_formats_two_decimals():
+    quotes = {'sh600000': Quote('浦发银行', 10.5, 1.256, 0.3, 3087.654, 10.6, 10.3)}
+    assert quotes_to_dict(quotes) == {'sh600000': {'现价': '10.50', '涨幅': '1.26', '换手率': '0.30', '流通市值': '3087.65', '名称': '浦发银行', '今日最高价': '10.60', '今日最低价': '10.30'}}
+    assert Quote('a', 1, 2, 3, 4, 5, 6) != Quote('a', 1, 2, 3, 4, 5, 7)
+
+def test_eastmoney_parse_matches_tencent_units():
+    content = 'jQuery1(' + json.dumps({'rc': 0, 'data': {'diff': [{'f2': 10.52, 'f3': 1.25, 'f8': 0.31, 'f12': '600000', 'f13': 1, 'f14': '浦发银行', 'f15': 10.6, 'f16': 10.3, 'f21': 308765000000}, {'f2': '-', 'f3': '-', 'f8': '-', 'f12': '000001', 'f13': 0, 'f14': '平安银行', 'f15': '-', 'f16': '-', 'f21': '-'}]}}) + ');'
+    results = EastmoneyQuoteSource().parse(content)
+    assert [result['code'] for result in results] == ['sh600000', 'sz000001']
+    assert results[0]['data'] == Quote('浦发银行', 10.52, 1.25, 0.31, 3087.65, 10.6, 10.3)
+    assert results[1]['data'].price == 0.0
+    assert EastmoneyQuoteSource().parse(json.dumps({'rc': 0, 'data': None})) == []
+
+@pytest.fixture(autouse=True)
+def _fresh_limiters(monkeypatch):
+    """每个用例用新的主机限流器，熔断状态不带到下一个用例"""
+    monkeypatch.setattr(adaptive_limiter, '_limiters', {})
+
+class _Source(TencentQuoteSource):
+
+    def __init__(self, name):
+        self.name = name
+        self.base_url = f'http://{name}.local/q='
+
+class _Response:
+
+    def __init__(self, text, delay, status):
+        self._text = text
+        self._delay = delay
+        self.status = status
+
+    async def __aenter__(self):
+        await asyncio.sleep(self._delay)
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise RuntimeError(f'HTTP {self.status}')
+
+    async def text(self):
+        return self._text
+
+class _Session:
+    """按主机设置延迟和状态码，返回腾讯格式的行情，名称是主机名"""
+
+    def __init__(self, delays=None, statuses=None, empty=()):
+        self.delays = delays or {}
+        self.statuses = statuses or {}
+        self.empty = set(empty)
+        self.hosts = []
+
+    def get(self, url, timeout=None):
+        parts = urlsplit(url)
+        host = parts.hostname.split('.')[0]
+        self.hosts.append(host)
+        prefix_codes = url.split('q=', 1)[1].split(',')
+        lines = ['v_pv_none_match="1";' if host in self.empty else _tencent_line(prefix_code, host, '10', '1', '1', '1', '10', '9') for prefix_code in prefix_codes]
+        return _Response('\n'.join(lines), self.delays.get(host, 0), self.statuses.get(host, 200))
+
+def _router(**kwargs):
+    return QuoteRouter([_Source('primary'), _Source('backup')], hedge_min_delay=0.05, hedge_default_delay=0.05, **kwargs)
+
+def _fetch(router, session, codes=('sh600000',)):
+    return asyncio.run(router.fetch(session, list(codes)))
+
+def test_fast_primary_is_not_hedged():
+    router = _router()
+    session = _Session()
+    results = _fetch(router, session)
+    assert results[0]['data'].name == 'primary'
+    assert session.hosts == ['primary']
+    assert router.hedged == 0
+
+def test_slow_primary_is_hedged_to_backup():
+    router = _router()
+    session = _Session(delays={'primary': 1.0})
+    start = time.monotonic()
+    results = _fetch(router, session)
+    assert time.monotonic() - start < 0.5
+    assert results[0]['data'].name == 'backup'
+    assert session.hosts == ['primary', 'backup']
+    assert (router.hedged, router.hedge_wins) == (1, 1)
+
+def test_failed_primary_falls_back_immediately():
+    router = _router()
+    session = _Session(statuses={'primary': 503})
+    results = _fetch(router, session)
+    assert results[0]['data'].name == 'backup'
+    assert router.stats['primary'].failures == 1
+
+def test_all_sources_failing_raises():
+    router = _router()
+    session = _Session(statuses={'primary': 503, 'backup': 502})
+    with pytest.raises(RuntimeError):
+        _fetch(router, session)
+
+def test_empty_response_is_no_data_not_a_failure():
+    router = _router()
+    session = _Session(empty=['primary'])
+    assert _fetch(router, session) == []
+    assert session.hosts == ['primary']
+    assert router.stats['primary'].failures == 0
+
+def test_failover_prefers_backup_while_primary_is_degraded(monkeypatch):
+    monkeypatch.setitem(adaptive_limiter.DEFAULT_HOST_SETTINGS, 'primary.local', {'breaker_failures': 100})
+    router = _router(failover_error_rate=0.5, failover_cooldown=60)
+    session = _Session(statuses={'primary': 503})
+    for _ in range(10):
+        _fetch(router, session)
+    assert router.failovers == 1
+    assert router.ordered_sources()[0].name == 'backup'
+    assert _fetch(router, _Session())[0]['data'].name == 'backup'
+    assert router.status()['首选来源'] == 'backup'
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""列式查询和页面筛选的对照检查
+
+页面里的 filterStocksLocally 从 index.html 里取出来用 node 执行（没有安装node时跳过），
+同一份数据、同样的筛选条件和排序，结果要和 StockTable.query 完全一致。
+运行: python -m pytest -q test_stock_query.py
+"""
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import numpy as np
+import pytest
+import stock_query
+
+INDEX_HTML = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'index.html')
+# 复选框和它的输入框，输入框的候选值（包括空串和非法值，走页面的默认值）
+FILTER_CHOICES = [('upCheck', 'upTo', ['0', '2', '', '-1.5']), ('todayHighCheck', None, None), ('highCountCheck', 'highCount', ['0', '1', '']), ('lowCheck', None, None), ('lowCountCheck', 'lowCount', ['0', '2']), ('everUpCheck', 'everUp', ['0', '3', '']), ('break30Check', 'break30', ['90', '100', '']), ('break30CountCheck', 'break30Count', ['0', '1']), ('break60Check', None, None), ('limitUpGte2Check', 'limitUpGte2', ['1', '2', '3', '']), ('limitUp2Check', 'limitUp2', ['1', '2', '3']), ('sunDayCheck', 'sunDay', ['0', '1', '2', '']), ('totalLimitUpCheck', 'totalLimitUp', ['0', '1', '2']), ('yesterdayNegativeCheck', None, None), ('prevDaysPositiveCheck', 'prevDaysPositive', ['1', '3', ''])]
+SORTS = [None, {'column': '现价', 'direction': 'asc'}, {'column': '现价', 'direction': 'desc'}, {'column': '阳天数', 'direction': 'desc'}, {'column': '名称', 'direction': 'asc'}, {'column': '名称', 'direction': 'desc'}]
+
+def _extract_function(source, name):
+    start = source.index(f'function {name}(')
+    depth = 0
+    for i in range(source.index('{', start), len(source)):
+        if source[i] == '{':
+            depth += 1
+        elif source[i] == '}':
+            depth -= 1
+            if depth == 0:
+                return source[start:i + 1]
+    raise ValueError(name)
+
+def _page_filter():
+    """(filterStocksLocally 的源码, {筛选条件键: (选择器, 'checked'/'value')})"""
+    with open(INDEX_HTML, 'r', encoding='utf-8') as f:
+        source = f.read()
+    block = _extract_function(source, 'fillStockTable')
+    selectors = {key: (selector, attribute) for key, selector, attribute in re.findall("(\\w+): document\\.querySelector\\('([^']+)'\\)\\.(checked|value)", block)}
+    return (_extract_function(source, 'filterStocksLocally'), selectors)
+
+def _random_data(seed):
+    rnd = random.Random(seed)
+    codes = list(dict.fromkeys((rnd.choice(['600', '000', '300', '688', '002']) + f'{rnd.randrange(1000):03d}' for _ in range(1500))))
+    merged = {}
+    for stock_code in codes:
+        merged[stock_code] = {'代码': stock_code, '名称': rnd.choice(['平安', '万科', '茅台', 'ST华']) + str(rnd.randrange(20)), '现价': f'{rnd.uniform(5, 12):.1f}', '涨幅': rnd.choice(['', f'{rnd.uniform(-5, 10):.2f}', -1.0, 3.2]), '今日最高价': rnd.choice(['', f'{rnd.uniform(5, 12):.1f}']), '今日最低价': rnd.choice(['', f'{rnd.uniform(5, 12):.1f}']), '阳天数': rnd.randrange(4), '前N天阳天数': rnd.randrange(5), '昨日涨幅': rnd.choice(['', -1.2, 0.5]), '30日最高价': rnd.choice(['', 0, round(rnd.uniform(5, 12), 2)]), '离涨停多少天_严格': rnd.choice(['无涨停', 0, 1, 3, 5, 10, 21, 30]), '离涨停多少天_宽松': rnd.choice(['无涨停', 2, 4, 8, 15]), '连续涨停数_严格': rnd.randrange(4), '连续涨停数_宽松': rnd.randrange(4), '全部涨停天数_严格': rnd.randrange(6), '全部涨停天数_宽松': rnd.randrange(6), '总涨停数_天数_严格': rnd.randrange(4), '总涨停数_天数_宽松': rnd.randrange(4)}
+    concept = {'10月30': [[stock_code, merged[stock_code]['名称'], 0, '概念A'] for stock_code in codes[:900]], '10月29': [[stock_code, merged[stock_code]['名称'], 0, '概念B'] for stock_code in codes[600:]]}
+    cases = []
+    for _ in range(300):
+        filters = {'preview': rnd.choice(['0', '3', '1', '']), 'back': rnd.choice(['21', '10', ''])}
+        for check, value, choices in FILTER_CHOICES:
+            filters[check] = rnd.random() < 0.3
+            if value:
+                filters[value] = rnd.choice(choices)
+        cases.append((filters, rnd.choice(SORTS)))
+    return (merged, concept, cases)
+
+NODE_SCRIPT = '''
+const input = JSON.parse(require('fs').readFileSync(0, 'utf8'));
+const window = {conceptData: input.concept, mergedData: input.merged};
+let elements = {};
+const document = {querySelector: selector => elements[selector]};
+let currentSort = {column: null, direction: null};
+%s
+const output = [];
+for (const [filters, sort] of input.cases) {
+    elements = {};
+    for (const [key, [selector, attribute]] of Object.entries(input.selectors)) {
+        elements[selector] = attribute === 'checked' ? {checked: !!filters[key]} : {value: filters[key] === undefined ? '' : filters[key]};
+    }
+    currentSort = sort || {column: null, direction: null};
+    output.push(filterStocksLocally().map(stock => stock.stockCode));
+}
+process.stdout.write(JSON.stringify(output));
+'''
+
+@pytest.mark.skipif(shutil.which('node') is None, reason='需要node执行页面的筛选函数')
+def test_query_matches_page_filter():
+    function_source, selectors = _page_filter()
+    assert set(selectors) >= {check for check, _, _ in FILTER_CHOICES} | {'preview', 'back'}
+    merged, concept, cases = _random_data(5)
+    payload = json.dumps({'merged': merged, 'concept': concept, 'cases': cases, 'selectors': selectors}, ensure_ascii=False)
+    completed = subprocess.run(['node', '-e', NODE_SCRIPT % function_source], input=payload.encode('utf-8'), capture_output=True, check=True)
+    expected = json.loads(completed.stdout.decode('utf-8'))
+    table = stock_query.StockTable(merged, concept)
+    for (filters, sort), expected_codes in zip(cases, expected):
+        result = table.query(filters, sort, 0)
+        assert [row['代码'] for row in result['股票']] == expected_codes, (filters, sort)
+        assert result['总数'] == len(expected_codes)
+
+def test_tracker_columns_fill_intraday_fields():
+    merged = {stock_code: {'代码': stock_code, '名称': stock_code, '现价': '10', '离涨停多少天_严格': 5, '离涨停多少天_宽松': 5} for stock_code in ('600001', '600002', '300003')}
+    concept = {'10月30': [[stock_code, stock_code, 0, '概念'] for stock_code in merged]}
+    tracker_columns = {'index': {'600002': 0, '600001': 1, '000009': 2}, 'initialized': np.array([True, False, True]), 'new_high_count': np.array([3, 7, 1], dtype=np.int32), 'new_low_count': np.array([1, 0, 0], dtype=np.int32), 'max_change': np.array([5.123, 9.0, 1.0]), 'break_30d_count': np.array([2, 0, 0], dtype=np.int32), 'above_60d': np.array([True, True, False])}
+    table = stock_query.StockTable(merged, concept, tracker_columns)
+    result = table.query({'highCountCheck': True, 'highCount': '1'})
+    # 600001 的槽位还没初始化，按0处理
+    assert [row['代码'] for row in result['股票']] == ['600002']
+    assert result['股票'][0]['今天创新高次数'] == 3
+    assert result['股票'][0]['曾经最高涨幅'] == 5.12
+    assert result['股票'][0]['已突破60日新高'] is True
+    assert table.query({'break60Check': True})['总数'] == 1
+    assert 'today' not in merged['600002'] and '今天创新高次数' not in merged['600002']
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""行情录制文件的写入、断点续写和读取检查
+
+运行: python -m pytest -q test_tick_recorder.py
+"""
+import os
+from datetime import datetime
+from quote_sources import Quote
+from tick_recorder import FRAME, FRAME_TICK, RECORD_DTYPE, TickReader, TickRecorder, get_tick_file_path
+
+def _quotes(step):
+    quotes = {'sh600001': Quote('浦发银行', 10.0 + step * 0.01, 0.5 + step * 0.1, 1.25, 3000.5, 10.2, 9.8), 'sz000002': Quote('万科A', 8.123, -1.0, 0.75, 900.0, 8.3, 8.0)}
+    if step >= 1:
+        quotes['sz300003'] = Quote('新股', 20.0, 20.0, 35.5, 12.345, 20.0, 16.0)
+    if step >= 2:
+        # 退出订阅，名称变化
+        del quotes['sz000002']
+        quotes['sh600001'] = Quote('ST浦发', *quotes['sh600001'].as_tuple()[1:])
+    return quotes
+
+def test_tick_recorder_round_trip_with_truncated_frame(tmp_path):
+    start = datetime(2025, 10, 20, 9, 30).timestamp()
+    recorded = []
+    recorder = TickRecorder(folder=str(tmp_path))
+    for step in range(4):
+        quotes = _quotes(step)
+        recorder.record(quotes, start + step * 3)
+        recorded.append((start + step * 3, quotes))
+    recorder.close()
+    file_path = get_tick_file_path('20251020', str(tmp_path))
+    with TickReader(file_path) as reader:
+        assert list(reader.ticks()) == recorded
+        complete_size = reader.valid_size
+    assert os.path.getsize(file_path) == complete_size
+    # 模拟写到一半退出：帧头说有3条，后面只有1条半
+    with open(file_path, 'ab') as f:
+        f.write(FRAME.pack(FRAME_TICK, 3, start + 12))
+        f.write(b'\x01' * (RECORD_DTYPE.itemsize * 3 // 2))
+    with TickReader(file_path) as reader:
+        assert reader.valid_size == complete_size
+        assert list(reader.ticks()) == recorded
+    # 重启后续写：截掉写了一半的帧，接着上次的状态只写变化的股票
+    recorder = TickRecorder(folder=str(tmp_path))
+    quotes = _quotes(4)
+    assert recorder.record(quotes, start + 15) == 1
+    recorder.close()
+    recorded.append((start + 15, quotes))
+    with TickReader(file_path) as reader:
+        assert list(reader.ticks()) == recorded
+        assert list(reader.ticks(start=start + 6, end=start + 9)) == recorded[2:4]
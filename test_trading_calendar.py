@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""交易日历和盘中交易状态的检查（用2025年的节假日表，国庆 10-01 到 10-08 休市）
+
+运行: python -m pytest -q test_trading_calendar.py
+"""
+from datetime import date, datetime
+import pytest
+from trading_calendar import HOLIDAYS, SESSION_AFTER_CLOSE, SESSION_CLOSED, SESSION_LUNCH, SESSION_OPEN, SESSION_PRE_OPEN, TradingCalendar, concept_date_to_iso, holiday_dates, load_extra_holidays
+
+@pytest.fixture
+def calendar():
+    return TradingCalendar(holiday_dates({2025: HOLIDAYS[2025]}))
+
+@pytest.mark.parametrize('now, state', [(datetime(2025, 10, 9, 9, 14, 59), SESSION_PRE_OPEN), (datetime(2025, 10, 9, 9, 15), SESSION_OPEN), (datetime(2025, 10, 9, 11, 30, 59), SESSION_OPEN), (datetime(2025, 10, 9, 11, 31), SESSION_LUNCH), (datetime(2025, 10, 9, 13, 0), SESSION_OPEN), (datetime(2025, 10, 9, 15, 0, 30), SESSION_OPEN), (datetime(2025, 10, 9, 15, 1), SESSION_AFTER_CLOSE), (datetime(2025, 10, 3, 10, 0), SESSION_CLOSED), (datetime(2025, 10, 11, 10, 0), SESSION_CLOSED)])
+def test_session_state(calendar, now, state):
+    assert calendar.session_state(now) == state
+
+def test_is_trading_time_includes_lunch(calendar):
+    assert calendar.is_trading_time(datetime(2025, 10, 9, 12, 0))
+    assert not calendar.is_trading_time(datetime(2025, 10, 9, 9, 0))
+    assert not calendar.is_trading_time(datetime(2025, 10, 11, 10, 0))
+
+def test_adjacent_trading_days_skip_holidays_and_weekends(calendar):
+    assert calendar.previous_trading_day(date(2025, 10, 9)) == date(2025, 9, 30)
+    assert calendar.next_trading_day(date(2025, 9, 30)) == date(2025, 10, 9)
+    assert calendar.next_trading_day(datetime(2025, 10, 10, 15, 30)) == date(2025, 10, 13)
+    assert calendar.trading_days_between(date(2025, 9, 30), date(2025, 10, 13)) == 3
+    assert calendar.trading_days_between(date(2025, 10, 13), date(2025, 9, 30)) == 0
+
+def test_dates_outside_the_table_extend_it(calendar):
+    assert calendar.previous_trading_day(date(2031, 1, 1)) == date(2030, 12, 31)
+    assert calendar.last >= date(2031, 1, 1)
+    assert calendar.is_trading_day(date(2018, 3, 5))
+    assert not calendar.is_trading_day(date(2018, 3, 4))
+
+def test_next_open(calendar):
+    assert calendar.next_open(datetime(2025, 10, 9, 8, 0)) == datetime(2025, 10, 9, 9, 15)
+    assert calendar.next_open(datetime(2025, 10, 9, 12, 0)) == datetime(2025, 10, 9, 13, 0)
+    assert calendar.next_open(datetime(2025, 10, 9, 10, 0)) == datetime(2025, 10, 10, 9, 15)
+    assert calendar.next_open(datetime(2025, 10, 10, 15, 30)) == datetime(2025, 10, 13, 9, 15)
+    assert calendar.next_open(datetime(2025, 9, 30, 16, 0)) == datetime(2025, 10, 9, 9, 15)
+
+def test_holiday_dates_and_extra_holidays(tmp_path):
+    dates = holiday_dates({2025: [('01-28', '02-04')]})
+    assert len(dates) == 8 and date(2025, 1, 31) in dates
+    file_path = tmp_path / '交易日历.txt'
+    file_path.write_text('# 2027年安排\n2027-01-01\n\n2027/01/02\n2027-02-10\n', encoding='utf-8')
+    assert load_extra_holidays(str(file_path)) == {date(2027, 1, 1), date(2027, 2, 10)}
+    assert load_extra_holidays(str(tmp_path / 'missing.txt')) == set()
+
+def test_concept_date_to_iso_across_year_boundary():
+    assert concept_date_to_iso('10月30', date(2026, 1, 5)) == '2025-10-30'
+    assert concept_date_to_iso('1月5', date(2026, 1, 5)) == '2026-01-05'
+    assert concept_date_to_iso('12月31', date(2025, 12, 31)) == '2025-12-31'
+    assert concept_date_to_iso('latest', date(2026, 1, 5)) is None
@@ -0,0 +1,541 @@
+# -*- coding: utf-8 -*-
+"""盘中行情录制和回放
+
+自动更新每拿到一份新的行情快照，就按天追加写入 行情录制/ticks-YYYYMMDD.bin；
+事后可以用 replay 把当天的行情按原来的节奏（或N倍速）再交给 check_breakthrough / merge_all_data，
+用来复现漏掉的提醒，也可以当作合并和突破跟踪的真实负载做性能测试。
+
+文件格式：64字节文件头，后面是一帧接一帧，只追加（程序中途退出最多丢掉最后半帧，读取时忽略）
+    帧头 FRAME：类型、条数、时间戳（秒）
+    FRAME_SYMBOLS 代码表帧：条数 × SYMBOL_DTYPE（编号、带前缀代码、名称），出现新股票或名称变化时写
+    FRAME_REMOVE  移除帧：  条数 × uint32 编号，股票退出订阅时写
+    FRAME_TICK    行情帧：  条数 × RECORD_DTYPE（编号、现价、涨幅、换手率、流通市值、最高、最低）
+行情帧只写和上一帧相比有变化的股票，回放时在上一帧的状态上叠加；
+数值乘以 VALUE_SCALE 存成int32（行情最多3位小数，整数除以1000得到的float和直接解析行情字符串完全一样，
+只有东方财富的流通市值会四舍五入到0.001亿）；写入和读取都用mmap映射文件，读取时每帧用 numpy.frombuffer 直接读
+"""
+import argparse
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from datetime import datetime, timedelta
+import numpy as np
+import compute_worker
+import get_xls_data
+import trading_calendar
+
+TICK_RECORDING_ENABLED = os.environ.get('THREE_SUN_RECORD_TICKS', '1') != '0'
+TICK_FOLDER_NAME = '行情录制'
+TICK_RETENTION_DAYS = 20
+DEFAULT_REPLAY_SPEED = 10.0
+MAGIC = b'TSTICK01'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<8sIi')
+HEADER_SIZE = 64
+FRAME = struct.Struct('<BxxxId')
+FRAME_SYMBOLS = 1
+FRAME_REMOVE = 2
+FRAME_TICK = 3
+VALUE_FIELDS = compute_worker.QUOTE_FIELDS
+VALUE_SCALE = 1000
+SYMBOL_DTYPE = np.dtype([('id', '<u4'), ('code', 'S8'), ('name', 'S24')])
+RECORD_DTYPE = np.dtype([('id', '<u4')] + [(field, '<i4') for field in VALUE_FIELDS])
+REMOVE_DTYPE = np.dtype('<u4')
+# 新编号的初始状态，和任何真实行情都不相等，保证股票第一次出现时整行写入
+EMPTY_VALUE = np.iinfo(np.int32).min
+_FRAME_DTYPES = {FRAME_SYMBOLS: SYMBOL_DTYPE, FRAME_REMOVE: REMOVE_DTYPE, FRAME_TICK: RECORD_DTYPE}
+
+def get_tick_folder():
+    """获取行情录制文件夹路径，如果不存在则创建"""
+    folder_path = get_xls_data.get_data_path(TICK_FOLDER_NAME)
+    if not os.path.exists(folder_path):
+        os.makedirs(folder_path)
+    return folder_path
+
+def get_tick_file_path(date_str, folder=None):
+    """某一天的行情录制文件路径
+    Args:
+        date_str: 日期 '20251030'
+    """
+    return os.path.join(folder or get_tick_folder(), f'ticks-{date_str}.bin')
+
+def list_tick_files(folder=None):
+    """已有的行情录制文件，按日期从早到晚排列"""
+    folder = folder or get_tick_folder()
+    names = sorted(name for name in os.listdir(folder) if name.startswith('ticks-') and name.endswith('.bin'))
+    return [os.path.join(folder, name) for name in names]
+
+def _encode_name(name):
+    # 截断时可能切在多字节字符中间，读取时用 errors='ignore' 丢掉半个字符
+    return name.encode('utf-8')[:SYMBOL_DTYPE['name'].itemsize]
+
+class _TickState:
+    """按编号排列的行情状态：带前缀代码、名称、缩放后的数值和是否在订阅中"""
+
+    def __init__(self):
+        self.codes = []
+        self.names = []
+        self.values = np.empty((0, len(VALUE_FIELDS)), dtype=np.int32)
+        self.present = np.zeros(0, dtype=bool)
+
+    def grow(self, size):
+        if size <= len(self.codes):
+            return
+        extra = size - len(self.codes)
+        self.codes.extend([''] * extra)
+        self.names.extend([''] * extra)
+        self.values = np.vstack([self.values, np.full((extra, len(VALUE_FIELDS)), EMPTY_VALUE, dtype=np.int32)])
+        self.present = np.concatenate([self.present, np.zeros(extra, dtype=bool)])
+
+    def apply(self, kind, rows):
+        """在状态上叠加一帧，返回这一帧涉及的编号数组"""
+        if kind == FRAME_SYMBOLS:
+            ids = rows['id'].astype(np.intp)
+            self.grow(int(ids.max()) + 1 if len(ids) else 0)
+            for sid, code, name in zip(ids.tolist(), rows['code'].tolist(), rows['name'].tolist()):
+                self.codes[sid] = code.decode('ascii')
+                self.names[sid] = name.decode('utf-8', errors='ignore')
+        elif kind == FRAME_REMOVE:
+            ids = rows.astype(np.intp)
+            self.present[ids] = False
+            self.values[ids] = EMPTY_VALUE
+        else:
+            ids = rows['id'].astype(np.intp)
+            self.present[ids] = True
+            for j, field in enumerate(VALUE_FIELDS):
+                self.values[ids, j] = rows[field]
+        return ids
+
+class TickReader:
+    """用mmap打开的行情录制文件
+
+    打开时只扫描一遍帧头，帧的内容在回放时才读；文件可以正在被录制（只读到打开时已经写完的帧）。
+    用完需要close()（或用with）
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._file = open(file_path, 'rb')
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f'行情录制文件为空: {file_path}')
+        if len(self._mmap) < HEADER_SIZE:
+            self.close()
+            raise ValueError(f'行情录制文件不完整: {file_path}')
+        magic, version, date_int = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self.close()
+            raise ValueError(f'不是可识别的行情录制文件: {file_path}')
+        self.date = f'{date_int // 10000:04d}-{date_int // 100 % 100:02d}-{date_int % 100:02d}'
+        self.frames = []
+        offset = HEADER_SIZE
+        size = len(self._mmap)
+        while offset + FRAME.size <= size:
+            kind, count, timestamp = FRAME.unpack_from(self._mmap, offset)
+            dtype = _FRAME_DTYPES.get(kind)
+            if dtype is None:
+                break
+            end = offset + FRAME.size + count * dtype.itemsize
+            if end > size:
+                break
+            self.frames.append((kind, count, timestamp, offset + FRAME.size))
+            offset = end
+        # 最后一个完整帧的结尾，续写时从这里截断，丢掉写了一半的帧
+        self.valid_size = offset
+        self.tick_times = [timestamp for kind, count, timestamp, _ in self.frames if kind == FRAME_TICK]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.tick_times)
+
+    def _rows(self, kind, count, offset):
+        return np.frombuffer(self._mmap, dtype=_FRAME_DTYPES[kind], count=count, offset=offset)
+
+    def load_state(self):
+        """把所有帧叠加起来，得到文件结尾时的状态（续写同一天的文件时用）"""
+        state = _TickState()
+        for kind, count, timestamp, offset in self.frames:
+            state.apply(kind, self._rows(kind, count, offset))
+        return state
+
+    def ticks(self, start=None, end=None):
+        """依次还原每个行情帧之后的完整行情
+
+        Args:
+            start: 只返回这个时间戳之后（含）的帧，之前的帧仍然会叠加到状态里
+            end: 只返回这个时间戳之前（含）的帧
+        Yields:
+            tuple: (时间戳, {带前缀代码: Quote})，每一帧都是新的字典，之前返回的不会被修改
+        """
+        from quote_sources import Quote
+        state = _TickState()
+        current = {}
+        for kind, count, timestamp, offset in self.frames:
+            if end is not None and kind == FRAME_TICK and timestamp > end:
+                break
+            ids = state.apply(kind, self._rows(kind, count, offset))
+            if kind == FRAME_REMOVE:
+                for sid in ids.tolist():
+                    current.pop(state.codes[sid], None)
+                continue
+            if kind == FRAME_SYMBOLS:
+                # 名称变了但这一轮数值没变的股票也要换成新名称
+                for sid in ids.tolist():
+                    quote = current.get(state.codes[sid])
+                    if quote is not None:
+                        current[state.codes[sid]] = Quote(state.names[sid], *quote.as_tuple()[1:])
+                continue
+            values = (state.values[ids] / VALUE_SCALE).tolist()
+            for sid, row in zip(ids.tolist(), values):
+                current[state.codes[sid]] = Quote(state.names[sid], *row)
+            if start is None or timestamp >= start:
+                yield (timestamp, dict(current))
+
+    def info(self):
+        """文件概况：日期、帧数、股票数、时间范围、平均每帧写入的股票数"""
+        records = sum(count for kind, count, _, _ in self.frames if kind == FRAME_TICK)
+        symbols = sum(count for kind, count, _, _ in self.frames if kind == FRAME_SYMBOLS)
+        first = datetime.fromtimestamp(self.tick_times[0]).strftime('%H:%M:%S') if self.tick_times else ''
+        last = datetime.fromtimestamp(self.tick_times[-1]).strftime('%H:%M:%S') if self.tick_times else ''
+        return {'日期': self.date, '行情帧数': len(self.tick_times), '股票数': symbols, '开始时间': first, '结束时间': last, '平均每帧变化股票数': round(records / len(self.tick_times), 1) if self.tick_times else 0, '文件KB': self.valid_size // 1024}
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+class TickRecorder:
+    """按天追加写入行情帧
+
+    每天一个文件，跨天时自动换文件并清理 retention_days 天以前的录制；
+    程序重启后打开当天已有的文件时，先读出代码表和最后的状态再接着写。
+    写入也用mmap：文件按 GROW_BYTES 预先加长，帧直接拷进映射，先写内容后写帧头，
+    没写完的帧前面是全0（类型0），读取时就停在那里；关闭时把文件截到实际长度。
+    写文件出错时当天不再录制，跨天后重试
+    """
+    GROW_BYTES = 4 * 1024 * 1024
+
+    def __init__(self, folder=None, retention_days=TICK_RETENTION_DAYS):
+        self.folder = folder
+        self.retention_days = retention_days
+        self._lock = threading.Lock()
+        self._file = None
+        self._mmap = None
+        self._size = 0
+        self._date = None
+        self._failed_date = None
+        self._state = None
+        self._ids = {}
+        self._table = None
+        self._table_ids = None
+        self.frames = 0
+        self.records = 0
+        self.bytes_written = 0
+        self.failures = 0
+
+    def _open_for(self, date_str):
+        if date_str == self._date:
+            return
+        self._close_file()
+        folder = self.folder or get_tick_folder()
+        file_path = get_tick_file_path(date_str, folder)
+        state = _TickState()
+        valid_size = 0
+        if os.path.exists(file_path):
+            try:
+                with TickReader(file_path) as reader:
+                    state = reader.load_state()
+                    valid_size = reader.valid_size
+            except ValueError as e:
+                print(f'行情录制文件无法续写，重新开始: {e}')
+        f = open(file_path, 'r+b' if valid_size else 'w+b')
+        self._file = f
+        if valid_size:
+            # 去掉上次没写完的帧和预留的空白
+            f.truncate(valid_size)
+            self._size = valid_size
+        else:
+            self._size = 0
+            self._write(HEADER.pack(MAGIC, FORMAT_VERSION, int(date_str)).ljust(HEADER_SIZE, b'\x00'))
+        self._date = date_str
+        self._state = state
+        self._ids = {code: sid for sid, code in enumerate(state.codes)}
+        self._table = None
+        self._table_ids = None
+        self._remove_expired(folder, date_str)
+
+    def _reserve(self, size):
+        """保证映射至少有 size 字节，不够时加长文件并重新映射"""
+        if self._mmap is not None and len(self._mmap) >= size:
+            return
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        capacity = (size // self.GROW_BYTES + 1) * self.GROW_BYTES
+        self._file.truncate(capacity)
+        self._mmap = mmap.mmap(self._file.fileno(), capacity)
+
+    def _write(self, data, header=b''):
+        """在已写内容后面追加：先拷 data 到帧头之后，再写帧头，帧头写好之前读取方看到的还是类型0"""
+        offset = self._size
+        end = offset + len(header) + len(data)
+        self._reserve(end)
+        self._mmap[offset + len(header):end] = data
+        if header:
+            self._mmap[offset:offset + len(header)] = header
+        self._size = end
+
+    def _remove_expired(self, folder, date_str):
+        oldest = (datetime.strptime(date_str, '%Y%m%d') - timedelta(days=self.retention_days)).strftime('%Y%m%d')
+        for file_path in list_tick_files(folder):
+            if os.path.basename(file_path)[6:14] < oldest:
+                try:
+                    os.remove(file_path)
+                except OSError:
+                    pass
+
+    def record(self, real_time_data, timestamp=None):
+        """追加一帧行情，只写和上一帧相比有变化的股票
+        Args:
+            real_time_data: {带前缀代码: Quote}
+            timestamp: 行情时间（秒），默认当前时间
+        Returns:
+            int: 这一帧写入的股票条数（当天写文件出错过时为0）
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        date_str = datetime.fromtimestamp(timestamp).strftime('%Y%m%d')
+        with self._lock:
+            if date_str == self._failed_date:
+                return 0
+            try:
+                self._open_for(date_str)
+                return self._record_frame(real_time_data, timestamp)
+            except OSError as e:
+                self.failures += 1
+                self._failed_date = date_str
+                print(f'行情录制失败，今天不再录制: {e}')
+                try:
+                    self._close_file()
+                except OSError:
+                    self._file = self._mmap = self._date = None
+                return 0
+
+    def _record_frame(self, real_time_data, timestamp):
+        state = self._state
+        table, payload = compute_worker.encode_quotes(real_time_data)
+        if table != self._table:
+            symbols, removed = self._update_table(table)
+            if symbols:
+                rows = np.array(symbols, dtype=SYMBOL_DTYPE)
+                self._write(rows.tobytes(), FRAME.pack(FRAME_SYMBOLS, len(rows), timestamp))
+            if len(removed):
+                self._write(removed.astype(REMOVE_DTYPE).tobytes(), FRAME.pack(FRAME_REMOVE, len(removed), timestamp))
+        ids = self._table_ids
+        values = np.frombuffer(payload, dtype=np.float64).reshape(len(ids), len(VALUE_FIELDS))
+        scaled = np.clip(np.rint(values * VALUE_SCALE), EMPTY_VALUE + 1, np.iinfo(np.int32).max).astype(np.int32)
+        changed = (state.values[ids] != scaled).any(axis=1)
+        changed_ids = ids[changed]
+        rows = np.empty(len(changed_ids), dtype=RECORD_DTYPE)
+        rows['id'] = changed_ids
+        for j, field in enumerate(VALUE_FIELDS):
+            rows[field] = scaled[changed, j]
+        state.apply(FRAME_TICK, rows)
+        start = self._size
+        self._write(rows.tobytes(), FRAME.pack(FRAME_TICK, len(rows), timestamp))
+        self.frames += 1
+        self.records += len(rows)
+        self.bytes_written += self._size - start
+        return len(rows)
+
+    def _update_table(self, table):
+        """股票列表或名称变了：给新股票分配编号，找出名称变化和退出订阅的股票
+        Returns:
+            tuple: ([代码表帧的行], 退出订阅的编号数组)
+        """
+        state = self._state
+        for prefix_code, name in table:
+            if prefix_code not in self._ids:
+                self._ids[prefix_code] = len(self._ids)
+        state.grow(len(self._ids))
+        ids = np.fromiter((self._ids[prefix_code] for prefix_code, name in table), dtype=np.intp, count=len(table))
+        symbols = []
+        for sid, (prefix_code, name) in zip(ids.tolist(), table):
+            if state.codes[sid] != prefix_code or state.names[sid] != name:
+                state.codes[sid] = prefix_code
+                state.names[sid] = name
+                symbols.append((sid, prefix_code.encode('ascii'), _encode_name(name)))
+        subscribed = np.zeros(len(state.present), dtype=bool)
+        subscribed[ids] = True
+        removed = np.flatnonzero(state.present & ~subscribed)
+        state.apply(FRAME_REMOVE, removed)
+        self._table = table
+        self._table_ids = ids
+        return (symbols, removed)
+
+    def _close_file(self):
+        if self._mmap is not None:
+            self._mmap.flush()
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            # 去掉预留的空白；别的进程正映射着文件时（Windows）截不了，留着也能正常读取和续写
+            try:
+                self._file.truncate(self._size)
+            except OSError:
+                pass
+            self._file.close()
+            self._file = None
+        self._date = None
+
+    def close(self):
+        with self._lock:
+            self._close_file()
+
+    def status(self):
+        return {'日期': self._date or '', '帧数': self.frames, '写入股票条数': self.records, '写入KB': self.bytes_written // 1024, '写入失败次数': self.failures, '停止录制的日期': self._failed_date or ''}
+
+class SimulatedClock:
+    """回放用的模拟时钟，时间跟着录制的帧走；now() 可以直接赋给 Api.clock"""
+
+    def __init__(self, timestamp=0.0):
+        self.timestamp = timestamp
+
+    def now(self):
+        return datetime.fromtimestamp(self.timestamp)
+
+def _parse_clock_time(date, text):
+    """'09:30:00' -> 录制当天这个时刻的时间戳，空值返回None"""
+    if not text:
+        return None
+    return datetime.strptime(f'{date} {text}', '%Y-%m-%d %H:%M:%S').timestamp()
+
+def replay(api, file_path, speed=DEFAULT_REPLAY_SPEED, min_days=3, max_days=21, start=None, end=None, on_tick=None):
+    """把录制的行情按时间顺序交给 api.check_breakthrough / merge_all_data
+
+    回放期间 api.clock 换成模拟时钟，是否交易时间、突破事件的时间都按录制的时间算；
+    调用前要停掉自动更新，并准备好 api.history_data 和 industry_data
+
+    Args:
+        api: main.Api
+        file_path: 行情录制文件
+        speed: 回放倍速，按录制时相邻两帧的间隔除以倍速等待；0表示不等待，尽快回放
+        min_days, max_days: 传给 merge_all_data
+        start, end: 只回放这段时间 'HH:MM:SS'
+        on_tick: 每帧合并并发布快照后调用 on_tick(时间戳, 快照)
+    Returns:
+        dict: {'帧数', '股票数', '事件数', '用时秒', '突破跟踪平均毫秒', '合并平均毫秒', '最慢一帧毫秒', '最慢一帧时间'}
+    """
+    clock = SimulatedClock()
+    previous_clock = api.clock
+    api.clock = clock.now
+    check_seconds = []
+    merge_seconds = []
+    event_count = 0
+    slowest = (0.0, None)
+    wall_start = time.perf_counter()
+    first_timestamp = None
+    try:
+        with TickReader(file_path) as reader:
+            for timestamp, quotes in reader.ticks(_parse_clock_time(reader.date, start), _parse_clock_time(reader.date, end)):
+                if first_timestamp is None:
+                    first_timestamp = timestamp
+                if speed > 0:
+                    delay = (timestamp - first_timestamp) / speed - (time.perf_counter() - wall_start)
+                    if delay > 0:
+                        time.sleep(delay)
+                with api._update_lock:
+                    clock.timestamp = timestamp
+                    api.real_time_data = quotes
+                    api.last_update_time = clock.now().strftime('%H:%M:%S')
+                    t0 = time.perf_counter()
+                    event_count += api.check_breakthrough()
+                    t1 = time.perf_counter()
+                    api.merge_all_data(min_days=min_days, max_days=max_days)
+                    snapshot = api._publish_snapshot()
+                    t2 = time.perf_counter()
+                check_seconds.append(t1 - t0)
+                merge_seconds.append(t2 - t1)
+                if t2 - t0 > slowest[0]:
+                    slowest = (t2 - t0, timestamp)
+                if on_tick is not None:
+                    on_tick(timestamp, snapshot)
+    finally:
+        api.clock = previous_clock
+    frames = len(check_seconds)
+    return {'帧数': frames, '股票数': len(api.real_time_data), '事件数': event_count, '用时秒': round(time.perf_counter() - wall_start, 3), '突破跟踪平均毫秒': round(sum(check_seconds) / frames * 1000, 2) if frames else 0, '合并平均毫秒': round(sum(merge_seconds) / frames * 1000, 2) if frames else 0, '最慢一帧毫秒': round(slowest[0] * 1000, 2), '最慢一帧时间': datetime.fromtimestamp(slowest[1]).strftime('%H:%M:%S') if slowest[1] else ''}
+
+def load_replay_history(file_path):
+    """从历史数据仓库还原录制当天盘中的历史数据（只用录制日期之前的K线）"""
+    with TickReader(file_path) as reader:
+        date = reader.date
+        codes = set(reader.load_state().codes)
+        first = reader.tick_times[0] if reader.tick_times else None
+    stock_codes = [prefix_code[2:] for prefix_code in codes if prefix_code]
+    store = get_xls_data.load_history_store(stock_codes)
+    is_trading_time = trading_calendar.is_trading_time(datetime.fromtimestamp(first)) if first else None
+    history_data = {}
+    for stock_code, prices in store['股票'].items():
+        record = get_xls_data.build_history_record(stock_code, [p for p in prices if p['日期'] < date], is_trading_time)
+        if record:
+            history_data[stock_code] = record
+    return history_data
+
+def main():
+    parser = argparse.ArgumentParser(description='盘中行情录制文件的查看和回放')
+    parser.add_argument('command', choices=['list', 'info', 'replay'], help='list 列出录制文件，info 查看文件概况，replay 回放')
+    parser.add_argument('file', nargs='?', help='录制文件路径或日期（20251030），默认最近一天')
+    parser.add_argument('--speed', type=float, default=DEFAULT_REPLAY_SPEED, help='回放倍速，0表示尽快回放')
+    parser.add_argument('--start', help='从这个时间开始回放，如 09:30:00')
+    parser.add_argument('--end', help='回放到这个时间，如 10:00:00')
+    parser.add_argument('--preview', type=int, default=3, help='离涨停天数的最小值')
+    parser.add_argument('--back', type=int, default=21, help='离涨停天数的最大值')
+    parser.add_argument('--json', action='store_true', help='输出JSON')
+    args = parser.parse_args()
+    files = list_tick_files()
+    if args.command == 'list':
+        for file_path in files:
+            print(file_path)
+        return
+    if args.file and os.path.exists(args.file):
+        file_path = args.file
+    elif args.file:
+        file_path = get_tick_file_path(args.file)
+    elif files:
+        file_path = files[-1]
+    else:
+        parser.error('没有行情录制文件')
+    if not os.path.exists(file_path):
+        parser.error(f'行情录制文件不存在: {file_path}')
+    if args.command == 'info':
+        with TickReader(file_path) as reader:
+            result = reader.info()
+    else:
+        import contextlib
+        import main as app
+        api = app.Api()
+        try:
+            api._load_industry_data()
+        except OSError as e:
+            print(f'读取行业数据失败，行业列显示为 -: {e}')
+        api.history_data = load_replay_history(file_path)
+        with open(os.devnull, 'w', encoding='utf-8') as devnull, contextlib.redirect_stdout(devnull):
+            result = replay(api, file_path, args.speed, args.preview, args.back, args.start, args.end)
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        return
+    for key, value in result.items():
+        print(f'{key}: {value}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""A股交易日历
+
+周末和沪深交易所公布的节假日休市，节假日表见 HOLIDAYS；新一年的安排公布之前，
+可以在数据目录的 交易日历.txt 里每行写一个休市日期（2027-01-01，#开头的行忽略）补上。
+日历按天预先算好是否交易日、上一个/下一个交易日和累计交易日数，查询都是按下标直接取；
+盘中的交易状态（盘前、交易中、午间休市、收盘后、休市日）也只看日历和几个固定时刻
+"""
+import re
+import threading
+from datetime import date, datetime, time, timedelta
+
+# 交易所休市安排（含周末在内的整段假期，周末本来就不交易）
+HOLIDAYS = {
+    2024: [('01-01', '01-01'), ('02-09', '02-17'), ('04-04', '04-06'), ('05-01', '05-05'), ('06-10', '06-10'), ('09-15', '09-17'), ('10-01', '10-07')],
+    2025: [('01-01', '01-01'), ('01-28', '02-04'), ('04-04', '04-06'), ('05-01', '05-05'), ('05-31', '06-02'), ('10-01', '10-08')],
+    2026: [('01-01', '01-03'), ('02-15', '02-23'), ('04-04', '04-06'), ('05-01', '05-05'), ('06-19', '06-21'), ('09-25', '09-27'), ('10-01', '10-07')],
+}
+EXTRA_HOLIDAYS_FILENAME = '交易日历.txt'
+PRE_OPEN_CHECK_TIME = time(9, 14, 30)
+OPEN_TIME = time(9, 15)
+MORNING_CLOSE_TIME = time(11, 30)
+AFTERNOON_OPEN_TIME = time(13, 0)
+CLOSE_TIME = time(15, 0)
+# 自动更新在收盘后继续到这个时刻（不含），拿到收盘后的最终数据
+AFTER_CLOSE_UPDATE_END = time(16, 1)
+SESSION_CLOSED = '休市日'
+SESSION_PRE_OPEN = '盘前'
+SESSION_OPEN = '交易中'
+SESSION_LUNCH = '午间休市'
+SESSION_AFTER_CLOSE = '收盘后'
+
+def holiday_dates(holidays=HOLIDAYS):
+    """把 {年: [(开始'MM-DD', 结束'MM-DD')]} 展开成休市日期的集合"""
+    dates = set()
+    for year, ranges in holidays.items():
+        for start, end in ranges:
+            current = datetime.strptime(f'{year}-{start}', '%Y-%m-%d').date()
+            last = datetime.strptime(f'{year}-{end}', '%Y-%m-%d').date()
+            while current <= last:
+                dates.add(current)
+                current += timedelta(days=1)
+    return dates
+
+def load_extra_holidays(file_path):
+    """读取 交易日历.txt 里补充的休市日期，文件不存在返回空集合"""
+    dates = set()
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            lines = f.readlines()
+    except OSError:
+        return dates
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            dates.add(datetime.strptime(line, '%Y-%m-%d').date())
+        except ValueError:
+            print(f'交易日历: 忽略无法识别的日期 {line}')
+    return dates
+
+class _CalendarTable:
+    """一段日期范围的预算结果，建好后不再修改；范围扩大时整个换成新的一份"""
+    __slots__ = ('first', 'last', 'base', 'trading', 'previous', 'following', 'cumulative')
+
+    def __init__(self, first, last, holidays):
+        size = (last - first).days + 1
+        trading = [False] * size
+        current = first
+        for i in range(size):
+            trading[i] = current.weekday() < 5 and current not in holidays
+            current += timedelta(days=1)
+        previous = [-1] * size
+        cumulative = [0] * size
+        last_trading = -1
+        count = 0
+        for i in range(size):
+            # previous[i] 是 i 之前（不含）最近的交易日下标
+            previous[i] = last_trading
+            if trading[i]:
+                last_trading = i
+                count += 1
+            cumulative[i] = count
+        following = [size] * size
+        next_trading = size
+        for i in range(size - 1, -1, -1):
+            following[i] = next_trading
+            if trading[i]:
+                next_trading = i
+        self.first = first
+        self.last = last
+        self.base = first.toordinal()
+        self.trading = trading
+        self.previous = previous
+        self.following = following
+        self.cumulative = cumulative
+
+def _day_index(table, day):
+    if isinstance(day, datetime):
+        day = day.date()
+    return day.toordinal() - table.base
+
+class TradingCalendar:
+    """预先算好的交易日历
+
+    从节假日表最早一年的前一年到最晚一年（或今年）的后一年，每个自然日占一个下标；
+    查询超出这个范围的日期时把范围扩大后重算一次（范围外只按周末判断）。
+    预算结果放在一个只读的 _CalendarTable 里，扩大范围时加锁建好新的一份再整体替换，
+    每次查询只读一次 self._table，其他线程同时查询不会拿到新旧混在一起的下标和数组
+    """
+
+    def __init__(self, holidays=()):
+        self.holidays = frozenset(holidays)
+        self._lock = threading.Lock()
+        years = [d.year for d in self.holidays] + [date.today().year]
+        self._table = _CalendarTable(date(min(years) - 1, 1, 1), date(max(years) + 1, 12, 31), self.holidays)
+
+    @property
+    def first(self):
+        return self._table.first
+
+    @property
+    def last(self):
+        return self._table.last
+
+    def _extend(self, first, last):
+        """把范围扩大到至少包含 first 到 last，返回新的预算结果"""
+        with self._lock:
+            table = self._table
+            if table.first <= first and last <= table.last:
+                return table
+            table = _CalendarTable(min(table.first, first), max(table.last, last), self.holidays)
+            self._table = table
+            return table
+
+    def _lookup(self, *days):
+        """返回包含这些日期的预算结果和各日期在其中的下标"""
+        days = [day.date() if isinstance(day, datetime) else day for day in days]
+        table = self._table
+        if not all(table.first <= day <= table.last for day in days):
+            table = self._extend(date(min(days).year - 1, 1, 1), date(max(days).year + 1, 12, 31))
+        return (table, [_day_index(table, day) for day in days])
+
+    def is_trading_day(self, day):
+        table, (i,) = self._lookup(day)
+        return table.trading[i]
+
+    def previous_trading_day(self, day):
+        """day 之前（不含）最近的一个交易日"""
+        table, (i,) = self._lookup(day)
+        while table.previous[i] < 0:
+            table = self._extend(date(table.first.year - 1, 1, 1), table.last)
+            i = _day_index(table, day)
+        return date.fromordinal(table.base + table.previous[i])
+
+    def next_trading_day(self, day):
+        """day 之后（不含）最近的一个交易日"""
+        table, (i,) = self._lookup(day)
+        while table.following[i] >= len(table.trading):
+            table = self._extend(table.first, date(table.last.year + 1, 12, 31))
+            i = _day_index(table, day)
+        return date.fromordinal(table.base + table.following[i])
+
+    def trading_days_between(self, start, end):
+        """start（不含）到 end（含）之间的交易日数，end 不晚于 start 时为0"""
+        table, (i, j) = self._lookup(start, end)
+        if j <= i:
+            return 0
+        return table.cumulative[j] - table.cumulative[i]
+
+    def session_state(self, now):
+        """now 所处的交易状态：SESSION_CLOSED / PRE_OPEN / OPEN / LUNCH / AFTER_CLOSE"""
+        if not self.is_trading_day(now):
+            return SESSION_CLOSED
+        minute = now.time().replace(second=0, microsecond=0)
+        if minute < OPEN_TIME:
+            return SESSION_PRE_OPEN
+        if minute <= MORNING_CLOSE_TIME:
+            return SESSION_OPEN
+        if minute < AFTERNOON_OPEN_TIME:
+            return SESSION_LUNCH
+        if minute <= CLOSE_TIME:
+            return SESSION_OPEN
+        return SESSION_AFTER_CLOSE
+
+    def is_trading_time(self, now):
+        """交易日的9:15到15:00（含午间休市，这段时间历史数据仓库里最新的K线是昨天的）"""
+        return self.is_trading_day(now) and OPEN_TIME <= now.time().replace(second=0, microsecond=0) <= CLOSE_TIME
+
+    def next_open(self, now):
+        """now 之后下一次进入交易中的时刻（上午9:15或下午13:00）"""
+        state = self.session_state(now)
+        if state == SESSION_PRE_OPEN:
+            return datetime.combine(now.date(), OPEN_TIME)
+        if state == SESSION_LUNCH:
+            return datetime.combine(now.date(), AFTERNOON_OPEN_TIME)
+        return datetime.combine(self.next_trading_day(now), OPEN_TIME)
+
+_default_calendar = None
+_default_lock = threading.Lock()
+
+def get_calendar():
+    """默认日历：内置节假日表加上数据目录里 交易日历.txt 补充的日期，第一次调用时建立"""
+    global _default_calendar
+    if _default_calendar is None:
+        with _default_lock:
+            if _default_calendar is None:
+                from get_xls_data import get_data_path
+                _default_calendar = TradingCalendar(holiday_dates() | load_extra_holidays(get_data_path(EXTRA_HOLIDAYS_FILENAME)))
+    return _default_calendar
+
+def is_trading_day(day):
+    return get_calendar().is_trading_day(day)
+
+def previous_trading_day(day):
+    return get_calendar().previous_trading_day(day)
+
+def next_trading_day(day):
+    return get_calendar().next_trading_day(day)
+
+def trading_days_between(start, end):
+    return get_calendar().trading_days_between(start, end)
+
+def session_state(now=None):
+    return get_calendar().session_state(now or datetime.now())
+
+def is_trading_time(now=None):
+    return get_calendar().is_trading_time(now or datetime.now())
+
+def next_open(now=None):
+    return get_calendar().next_open(now or datetime.now())
+
+def concept_date_to_iso(label, today=None):
+    """股票数据文件的日期 '10月30' -> '2025-10-30'
+
+    文件名里没有年份，取 today（默认今天）当天或之前最近的那个日期，跨年时10月30会落在去年
+    Returns:
+        str: 'YYYY-MM-DD'，不是 'M月D' 格式时返回None
+    """
+    match = re.match('(\\d+)月(\\d+)', label)
+    if not match:
+        return None
+    month = int(match.group(1))
+    day = int(match.group(2))
+    today = today or date.today()
+    year = today.year if (month, day) <= (today.month, today.day) else today.year - 1
+    return f'{year:04d}-{month:02d}-{day:02d}'